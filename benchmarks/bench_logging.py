@@ -0,0 +1,72 @@
+"""
+End-to-end /llm throughput, in process, with request logging set to each
+LOG_MODE ("off", "sync", "batched") against a scratch SQLite database and the
+echo_args.sh stub executable.
+
+    python benchmarks/bench_logging.py --requests 500 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import httpx
+from gull_api import config, db
+import gull_api.main as gull_main
+from gull_api.schema import SchemaRegistry, get_schema
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAYLOAD = {"Prompt": "Once upon a time", "Maximum length": 16}
+
+
+async def run_mode(mode, args, tmpdir):
+    config.LOG_MODE = mode
+    config.DB_URI = f"sqlite:///{os.path.join(tmpdir, mode + '.db')}"
+    config.EXECUTABLE = os.path.join(ROOT, "echo_args.sh")
+    db.reset_default_session_maker()
+    config.MAX_CONCURRENCY = args.concurrency
+    config.MAX_QUEUE = args.requests
+    gull_main.admissions.clear()
+    # Every request has to run and be logged; nothing may be served from another's run.
+    gull_main.coalescer = None
+    gull_main.response_cache = None
+    registry = SchemaRegistry(path=args.cli_json)
+    gull_main.app.dependency_overrides[get_schema] = lambda: registry.get().default
+
+    await gull_main.app.router.startup()
+    try:
+        async with httpx.AsyncClient(app=gull_main.app, base_url="http://bench") as client:
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def one(i):
+                async with semaphore:
+                    response = await client.post("/llm", json=dict(PAYLOAD, Prompt=f"{PAYLOAD['Prompt']} {i}"))
+                    response.raise_for_status()
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(args.requests)))
+            elapsed = time.perf_counter() - start
+    finally:
+        await gull_main.app.router.shutdown()
+        gull_main.app.dependency_overrides.clear()
+    return args.requests / elapsed
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        return {mode: await run_mode(mode, args, tmpdir) for mode in args.modes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cli-json", default=os.path.join(ROOT, "example_cli.json"))
+    parser.add_argument("--requests", default=500, type=int)
+    parser.add_argument("--concurrency", default=8, type=int)
+    parser.add_argument("--modes", nargs="+", default=["off", "sync", "batched"])
+    args = parser.parse_args()
+    print(json.dumps({"req_per_s": asyncio.run(run(args))}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
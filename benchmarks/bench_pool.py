@@ -0,0 +1,60 @@
+"""
+Latency of one request through a fresh subprocess per call versus a warm
+WorkerPool, using the stub executors shipped in the repo.
+
+    python benchmarks/bench_pool.py --requests 200 --size 4 --load-delay 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from gull_api.pool import WorkerPool
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ARGV = ["-n", "128", "--prompt", "Once upon a time"]
+
+
+async def spawn_once(load_delay):
+    # Simulate the model load a real executable pays on every cold start.
+    command = ["sh", "-c", f'sleep {load_delay}; exec "$0" "$@"', os.path.join(ROOT, "echo_args.sh"), *ARGV]
+    process = await asyncio.create_subprocess_exec(*command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    await process.communicate()
+
+
+async def timed(fn, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await fn()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return requests / (time.perf_counter() - start)
+
+
+async def run(args):
+    results = {"spawn_req_per_s": await timed(lambda: spawn_once(args.load_delay), args.requests, args.size)}
+    pool = WorkerPool([sys.executable, os.path.join(ROOT, "echo_worker.py")], size=args.size, health_interval=0)
+    await pool.start()
+    try:
+        results["pool_req_per_s"] = await timed(lambda: pool.run(ARGV, timeout=60), args.requests, args.size)
+    finally:
+        await pool.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", default=200, type=int)
+    parser.add_argument("--size", default=4, type=int, help="Pool size and request concurrency")
+    parser.add_argument("--load-delay", default=0.0, type=float, help="Seconds of simulated model load per spawn")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
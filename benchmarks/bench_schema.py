@@ -0,0 +1,62 @@
+"""
+Per-request schema overhead: re-reading and recompiling cli.json (the old
+`Depends(load_cli_json)` path) versus using the precompiled registry schema.
+
+    python benchmarks/bench_schema.py --cli-json example_cli.json
+"""
+import argparse
+import json
+import timeit
+from gull_api.schema import (
+    SchemaRegistry, create_llm_request_model, convert_request_to_cli_command,
+    convert_cli_json_to_api_format,
+)
+
+REQUEST = {"Prompt": "Once upon a time", "Maximum length": 64, "Temperature": 0.5}
+
+
+def uncompiled_llm(path):
+    with open(path, "r") as f:
+        cli_json = json.load(f)
+    validated = create_llm_request_model(cli_json)(**REQUEST)
+    return convert_request_to_cli_command(validated, cli_json)
+
+
+def uncompiled_api(path):
+    with open(path, "r") as f:
+        cli_json = json.load(f)
+    return convert_cli_json_to_api_format(cli_json)
+
+
+def compiled_llm(registry):
+    schema = registry.get().default
+    return schema.build_command(schema.validate(REQUEST))
+
+
+def compiled_api(registry):
+    return registry.get().default.api_json
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cli-json", default="example_cli.json")
+    parser.add_argument("--number", default=2000, type=int)
+    args = parser.parse_args()
+
+    registry = SchemaRegistry(path=args.cli_json)
+    registry.get()
+    cases = {
+        "llm_uncompiled": lambda: uncompiled_llm(args.cli_json),
+        "llm_compiled": lambda: compiled_llm(registry),
+        "api_uncompiled": lambda: uncompiled_api(args.cli_json),
+        "api_compiled": lambda: compiled_api(registry),
+    }
+    results = {}
+    for name, fn in cases.items():
+        best = min(timeit.repeat(fn, number=args.number, repeat=3))
+        results[name] = best / args.number * 1e6
+    print(json.dumps({"us_per_request": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
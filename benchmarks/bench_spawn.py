@@ -0,0 +1,83 @@
+"""
+Cost of starting an executor process as the server's heap grows, for
+asyncio's create_subprocess_exec, a plain fork+exec and posix_spawn.
+
+    python benchmarks/bench_spawn.py --sizes 0 512 2048 --runs 200
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+METHODS = ("asyncio", "fork", "posix_spawn")
+COMMAND = ["true"]
+
+
+async def start(method):
+    if method == "posix_spawn":
+        from gull_api.spawner import posix_spawn_exec
+        return await posix_spawn_exec(COMMAND)
+    # A preexec_fn makes subprocess fall back from vfork to fork, as
+    # Python < 3.10 and uvloop always do.
+    preexec_fn = (lambda: None) if method == "fork" else None
+    return await asyncio.create_subprocess_exec(
+        *COMMAND, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True, preexec_fn=preexec_fn
+    )
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return {
+        "median_ms": round(statistics.median(samples) * 1000, 3),
+        "p99_ms": round(samples[int(len(samples) * 0.99) - 1] * 1000, 3),
+    }
+
+
+async def measure(runs):
+    results = {}
+    for method in METHODS:
+        spawn, total = [], []
+        for _ in range(runs):
+            started = time.perf_counter()
+            process = await start(method)
+            spawn.append(time.perf_counter() - started)
+            await asyncio.gather(process.stdout.read(), process.stderr.read())
+            await process.wait()
+            total.append(time.perf_counter() - started)
+        results[method] = {"spawn": summary(spawn), "spawn_and_exit": summary(total)}
+    return results
+
+
+def child(size_mb, runs):
+    # Touch every page so the heap is resident, as loaded state in a server would be.
+    ballast = bytearray(size_mb << 20)
+    for i in range(0, len(ballast), 4096):
+        ballast[i] = 1
+    print(json.dumps(asyncio.run(measure(runs))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default=[0, 512, 2048], type=int, nargs="+", help="Parent heap sizes in MB")
+    parser.add_argument("--runs", default=200, type=int)
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child is not None:
+        child(args.child, args.runs)
+        return
+    results = {}
+    for size in args.sizes:
+        # A fresh interpreter per size so earlier ballast doesn't linger.
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", str(size), "--runs", str(args.runs)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        results[f"{size}MB"] = json.loads(output)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Request logging throughput into one SQLite file as the number of server
+processes grows, for each way of writing it:
+
+  default  every process commits its own records, stock SQLite settings
+  wal      every process commits its own records, with WAL, busy timeout and
+           synchronous=NORMAL (what get_engine() now sets up)
+  socket   every process sends its records to one log writer process
+           (LOG_MODE=socket), which writes them in batched transactions
+
+Each process logs --records records, committing one at a time in the
+direct modes, like LOG_MODE=sync, and counts "database is locked" failures.
+
+    python benchmarks/bench_sqlite_workers.py --workers 1 2 4 8 --records 500
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+from sqlalchemy.exc import OperationalError
+from gull_api import config, db
+from gull_api.logserver import LogServer, SocketLogWriter
+
+PROMPT = json.dumps({"Prompt": "Once upon a time", "Maximum length": 16})
+
+
+def sample_log(worker, i):
+    return db.APIRequestLog(request=PROMPT, response=f"worker {worker} record {i}", error_occurred=False,
+                            timestamp=time.time(), duration=0.1, returncode=0, model="bench")
+
+
+def direct_worker(uri, lock_timeout, worker, records, start, results):
+    if lock_timeout is None:
+        engine = db.create_engine(uri)
+        db.configure_sqlite(engine)
+    else:
+        engine = db.create_engine(uri, connect_args={"timeout": lock_timeout})
+    session_maker = db.sqlalchemy.orm.sessionmaker(bind=engine)
+    start.wait()
+    locked = 0
+    for i in range(records):
+        try:
+            db.write_logs([sample_log(worker, i)], session_maker)
+        except OperationalError:
+            locked += 1
+    results.put(locked)
+
+
+def socket_worker(path, worker, records, start, results):
+    async def run():
+        writer = SocketLogWriter(path)
+        await writer.start()
+        start.wait()
+        for i in range(records):
+            await writer.submit(sample_log(worker, i))
+        await writer.stop(timeout=60)
+    asyncio.run(run())
+    results.put(0)
+
+
+def log_server(uri, path, ready, done):
+    async def run():
+        server = LogServer(path, db.get_session_maker(db.get_engine()))
+        await server.start()
+        ready.set()
+        await asyncio.to_thread(done.wait)
+        await server.stop(timeout=60)
+    config.DB_URI = uri
+    asyncio.run(run())
+
+
+def run_mode(mode, workers, records, tmpdir, default_timeout):
+    path = os.path.join(tmpdir, f"{mode}-{workers}.db")
+    uri = f"sqlite:///{path}"
+    # Create the tables up front, outside the timed section.
+    db.get_session_maker(db.create_engine(uri)).kw["bind"].dispose()
+    start, done, ready = multiprocessing.Event(), multiprocessing.Event(), multiprocessing.Event()
+    results = multiprocessing.Queue()
+    server = None
+    if mode == "socket":
+        socket_path = os.path.join(tmpdir, f"{workers}.sock")
+        server = multiprocessing.Process(target=log_server, args=(uri, socket_path, ready, done))
+        server.start()
+        ready.wait()
+        target, extra = socket_worker, (socket_path,)
+    else:
+        target, extra = direct_worker, (uri, None if mode == "wal" else default_timeout)
+    processes = [
+        multiprocessing.Process(target=target, args=extra + (worker, records, start, results))
+        for worker in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    began = time.perf_counter()
+    start.set()
+    locked = sum(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    if server is not None:
+        done.set()
+        server.join()
+    elapsed = time.perf_counter() - began
+    written = sqlite3.connect(path).execute("SELECT count(*) FROM api_request_log").fetchone()[0]
+    return {"records_per_s": round(written / elapsed), "written": written, "locked_errors": locked}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", nargs="+", default=[1, 2, 4, 8], type=int)
+    parser.add_argument("--records", default=500, type=int, help="Records logged by each process")
+    parser.add_argument("--modes", nargs="+", default=["default", "wal", "socket"])
+    parser.add_argument("--default-timeout", default=5.0, type=float,
+                        help="Lock timeout of the default mode, in seconds (default: 5, the sqlite3 module's own)")
+    args = parser.parse_args()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for workers in args.workers:
+            results[workers] = {mode: run_mode(mode, workers, args.records, tmpdir, args.default_timeout)
+                                for mode in args.modes}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
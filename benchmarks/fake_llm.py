@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Configurable stand-in for an LLM executable, in the spirit of echo_args.sh.
+
+One-shot mode (use as EXECUTABLE): echoes its arguments, padded to the
+configured output size, after sleeping. With `--worker` as the first argument
+it speaks the gull_api.pool JSON-lines protocol instead (use as WORKER_COMMAND).
+
+Behaviour is set through the environment so it carries through the server:
+
+    FAKE_LLM_SLEEP         seconds per generation (default 0)
+    FAKE_LLM_OUTPUT_BYTES  minimum size of stdout (default 0)
+    FAKE_LLM_FAILURE_RATE  fraction of runs that exit non-zero (default 0)
+    FAKE_LLM_LOAD_DELAY    seconds of simulated model load at startup (default 0)
+"""
+import json
+import os
+import random
+import sys
+import time
+
+SLEEP = float(os.getenv("FAKE_LLM_SLEEP", "0"))
+OUTPUT_BYTES = int(os.getenv("FAKE_LLM_OUTPUT_BYTES", "0"))
+FAILURE_RATE = float(os.getenv("FAKE_LLM_FAILURE_RATE", "0"))
+LOAD_DELAY = float(os.getenv("FAKE_LLM_LOAD_DELAY", "0"))
+
+
+def generate(argv):
+    time.sleep(SLEEP)
+    if random.random() < FAILURE_RATE:
+        return "", "fake_llm: simulated failure\n", 1
+    text = " ".join(argv)
+    if len(text) < OUTPUT_BYTES:
+        text += " " + "x" * (OUTPUT_BYTES - len(text) - 1)
+    return text + "\n", "", 0
+
+
+def serve():
+    for line in sys.stdin:
+        message = json.loads(line)
+        if message.get("ping"):
+            reply = {"pong": True}
+        else:
+            stdout, stderr, returncode = generate(message.get("argv", []))
+            reply = {"stdout": stdout, "stderr": stderr, "returncode": returncode}
+        sys.stdout.write(json.dumps(reply) + "\n")
+        sys.stdout.flush()
+
+
+def main():
+    time.sleep(LOAD_DELAY)
+    if sys.argv[1:2] == ["--worker"]:
+        serve()
+        return
+    stdout, stderr, returncode = generate(sys.argv[1:])
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    sys.exit(returncode)
+
+
+if __name__ == "__main__":
+    main()
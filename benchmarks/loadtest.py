@@ -0,0 +1,191 @@
+"""
+Load test for a real gull_api server backed by benchmarks/fake_llm.py.
+
+For every --workers count the server is started through run_gull_api.py with
+a scratch database, then /llm and /api are driven at each --concurrency
+level. Throughput and p50/p95/p99 latency are written as JSON to --output.
+With --baseline, the run is compared against an earlier output file and the
+script exits non-zero if throughput dropped or p95 latency grew by more than
+--tolerance.
+
+    python benchmarks/loadtest.py --workers 1 2 --concurrency 1 8 32 \\
+        --requests 500 --sleep 0.01 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_LLM = os.path.join(ROOT, "benchmarks", "fake_llm.py")
+PAYLOAD = {"Prompt": "Once upon a time", "Maximum length": 128, "Temperature": 0.7}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "req_per_s": len(latencies) / elapsed if elapsed else None,
+        "p50_ms": percentile(latencies, 0.50) * 1000 if latencies else None,
+        "p95_ms": percentile(latencies, 0.95) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+        "statuses": {str(status): statuses.count(status) for status in sorted(set(statuses))},
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, workers, port, tmpdir):
+    env = dict(
+        os.environ,
+        CLI_JSON_PATH=args.cli_json,
+        EXECUTABLE=f"{FAKE_LLM}",
+        DB_URI=f"sqlite:///{os.path.join(tmpdir, f'bench-{workers}.db')}",
+        MAX_CONCURRENCY=str(args.max_concurrency),
+        MAX_QUEUE=str(max(args.concurrency) * 2),
+        COALESCE_REQUESTS="false",
+        FAKE_LLM_SLEEP=str(args.sleep),
+        FAKE_LLM_OUTPUT_BYTES=str(args.output_bytes),
+        FAKE_LLM_FAILURE_RATE=str(args.failure_rate),
+    )
+    if args.pool_size:
+        env.update(WORKER_POOL_SIZE=str(args.pool_size), WORKER_COMMAND=f"{sys.executable} {FAKE_LLM} --worker")
+    command = [
+        sys.executable, "-m", "gull_api.run_gull_api",
+        "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning",
+    ]
+    return subprocess.Popen(command, env=env, cwd=ROOT)
+
+
+async def wait_ready(client, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/api")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+async def drive(client, method, path, requests, concurrency):
+    latencies = []
+    statuses = []
+    queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(None)
+
+    async def user():
+        while not queue.empty():
+            queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                if method == "POST":
+                    response = await client.post(path, json=PAYLOAD)
+                else:
+                    response = await client.get(path)
+                statuses.append(response.status_code)
+            except httpx.TransportError:
+                statuses.append(0)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - start)
+
+
+async def run_workers(args, workers, tmpdir):
+    port = free_port()
+    server = start_server(args, workers, port, tmpdir)
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120, limits=limits) as client:
+            await wait_ready(client)
+            results = []
+            for concurrency in args.concurrency:
+                for method, path in (("POST", "/llm"), ("GET", "/api")):
+                    result = await drive(client, method, path, args.requests, concurrency)
+                    result.update(endpoint=path, workers=workers, concurrency=concurrency)
+                    results.append(result)
+                    print(json.dumps(result), file=sys.stderr)
+            return results
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def compare(results, baseline, tolerance):
+    """Return human-readable regressions of `results` against `baseline`."""
+    key = lambda result: (result["endpoint"], result["workers"], result["concurrency"])
+    previous = {key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None or not old["req_per_s"] or result["req_per_s"] is None:
+            continue
+        if result["req_per_s"] < old["req_per_s"] * (1 - tolerance):
+            regressions.append(f"{key(result)}: req/s {old['req_per_s']:.1f} -> {result['req_per_s']:.1f}")
+        if old["p95_ms"] and result["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{key(result)}: p95 {old['p95_ms']:.1f}ms -> {result['p95_ms']:.1f}ms")
+    return regressions
+
+
+async def run(args):
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for workers in args.workers:
+            results.extend(await run_workers(args, workers, tmpdir))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cli-json", default=os.path.join(ROOT, "example_cli.json"))
+    parser.add_argument("--workers", nargs="+", default=[1], type=int, help="uvicorn worker counts to test")
+    parser.add_argument("--concurrency", nargs="+", default=[1, 8, 32], type=int, help="Concurrent clients")
+    parser.add_argument("--requests", default=200, type=int, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--max-concurrency", default=8, type=int, help="Server MAX_CONCURRENCY")
+    parser.add_argument("--pool-size", default=0, type=int, help="Server WORKER_POOL_SIZE (0 spawns per request)")
+    parser.add_argument("--sleep", default=0.0, type=float, help="Fake generation time in seconds")
+    parser.add_argument("--output-bytes", default=0, type=int, help="Fake generation output size")
+    parser.add_argument("--failure-rate", default=0.0, type=float, help="Fraction of fake generations that fail")
+    parser.add_argument("--output", default="loadtest-results.json")
+    parser.add_argument("--baseline", help="Earlier --output file to compare against")
+    parser.add_argument("--tolerance", default=0.1, type=float, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report = {"config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+              "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
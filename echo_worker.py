@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+Mock LLM worker for pool mode. Speaks the line-delimited JSON protocol used by
+gull_api.pool and answers every request by echoing its arguments, like
+echo_args.sh does for one-shot mode.
+"""
+import json
+import sys
+
+
+def main():
+    for line in sys.stdin:
+        message = json.loads(line)
+        if message.get("ping"):
+            reply = {"pong": True}
+        else:
+            argv = message.get("argv", [])
+            stdout = " ".join(f'"{arg}"' if any(c.isspace() for c in arg) else arg for arg in [sys.argv[0]] + argv)
+            reply = {"stdout": stdout + "\n", "stderr": "", "returncode": 0}
+        sys.stdout.write(json.dumps(reply) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
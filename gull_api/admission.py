@@ -0,0 +1,333 @@
+import asyncio
+import itertools
+import math
+import time
+from collections import deque
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request can't get an execution slot, either because the wait
+    queue is full or because it waited longer than the queue timeout.
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+# Priority classes, highest first. Every queued interactive request is served
+# before any batch request; within a class clients share slots by weight.
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+ANONYMOUS = "anonymous"
+
+# Idle clients whose stats are kept for /status, per controller.
+MAX_TRACKED_CLIENTS = 1000
+
+# Upper bounds, in seconds, of the predicted runtime classes queue waits are reported by.
+RUNTIME_CLASSES = ((1.0, "under_1s"), (10.0, "under_10s"), (60.0, "under_60s"), (math.inf, "longer"))
+
+def runtime_class(cost: float = None) -> str:
+    if cost is None:
+        return "unpredicted"
+    for bound, name in RUNTIME_CLASSES:
+        if cost < bound:
+            return name
+
+class Slot:
+    """An acquired execution slot. Releasing it more than once is a no-op."""
+
+    def __init__(self, controller: "AdmissionController", queue: "ClientQueue", wait: float = 0.0):
+        self._controller = controller
+        self._queue = queue
+        self._acquired_at = time.monotonic()
+        self.client_id = queue.client_id
+        self.wait = wait
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._controller._release(self._queue, time.monotonic() - self._acquired_at)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+        return False
+
+class Waiter:
+    __slots__ = ("future", "rank", "start_tag", "finish_tag", "seq", "queued", "cost", "enqueued")
+
+    def __init__(self, future, rank, start_tag, finish_tag, seq, cost=None):
+        self.future = future
+        self.rank = rank
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.seq = seq
+        self.queued = True
+        self.cost = cost
+        self.enqueued = time.monotonic()
+
+class ClientQueue:
+    """One client's waiters (a queue per priority class) and usage within a controller."""
+
+    def __init__(self, client_id: str, weight: float, max_concurrency: int):
+        self.client_id = client_id
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.waiters = [deque() for _ in PRIORITIES]
+        self.active = 0
+        # Virtual finish tag of this client's latest request, for fair queuing.
+        self.finish_tag = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(waiters) for waiters in self.waiters)
+
+    @property
+    def has_room(self) -> bool:
+        return not self.max_concurrency or self.active < self.max_concurrency
+
+    def stats(self) -> dict:
+        return {
+            "weight": self.weight,
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait_seconds": self.total_wait / self.admitted if self.admitted else 0.0,
+        }
+
+class AdmissionController:
+    """
+    Caps the number of requests executing at once at `max_concurrency` and
+    lets at most `max_queue` more wait for a slot. Anything beyond that is
+    rejected immediately so the caller can answer with Retry-After instead of
+    piling more processes onto the host.
+
+    Waiting requests are ordered by priority class, then by start-time fair
+    queuing across clients: while several clients are backlogged, each gets
+    slots in proportion to its weight. One client's requests are served in
+    arrival order, or with `shortest_first` by predicted runtime (`cost`,
+    in seconds), shortest first. Each second waited takes `aging` seconds
+    off a request's cost, so a long one is overtaken by new short ones for
+    a bounded time only. A client may also be held to its own concurrency
+    limit.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float = 0,
+                 shortest_first: bool = False, aging: float = 1.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.shortest_first = shortest_first
+        self.aging = aging
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # Exponentially weighted average of how long a slot is held, for Retry-After.
+        self.avg_service_time = 0.0
+        self.virtual_time = 0.0
+        # Queue waits by predicted runtime class: [admitted, total wait, max wait].
+        self._class_waits = {}
+        self._seq = 0
+        self._queues = {}
+        # Clients seen so far, kept after they go idle so /status can report them.
+        self._clients = {}
+
+    def retry_after(self) -> int:
+        # Time for everything ahead of a new arrival to drain, at least one second.
+        backlog = (self.waiting + 1) / max(self.max_concurrency, 1)
+        return max(1, math.ceil(backlog * self.avg_service_time))
+
+    def _queue_for(self, client_id: str, weight: float, max_concurrency: int) -> ClientQueue:
+        queue = self._queues.get(client_id)
+        if queue is None:
+            queue = self._clients.get(client_id)
+            if queue is None:
+                if len(self._clients) >= MAX_TRACKED_CLIENTS:
+                    self._forget_idle_client()
+                queue = self._clients[client_id] = ClientQueue(client_id, weight, max_concurrency)
+            self._queues[client_id] = queue
+        # Pick up changed client settings.
+        queue.weight = weight
+        queue.max_concurrency = max_concurrency
+        return queue
+
+    def _forget_idle_client(self):
+        for client_id in self._clients:
+            if client_id not in self._queues:
+                del self._clients[client_id]
+                return
+
+    def _discard_if_idle(self, queue: ClientQueue):
+        if not queue.active and not queue.waiting:
+            self._queues.pop(queue.client_id, None)
+
+    def _record_wait(self, queue: ClientQueue, wait: float, cost: float = None):
+        self.admitted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        queue.admitted += 1
+        queue.total_wait += wait
+        waits = self._class_waits.setdefault(runtime_class(cost), [0, 0.0, 0.0])
+        waits[0] += 1
+        waits[1] += wait
+        waits[2] = max(waits[2], wait)
+
+    async def acquire(self, client_id: str = ANONYMOUS, weight: float = 1.0, max_concurrency: int = 0,
+                      priority: str = INTERACTIVE, cost: float = None) -> Slot:
+        queue = self._queue_for(client_id, weight, max_concurrency)
+        if self.active < self.max_concurrency and not self.waiting and queue.has_room:
+            self.active += 1
+            queue.active += 1
+            self._record_wait(queue, 0.0, cost)
+            return Slot(self, queue)
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            queue.rejected += 1
+            self._discard_if_idle(queue)
+            raise AdmissionRejected("Server is at capacity.", self.retry_after())
+
+        start_tag = max(self.virtual_time, queue.finish_tag)
+        queue.finish_tag = start_tag + 1.0 / max(weight, 1e-6)
+        self._seq += 1
+        waiter = Waiter(asyncio.get_running_loop().create_future(), PRIORITIES.index(priority),
+                        start_tag, queue.finish_tag, self._seq, cost)
+        queue.waiters[waiter.rank].append(waiter)
+        self.waiting += 1
+        # Slots may be free while every earlier waiter is held back by its client's limit.
+        self._dispatch()
+
+        start = time.monotonic()
+        try:
+            if self.queue_timeout > 0:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.queue_timeout)
+            else:
+                await waiter.future
+        except asyncio.TimeoutError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was handed over just as the timeout fired; take it.
+                self._record_wait(queue, time.monotonic() - start, cost)
+                return Slot(self, queue, time.monotonic() - start)
+            self._remove(queue, waiter)
+            self.timed_out += 1
+            queue.rejected += 1
+            raise AdmissionRejected("Timed out waiting for capacity.", self.retry_after())
+        except BaseException:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Cancelled after being granted a slot: pass it on rather than leak it.
+                self._release(queue, None)
+            else:
+                self._remove(queue, waiter)
+            raise
+        wait = time.monotonic() - start
+        self._record_wait(queue, wait, cost)
+        return Slot(self, queue, wait)
+
+    def _remove(self, queue: ClientQueue, waiter: Waiter):
+        if waiter.queued:
+            queue.waiters[waiter.rank].remove(waiter)
+            waiter.queued = False
+            self.waiting -= 1
+        waiter.future.cancel()
+        self._discard_if_idle(queue)
+
+    def _next_waiter(self):
+        best = None
+        for queue in self._queues.values():
+            if not queue.has_room:
+                continue
+            for waiters in queue.waiters:
+                # Drop waiters whose task was cancelled while they were queued.
+                while waiters and waiters[0].future.done():
+                    waiters.popleft().queued = False
+                    self.waiting -= 1
+                if waiters:
+                    head = waiters[0]
+                    if best is None or (head.rank, head.finish_tag, head.seq) < (best[1].rank, best[1].finish_tag, best[1].seq):
+                        best = (queue, head)
+                    # A client's lower priority classes never go ahead of its higher one.
+                    break
+        return best
+
+    def _take_shortest(self, waiters) -> Waiter:
+        """
+        Remove and return the waiter with the lowest aged cost. It takes the
+        head's fair queuing tags and each waiter it overtook takes the next
+        one's, so the client's turns come round as they would in arrival order.
+        """
+        now = time.monotonic()
+
+        def aged_cost(item):
+            waiter = item[1]
+            cost = waiter.cost if waiter.cost is not None else self.avg_service_time
+            return cost - self.aging * (now - waiter.enqueued), waiter.seq
+
+        index, chosen = min(
+            ((i, waiter) for i, waiter in enumerate(waiters) if not waiter.future.done()), key=aged_cost
+        )
+        tags = [(waiter.start_tag, waiter.finish_tag) for waiter in itertools.islice(waiters, index + 1)]
+        chosen.start_tag, chosen.finish_tag = tags[0]
+        for i in range(index):
+            waiters[i].start_tag, waiters[i].finish_tag = tags[i + 1]
+        del waiters[index]
+        return chosen
+
+    def _dispatch(self):
+        while self.active < self.max_concurrency:
+            best = self._next_waiter()
+            if best is None:
+                return
+            queue, waiter = best
+            if self.shortest_first:
+                waiter = self._take_shortest(queue.waiters[waiter.rank])
+            else:
+                queue.waiters[waiter.rank].popleft()
+            waiter.queued = False
+            self.waiting -= 1
+            self.active += 1
+            queue.active += 1
+            self.virtual_time = waiter.start_tag
+            waiter.future.set_result(None)
+
+    def _release(self, queue: ClientQueue, held: float):
+        if held is not None:
+            self.avg_service_time = held if self.avg_service_time == 0 else 0.9 * self.avg_service_time + 0.1 * held
+        self.active -= 1
+        queue.active -= 1
+        # Hand the slot on synchronously, so a new arrival can't jump the queue.
+        self._dispatch()
+        self._discard_if_idle(queue)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_seconds": self.total_wait / self.admitted if self.admitted else 0.0,
+            "max_wait_seconds": self.max_wait,
+            "avg_service_seconds": self.avg_service_time,
+            "scheduling": "sjf" if self.shortest_first else "fifo",
+            "waits_by_predicted_runtime": {
+                name: {"admitted": admitted, "avg_wait_seconds": total / admitted, "max_wait_seconds": longest}
+                for name, (admitted, total, longest) in self._class_waits.items()
+            },
+            "clients": {client_id: queue.stats() for client_id, queue in self._clients.items()},
+        }
@@ -0,0 +1,258 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from collections import OrderedDict
+from typing import Optional
+from pydantic import BaseModel
+from sqlalchemy.exc import SQLAlchemyError
+from gull_api import config
+from gull_api.db import CachedResponse, get_default_session_maker
+
+logger = logging.getLogger(__name__)
+
+# Seconds between prunes of the persistent cache table.
+PRUNE_INTERVAL = 60
+
+def file_identity(path: str) -> Optional[list]:
+    """Where a file really is, its size and modification time; None if there is no such file."""
+    try:
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    return [os.path.realpath(path), stat.st_size, stat.st_mtime_ns]
+
+def request_key(schema, validated_request: BaseModel) -> str:
+    """
+    Canonical hash of a validated request. Defaults are already filled in by
+    validation, so requests that differ only in omitted-vs-default fields hash
+    the same. The schema version ties the key to the cli.json it was run
+    against, and the identity of the executable and of the model files (string
+    parameters, such as the hidden Model one, whose default names a file) to
+    the binary and weights, so replacing either changes it.
+    """
+    values = validated_request.dict()
+    executable = schema.executable or config.EXECUTABLE
+    files = [file_identity(shutil.which(executable) or executable)]
+    for param in schema.params:
+        default = param.get("default")
+        if param["type"] == "str" and isinstance(default, str) and os.path.isfile(default):
+            files.append(file_identity(values.get(param["name"]) or default))
+    canonical = json.dumps(
+        {"schema": schema.version, "params": values, "files": files},
+        sort_keys=True, separators=(",", ":"), default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def is_deterministic(schema, validated_request: BaseModel) -> bool:
+    """
+    Whether running the request again gives the same output, so its result
+    may be cached: it samples at temperature 0 or from a fixed seed. A model
+    with neither parameter is assumed to sample at random.
+    """
+    values = validated_request.dict()
+    temperature_flag = schema.temperature_flag or config.TEMPERATURE_FLAG
+    seed_flag = schema.seed_flag or config.SEED_FLAG
+    for param in schema.params:
+        value = values.get(param["name"])
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            continue
+        if param["flag"] == temperature_flag and value == 0:
+            return True
+        if param["flag"] == seed_flag and value >= 0:
+            return True
+    return False
+
+class ResponseCache:
+    """
+    LRU cache of successful generations keyed by `request_key`.
+
+    Entries expire after `ttl` seconds (0 keeps them until evicted) and the
+    least recently used ones are evicted once the cache holds more than
+    `max_entries` entries or `max_bytes` of response text. With `persist` the
+    cache is backed by the response_cache table, so entries survive restarts
+    and are shared between workers using the same database; the table is
+    held to the same `ttl` and `max_entries` every PRUNE_INTERVAL seconds.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, ttl: float = 0,
+                 persist: bool = False, session_maker=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.persist = persist
+        self.session_maker = session_maker
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.size_bytes = 0
+        self.pruned = 0
+        self._pruned_at = time.monotonic()
+        self._entries = OrderedDict()
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl > 0 and time.time() - created_at > self.ttl
+
+    def _store(self, key: str, response: str, created_at: float):
+        if key in self._entries:
+            self.size_bytes -= len(self._entries.pop(key)[0])
+        self._entries[key] = (response, created_at)
+        self.size_bytes += len(response)
+        while self._entries and (len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes):
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self.size_bytes -= len(evicted)
+            self.evictions += 1
+
+    def _get_memory(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        response, created_at = entry
+        if self._expired(created_at):
+            del self._entries[key]
+            self.size_bytes -= len(response)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return response
+
+    async def get(self, key: str) -> Optional[str]:
+        response = self._get_memory(key)
+        if response is None and self.persist:
+            entry = await asyncio.to_thread(self._load, key)
+            if entry is not None and not self._expired(entry[1]):
+                response = entry[0]
+                self._store(key, *entry)
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    async def put(self, key: str, response: str):
+        created_at = time.time()
+        self._store(key, response, created_at)
+        if self.persist:
+            await asyncio.to_thread(self._save, key, response, created_at)
+            if time.monotonic() - self._pruned_at >= PRUNE_INTERVAL:
+                self._pruned_at = time.monotonic()
+                await asyncio.to_thread(self.prune)
+
+    def _session(self):
+        if self.session_maker is None:
+            self.session_maker = get_default_session_maker()
+        return self.session_maker()
+
+    def _load(self, key: str):
+        session = self._session()
+        try:
+            row = session.get(CachedResponse, key)
+            return (row.response, row.created_at) if row is not None else None
+        except SQLAlchemyError:
+            logger.exception("Failed to read cached response")
+            return None
+        finally:
+            session.close()
+
+    def _save(self, key: str, response: str, created_at: float):
+        session = self._session()
+        try:
+            session.merge(CachedResponse(key=key, response=response, created_at=created_at))
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            logger.exception("Failed to persist cached response")
+        finally:
+            session.close()
+
+    def prune(self) -> int:
+        """Delete persisted entries past their ttl, then all but the `max_entries` newest; returns how many."""
+        session = self._session()
+        try:
+            deleted = 0
+            if self.ttl > 0:
+                deleted += session.query(CachedResponse).filter(
+                    CachedResponse.created_at < time.time() - self.ttl
+                ).delete(synchronize_session=False)
+            newest = session.query(CachedResponse.key).order_by(CachedResponse.created_at.desc()).limit(self.max_entries)
+            deleted += session.query(CachedResponse).filter(
+                CachedResponse.key.notin_(newest.scalar_subquery())
+            ).delete(synchronize_session=False)
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            logger.exception("Failed to prune cached responses")
+            return 0
+        finally:
+            session.close()
+        self.pruned += deleted
+        return deleted
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "pruned": self.pruned,
+        }
+
+class _Call:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Runs at most one execution per key at a time. Callers that arrive while
+    an execution for their key is in flight wait for it and get the same
+    result, or the same exception.
+
+    A caller that is cancelled stops waiting without affecting the others;
+    the shared execution is only cancelled once nobody is waiting on it.
+    """
+
+    def __init__(self):
+        self.executions = 0
+        self.coalesced = 0
+        self._calls = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn):
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            self.executions += 1
+
+            def forget(task, key=key, call=call):
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+
+            call.task.add_done_callback(forget)
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+        }
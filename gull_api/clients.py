@@ -0,0 +1,189 @@
+import contextvars
+import json
+import math
+import time
+from typing import Dict, Mapping, Optional
+from gull_api import config
+from gull_api.admission import ANONYMOUS, INTERACTIVE, PRIORITIES
+
+# Rate limit buckets kept at most; the longest idle are dropped past that.
+MAX_DEFAULT_BUCKETS = 10000
+
+class RateLimited(Exception):
+    def __init__(self, client_id: str, retry_after: int):
+        super().__init__(f"Rate limit exceeded for client {client_id}.")
+        self.client_id = client_id
+        self.retry_after = retry_after
+
+class UnknownApiKey(Exception):
+    pass
+
+class Client:
+    """A caller and the scheduling settings that apply to it."""
+
+    def __init__(self, id: str, weight: float = 1.0, max_concurrency: int = 0, rate: float = 0.0,
+                 burst: int = 0, priority: str = INTERACTIVE):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority class {priority!r}, expected one of {PRIORITIES}")
+        self.id = id
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst or max(1, math.ceil(rate))
+        self.priority = priority
+
+class TokenBucket:
+    """Allows `rate` generations per second on average, in bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.limited = 0
+
+    def take(self) -> float:
+        """Take a token and return 0, or return the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        self.limited += 1
+        return (1 - self.tokens) / self.rate
+
+class RequestContext:
+    """
+    Who a request is for and how it was scheduled. Filled in as the request
+    runs and recorded with its log entry.
+    """
+
+    def __init__(self, client: Client, priority: str = INTERACTIVE):
+        self.client = client
+        self.priority = priority
+        self.started_at = time.time()
+        self.queue_wait = None
+        self.model = None
+        self.request_hash = None
+        self.timing = None
+        # request_size() of the request and the runtime predicted from it.
+        self.size = None
+        self.predicted_duration = None
+
+# The RequestContext of the request being handled, set by each endpoint so the
+# scheduler and request log can see it without threading it through every call.
+current_request = contextvars.ContextVar("current_request", default=None)
+
+def lower_priority(*priorities: Optional[str]) -> str:
+    """The lowest of the given priority classes; unknown values are ignored."""
+    ranks = [PRIORITIES.index(priority) for priority in priorities if priority in PRIORITIES]
+    return PRIORITIES[max(ranks)] if ranks else INTERACTIVE
+
+class ClientRegistry:
+    """
+    Identifies the client behind a request and enforces its rate quota.
+
+    CLIENTS_PATH names a JSON object mapping API keys to client settings:
+
+        {"<api key>": {"name": "webapp", "weight": 4, "max_concurrency": 2,
+                       "rate": 5, "burst": 10, "priority": "interactive"}}
+
+    The key is taken from X-API-Key or an "Authorization: Bearer" header;
+    once keys are configured, any other key is refused. Requests without a
+    key are told apart by their address, or by the CLIENT_ID_HEADER header
+    when they come through one of `trusted_proxies`, and get the
+    DEFAULT_CLIENT_* settings.
+    """
+
+    def __init__(self, path: str = None, trusted_proxies: str = None):
+        self.path = config.CLIENTS_PATH if path is None else path
+        self.keys = self.load(self.path) if self.path else {}
+        trusted_proxies = config.TRUSTED_PROXIES if trusted_proxies is None else trusted_proxies
+        self.trusted_proxies = {address.strip() for address in trusted_proxies.split(",") if address.strip()}
+        self._buckets = {}
+
+    @staticmethod
+    def load(path: str) -> Dict[str, Client]:
+        with open(path, "r") as f:
+            entries = json.load(f)
+        return {
+            key: Client(
+                settings.get("name", key),
+                weight=settings.get("weight", 1.0),
+                max_concurrency=settings.get("max_concurrency", 0),
+                rate=settings.get("rate", 0.0),
+                burst=settings.get("burst", 0),
+                priority=settings.get("priority", INTERACTIVE),
+            )
+            for key, settings in entries.items()
+        }
+
+    def default_client(self, client_id: str) -> Client:
+        return Client(
+            client_id,
+            weight=config.DEFAULT_CLIENT_WEIGHT,
+            max_concurrency=config.DEFAULT_CLIENT_MAX_CONCURRENCY,
+            rate=config.DEFAULT_CLIENT_RATE,
+            burst=config.DEFAULT_CLIENT_BURST,
+        )
+
+    def by_id(self, client_id: str) -> Client:
+        """The client with this id, e.g. to schedule work recorded earlier on its behalf."""
+        for client in self.keys.values():
+            if client.id == client_id:
+                return client
+        return self.default_client(client_id or ANONYMOUS)
+
+    def identify(self, headers: Mapping[str, str], host: str = None) -> Client:
+        key = headers.get("x-api-key")
+        authorization = headers.get("authorization", "")
+        if not key and authorization.lower().startswith("bearer "):
+            key = authorization[7:].strip()
+        if key and self.keys:
+            client = self.keys.get(key)
+            if client is None:
+                # Otherwise every made-up key would get a fresh quota and queue.
+                raise UnknownApiKey()
+            return client
+        # Only a proxy that sets the header itself, such as the dispatcher, is
+        # believed; any other caller could send a new id with each request.
+        # Prefixed so it can't share a configured client's queue.
+        client_id = headers.get(config.CLIENT_ID_HEADER.lower())
+        if client_id and host in self.trusted_proxies:
+            return self.default_client("id:" + client_id[:64])
+        return self.default_client("ip:" + host if host else ANONYMOUS)
+
+    def check_rate(self, client: Client):
+        """Spend one of the client's generation tokens, or raise RateLimited."""
+        if client.rate <= 0:
+            return
+        bucket = self._buckets.get(client.id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_DEFAULT_BUCKETS:
+                self._prune()
+            bucket = self._buckets[client.id] = TokenBucket(client.rate, client.burst)
+        bucket.rate, bucket.burst = client.rate, client.burst
+        wait = bucket.take()
+        if wait:
+            raise RateLimited(client.id, max(1, math.ceil(wait)))
+
+    def _prune(self):
+        # A bucket that has refilled completely behaves exactly like a new one.
+        now = time.monotonic()
+        for client_id, bucket in list(self._buckets.items()):
+            if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.burst:
+                del self._buckets[client_id]
+        # Callers from many addresses could still fill the table, so beyond
+        # that the longest idle go, leaving room for one more.
+        excess = len(self._buckets) - MAX_DEFAULT_BUCKETS + 1
+        if excess > 0:
+            idle = sorted(self._buckets, key=lambda client_id: self._buckets[client_id].updated)
+            for client_id in idle[:excess]:
+                del self._buckets[client_id]
+
+    def stats(self) -> dict:
+        return {
+            client_id: {"rate": bucket.rate, "burst": bucket.burst, "rate_limited": bucket.limited}
+            for client_id, bucket in self._buckets.items()
+        }
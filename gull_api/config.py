@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Path to the .env file in the current working directory
@@ -9,5 +10,119 @@ load_dotenv(dotenv_path=env_path)
 
 # Define configuration variables
 CLI_JSON_PATH = os.getenv("CLI_JSON_PATH", "cli.json")
+CLI_JSON_POLL_INTERVAL = float(os.getenv("CLI_JSON_POLL_INTERVAL", "2.0")) # Seconds between cli.json change checks
+API_CACHE_CONTROL = os.getenv("API_CACHE_CONTROL", "public, max-age=60") # Cache-Control sent with /api
 DB_URI = os.getenv("DB_URI", "sqlite:///./database.db")
-EXECUTABLE = os.getenv("EXECUTABLE", "./main") # Add this line for the executable config
\ No newline at end of file
+EXECUTABLE = os.getenv("EXECUTABLE", "./main") # Add this line for the executable config
+
+# Warm worker pool: keep WORKER_POOL_SIZE long-lived WORKER_COMMAND processes instead of spawning per request
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", "0")) # 0 spawns one process per request
+WORKER_COMMAND = os.getenv("WORKER_COMMAND", EXECUTABLE)
+WORKER_MAX_REQUESTS = int(os.getenv("WORKER_MAX_REQUESTS", "0")) # Recycle a worker after this many requests, 0 to never recycle
+WORKER_HEALTH_INTERVAL = float(os.getenv("WORKER_HEALTH_INTERVAL", "30.0"))
+
+# Startup warm-up: read the model files named in cli.json into the page cache and run a warm-up generation; /ready reports 503 until done
+PREWARM = os.getenv("PREWARM", "false").lower() == "true"
+PREWARM_MLOCK = os.getenv("PREWARM_MLOCK", "false").lower() == "true" # Also lock the files in memory (needs CAP_IPC_LOCK or a large enough RLIMIT_MEMLOCK)
+WARMUP_REQUEST = os.getenv("WARMUP_REQUEST", "") # JSON payload run once per model once the files are warm, e.g. {"Prompt": "Hi", "Maximum length": 2}; empty to skip
+
+# Admission control: at most MAX_CONCURRENCY generations run at once, MAX_QUEUE more wait, the rest get a 503.
+# Defaults to the pool size, or without a pool to one generation per usable core, split between the server's processes
+USABLE_CORES = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", str(
+    WORKER_POOL_SIZE or max(1, USABLE_CORES // int(os.getenv("PLACEMENT_WORKERS", "1")))
+)))
+MAX_QUEUE = int(os.getenv("MAX_QUEUE", "16"))
+QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT", "0")) # Seconds a request may wait for a slot, 0 to wait indefinitely
+
+# Scheduling of waiting requests within each client's queue: "sjf" runs the shortest predicted generation first, "fifo" keeps arrival order
+SCHEDULING = os.getenv("SCHEDULING", "sjf")
+SJF_AGING = float(os.getenv("SJF_AGING", "1.0")) # Seconds of predicted runtime forgiven per second waited, so long requests aren't starved
+LENGTH_FLAG = os.getenv("LENGTH_FLAG", "-n") # Flag of the maximum-tokens parameter, for runtime prediction; a model's "length_flag" overrides it
+RUNTIME_HISTORY = int(os.getenv("RUNTIME_HISTORY", "1000")) # Recent logged generations per model the runtime predictor is fitted on at startup
+
+# Request logging: "batched" writes from a background task, "sync" commits per request, "socket" sends records to a
+# separate log writer process (see run_gull_api.py --log-writer), "off" disables it
+LOG_MODE = os.getenv("LOG_MODE", "batched")
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "100"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0")) # Seconds before a partial batch is written
+LOG_COMPRESS_BYTES = int(os.getenv("LOG_COMPRESS_BYTES", "1024")) # Requests and responses larger than this are stored compressed, 0 to disable
+LOG_COMPRESS_LEVEL = int(os.getenv("LOG_COMPRESS_LEVEL", "6")) # zlib level, 1 (fastest) to 9 (smallest)
+LOG_RETENTION_DAYS = float(os.getenv("LOG_RETENTION_DAYS", "0")) # Records older than this are pruned in the background, 0 keeps everything
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "") # Pruned records are first written here as gzipped JSONL; empty to just delete them
+LOG_COMPACT_INTERVAL = float(os.getenv("LOG_COMPACT_INTERVAL", "3600")) # Seconds between pruning runs
+LOG_SOCKET = os.getenv("LOG_SOCKET", "gull_api_log.sock") # Unix socket of the log writer process when LOG_MODE is "socket"
+
+# SQLite tuning, applied when DB_URI is a SQLite file shared by several worker processes
+SQLITE_WAL = os.getenv("SQLITE_WAL", "true").lower() == "true" # Write-ahead logging, so reads don't block on writes
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30")) # Seconds a write waits for the lock before failing
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper() # OFF, NORMAL or FULL; NORMAL is durable across crashes of the process in WAL mode
+
+# /logs: read access to the request log
+LOGS_API = os.getenv("LOGS_API", "false").lower() == "true" # Serve /logs and /logs/stats, which expose every client's prompts
+LOGS_API_KEY = os.getenv("LOGS_API_KEY", "") # When set, /logs callers must send it as X-Admin-Key; empty to require none
+LOGS_PAGE_SIZE = int(os.getenv("LOGS_PAGE_SIZE", "100"))
+LOGS_MAX_PAGE_SIZE = int(os.getenv("LOGS_MAX_PAGE_SIZE", "1000"))
+
+# Response cache for deterministic generations (e.g. Temperature 0), off by default
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "false").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "0")) # Seconds, 0 to keep entries until evicted
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_PERSIST = os.getenv("RESPONSE_CACHE_PERSIST", "false").lower() == "true" # Also store entries in the database
+TEMPERATURE_FLAG = os.getenv("TEMPERATURE_FLAG", "--temp") # Only requests with this at 0, or a fixed seed, are cached; a model's "temperature_flag" overrides it
+SEED_FLAG = os.getenv("SEED_FLAG", "--seed") # Flag of the sampling seed, negative for a random one; a model's "seed_flag" overrides it
+
+# Share one execution between identical /llm requests that are in flight at the same time, off by default
+# (with sampling, e.g. Temperature above 0, the callers then get the same sample rather than one each)
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "false").lower() == "true"
+
+# /llm/batch: maximum requests per call and how many of them may run at once
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "10000"))
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", str(MAX_CONCURRENCY)))
+
+# Per-stage latency histograms and counters served on /metrics in Prometheus text format
+METRICS = os.getenv("METRICS", "true").lower() == "true"
+
+# Generation deadlines: LLM_TIMEOUT is the default per-model limit (a model's "timeout" in cli.json overrides it)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+KILL_GRACE_PERIOD = float(os.getenv("KILL_GRACE_PERIOD", "5")) # Seconds between SIGTERM and SIGKILL when stopping a generation
+SPAWN_METHOD = os.getenv("SPAWN_METHOD", "asyncio") # "posix_spawn" starts executables without forking the server process, whatever its size
+
+# Output capture: captured stdout/stderr beyond these sizes is dropped and the result flagged as truncated (0 disables a cap)
+STDOUT_MAX_BYTES = int(os.getenv("STDOUT_MAX_BYTES", str(16 * 1024 * 1024)))
+STDERR_MAX_BYTES = int(os.getenv("STDERR_MAX_BYTES", str(1024 * 1024)))
+OUTPUT_SPILL_BYTES = int(os.getenv("OUTPUT_SPILL_BYTES", str(1024 * 1024))) # Captured output past this size is kept in a temporary file
+
+# Clients and fair scheduling: CLIENTS_PATH maps API keys to per-client weight, concurrency, rate and priority class
+CLIENTS_PATH = os.getenv("CLIENTS_PATH", "") # Empty to treat every caller with the defaults below
+CLIENT_ID_HEADER = os.getenv("CLIENT_ID_HEADER", "X-Client-Id") # Identifies callers without an API key, when set by a trusted proxy
+TRUSTED_PROXIES = os.getenv("TRUSTED_PROXIES", "") # Comma-separated addresses allowed to set CLIENT_ID_HEADER, e.g. the dispatcher's
+DEFAULT_CLIENT_WEIGHT = float(os.getenv("DEFAULT_CLIENT_WEIGHT", "1"))
+DEFAULT_CLIENT_MAX_CONCURRENCY = int(os.getenv("DEFAULT_CLIENT_MAX_CONCURRENCY", "0")) # Slots per model, 0 for no limit
+DEFAULT_CLIENT_RATE = float(os.getenv("DEFAULT_CLIENT_RATE", "0")) # Generations per second, 0 for no limit
+DEFAULT_CLIENT_BURST = int(os.getenv("DEFAULT_CLIENT_BURST", "0")) # Defaults to the rate rounded up
+
+# CPU placement: give each executor process its own slot of cores (within one NUMA node) and pin it there
+PLACEMENT = os.getenv("PLACEMENT", "false").lower() == "true"
+PLACEMENT_CORES_PER_SLOT = int(os.getenv("PLACEMENT_CORES_PER_SLOT", "0")) # 0 splits the usable cores evenly across MAX_CONCURRENCY
+THREADS_FLAG = os.getenv("THREADS_FLAG", "") # Thread-count flag set to the slot's core count (e.g. "-t"); a model's "threads_flag" overrides it
+PLACEMENT_WORKERS = int(os.getenv("PLACEMENT_WORKERS", "1")) # Server processes sharing the cores; each gets its own share. Set by run_gull_api.py --workers
+PLACEMENT_LOCK_DIR = os.getenv("PLACEMENT_LOCK_DIR", os.path.join(tempfile.gettempdir(), "gull_api_placement")) # Where worker processes claim their core shares
+
+# Asynchronous jobs (/jobs): queued in the database and run by a background runner in every server process
+JOBS = os.getenv("JOBS", "false").lower() == "true" # Serve /jobs and run queued jobs; the runner polls the jobs table
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", str(MAX_CONCURRENCY))) # Jobs run at once by each process
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "3600")) # Deadline for one job's generation, in seconds
+JOB_LEASE = float(os.getenv("JOB_LEASE", "30")) # A job whose runner hasn't checked in for this long is run again
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "86400")) # Seconds finished jobs and their results are kept, 0 keeps them forever
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0")) # Seconds between checks for new jobs
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "60")) # Longest long-poll allowed on GET /jobs/{id}
+
+# Dispatcher mode (run_gull_api.py --dispatch): forward /llm to the least-loaded of several gull_api backends
+DISPATCH_BACKENDS = os.getenv("DISPATCH_BACKENDS", "") # Comma-separated backend base URLs, e.g. http://10.0.0.2:8000,http://10.0.0.3:8000
+DISPATCH_HEALTH_INTERVAL = float(os.getenv("DISPATCH_HEALTH_INTERVAL", "1.0")) # Seconds between polls of each backend's /ready and /status
+DISPATCH_CONNECT_TIMEOUT = float(os.getenv("DISPATCH_CONNECT_TIMEOUT", "2.0")) # Seconds to connect, or to answer a poll, before a backend counts as down
+DISPATCH_TIMEOUT = float(os.getenv("DISPATCH_TIMEOUT", "0")) # Seconds to wait for a forwarded response, 0 to leave deadlines to the backends
+DISPATCH_MAX_CONNECTIONS = int(os.getenv("DISPATCH_MAX_CONNECTIONS", "100")) # Pooled keep-alive connections per backend
@@ -1,38 +1,431 @@
+import asyncio
+import hashlib
 import json
+import logging
+import math
+import time
+import zlib
 import sqlalchemy
-from sqlalchemy import create_engine, Column, Integer, String, Boolean
+from sqlalchemy import create_engine, func, Column, Index, Integer, LargeBinary, String, Boolean, Float
+import sqlalchemy.event
 import sqlalchemy.orm
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import SQLAlchemyError
-from gull_api import config
+from typing import Any, Dict, List, Optional, Tuple
+from gull_api import config, metrics
+
+logger = logging.getLogger(__name__)
 
 Base = sqlalchemy.orm.declarative_base()
 
 class APIRequestLog(Base):
     __tablename__ = "api_request_log"
+    __table_args__ = (
+        # For /logs queries that filter by model or error state within a time range.
+        Index("ix_api_request_log_model_timestamp", "model", "timestamp"),
+        Index("ix_api_request_log_error_timestamp", "error_occurred", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True)
-    request = Column(String)
-    response = Column(String)
+    request = Column(String) # Canonical JSON; None when stored in log_content
+    response = Column(String) # None when stored compressed in response_data
     error_occurred = Column(Boolean)
     error_details = Column(String)
+    client_id = Column(String)
+    priority = Column(String)
+    queue_wait = Column(Float) # Seconds spent waiting for a generation slot
+    timestamp = Column(Float, index=True) # When the request arrived, in Unix time
+    duration = Column(Float, index=True) # Seconds from arrival to the log record
+    returncode = Column(Integer)
+    model = Column(String)
+    request_hash = Column(String(64), index=True) # The response cache key of the request
+    request_content = Column(String(64), index=True) # log_content hash of a large request
+    response_data = Column(LargeBinary) # zlib-compressed response, when large
+    # Executor timing, in seconds from just before the spawn (see GenerationTiming); empty for cached responses
+    spawn_latency = Column(Float)
+    time_to_first_output = Column(Float)
+    generation_time = Column(Float)
+    output_bytes = Column(Integer)
+    output_tokens = Column(Integer)
+    tokens_per_second = Column(Float)
+    predicted_duration = Column(Float) # The scheduler's runtime prediction, in seconds
+
+class LogContent(Base):
+    """A large logged request, compressed and stored once however many times it was sent."""
+
+    __tablename__ = "log_content"
+
+    hash = Column(String(64), primary_key=True) # sha256 of the uncompressed text
+    data = Column(LargeBinary) # zlib-compressed UTF-8
+    created_at = Column(Float)
+
+class CachedResponse(Base):
+    __tablename__ = "response_cache"
+
+    key = Column(String(64), primary_key=True)
+    response = Column(String)
+    created_at = Column(Float, index=True)
+
+class Job(Base):
+    """A queued /jobs generation. `worker` and `lease_expires` mark who is running it, and until when."""
+
+    __tablename__ = "jobs"
+
+    id = Column(String(32), primary_key=True)
+    model = Column(String)
+    request = Column(String) # JSON payload, as posted
+    status = Column(String, index=True) # queued, running, succeeded or failed
+    response = Column(String)
+    truncated = Column(Boolean)
+    error = Column(String)
+    status_code = Column(Integer)
+    timeout = Column(Float)
+    client_id = Column(String)
+    priority = Column(String)
+    attempts = Column(Integer, default=0)
+    worker = Column(String)
+    lease_expires = Column(Float)
+    available_at = Column(Float) # Not claimed before this time, for retry backoff
+    created_at = Column(Float)
+    started_at = Column(Float)
+    finished_at = Column(Float, index=True) # For pruning finished jobs
+
+def configure_sqlite(engine):
+    """
+    Tune SQLite connections for several server processes sharing one file:
+    WAL journaling so readers don't block the writer, a busy timeout so
+    writers wait for the lock instead of failing with "database is locked",
+    and the SQLITE_SYNCHRONOUS fsync level. Other databases are left alone.
+    """
+    if engine.dialect.name != "sqlite" or engine.url.database in (None, "", ":memory:"):
+        return
+    if config.SQLITE_SYNCHRONOUS not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+        raise ValueError(f"Invalid SQLITE_SYNCHRONOUS: {config.SQLITE_SYNCHRONOUS!r}")
+
+    @sqlalchemy.event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"PRAGMA busy_timeout = {int(config.SQLITE_BUSY_TIMEOUT * 1000)}")
+            if config.SQLITE_WAL:
+                cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.execute(f"PRAGMA synchronous = {config.SQLITE_SYNCHRONOUS}")
+        finally:
+            cursor.close()
 
 def get_engine():
-    return create_engine(config.DB_URI)
+    engine = create_engine(config.DB_URI)
+    configure_sqlite(engine)
+    return engine
+
+def add_missing_columns(engine):
+    """
+    Add columns defined on the models but missing from existing tables.
+    create_all only creates whole tables, so a database created by an older
+    version would otherwise lack columns added since.
+    """
+    inspector = sqlalchemy.inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(sqlalchemy.text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+def add_missing_indexes(engine):
+    """Create indexes defined on the models but missing from existing tables."""
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=connection, checkfirst=True)
+
+def is_schema_race(error: SQLAlchemyError) -> bool:
+    """Whether creating a table, column or index failed because another process just created it."""
+    message = str(getattr(error, "orig", error)).lower()
+    return "already exists" in message or "duplicate column" in message
+
+def create_schema(engine, attempts: int = 5):
+    """
+    Create missing tables, columns and indexes. Server processes started
+    together on a new database all try this at once; the ones that lose a
+    race look at the schema again and carry on from there.
+    """
+    for attempt in range(attempts):
+        try:
+            Base.metadata.create_all(bind=engine)
+            add_missing_columns(engine)
+            add_missing_indexes(engine)
+            return
+        except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.ProgrammingError) as e:
+            if attempt == attempts - 1 or not is_schema_race(e):
+                raise
+            logger.debug("Schema changed while creating it, retrying: %s", e)
 
 def get_session_maker(engine=None):
     if engine is None:
         engine = get_engine()
-    Base.metadata.create_all(bind=engine)
+    create_schema(engine)
     return sqlalchemy.orm.sessionmaker(bind=engine)
 
+# Process-wide sessionmaker, so the engine and create_all run once rather than per request.
+_session_maker = None
+
+def get_default_session_maker():
+    global _session_maker
+    if _session_maker is None:
+        _session_maker = get_session_maker()
+    return _session_maker
+
+def reset_default_session_maker():
+    global _session_maker
+    if _session_maker is not None:
+        _session_maker.kw["bind"].dispose()
+    _session_maker = None
+
+# Dialects whose INSERT can skip rows that already exist.
+INSERT_IGNORING_CONFLICTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+def canonical_json(value) -> str:
+    """Compact JSON with sorted keys, so equal requests serialize to equal text."""
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+def compress_text(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"), config.LOG_COMPRESS_LEVEL)
+
+def decompress_text(data: bytes) -> str:
+    return zlib.decompress(data).decode("utf-8")
+
+def compact_logs(logs) -> Dict[str, bytes]:
+    """
+    Move the large texts of not yet written log records out of line: a
+    response over LOG_COMPRESS_BYTES is compressed into response_data, and a
+    request over it is replaced by the hash of its log_content row. Returns
+    the compressed contents to store, by hash.
+    """
+    threshold = config.LOG_COMPRESS_BYTES
+    contents = {}
+    if not threshold:
+        return contents
+    for log in logs:
+        if isinstance(log.request, str) and len(log.request) > threshold // 4:
+            data = log.request.encode("utf-8")
+            if len(data) > threshold:
+                digest = hashlib.sha256(data).hexdigest()
+                if digest not in contents:
+                    contents[digest] = zlib.compress(data, config.LOG_COMPRESS_LEVEL)
+                log.request_content = digest
+                log.request = None
+        if isinstance(log.response, str) and len(log.response) > threshold // 4:
+            data = log.response.encode("utf-8")
+            if len(data) > threshold:
+                log.response_data = zlib.compress(data, config.LOG_COMPRESS_LEVEL)
+                log.response = None
+    return contents
+
+def store_contents(session, contents: Dict[str, bytes]):
+    """Insert log_content rows not already present; safe against a concurrent writer inserting the same hash."""
+    if not contents:
+        return
+    existing = {digest for (digest,) in session.query(LogContent.hash).filter(LogContent.hash.in_(list(contents)))}
+    now = time.time()
+    rows = [{"hash": digest, "data": data, "created_at": now} for digest, data in contents.items() if digest not in existing]
+    if not rows:
+        return
+    insert = INSERT_IGNORING_CONFLICTS.get(session.get_bind().dialect.name)
+    if insert is not None:
+        session.execute(insert(LogContent).on_conflict_do_nothing(index_elements=["hash"]), rows)
+    else:
+        session.execute(sqlalchemy.insert(LogContent), rows)
+
+def add_logs(session, logs):
+    """Compact log records and add them, with their contents, to a session."""
+    store_contents(session, compact_logs(logs))
+    session.add_all(logs)
+
+def write_logs(logs, session_maker=None):
+    """Write several log records in a single transaction."""
+    if session_maker is None:
+        session_maker = get_default_session_maker()
+    session = session_maker()
+    try:
+        add_logs(session, logs)
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def log_filters(since: float = None, until: float = None, error: bool = None, model: str = None,
+                client_id: str = None) -> list:
+    """WHERE criteria on APIRequestLog for the given filters; None means don't filter."""
+    criteria = []
+    if since is not None:
+        criteria.append(APIRequestLog.timestamp >= since)
+    if until is not None:
+        criteria.append(APIRequestLog.timestamp < until)
+    if error is not None:
+        criteria.append(APIRequestLog.error_occurred == error)
+    if model is not None:
+        criteria.append(APIRequestLog.model == model)
+    if client_id is not None:
+        criteria.append(APIRequestLog.client_id == client_id)
+    return criteria
+
+def load_contents(session, logs) -> Dict[str, str]:
+    """The decompressed log_content texts referenced by `logs`, by hash, in one query."""
+    hashes = {log.request_content for log in logs if log.request_content}
+    if not hashes:
+        return {}
+    return {row.hash: decompress_text(row.data) for row in session.query(LogContent).filter(LogContent.hash.in_(hashes))}
+
+def log_request(log: APIRequestLog, contents: Dict[str, str]) -> Optional[str]:
+    if log.request_content:
+        return contents.get(log.request_content)
+    return log.request
+
+def log_response(log: APIRequestLog) -> Optional[str]:
+    if log.response_data is not None:
+        return decompress_text(log.response_data)
+    return log.response
+
+def log_to_dict(log: APIRequestLog, include_response: bool = False, contents: Dict[str, str] = None) -> Dict[str, Any]:
+    result = {
+        "id": log.id,
+        "timestamp": log.timestamp,
+        "duration": log.duration,
+        "model": log.model,
+        "client_id": log.client_id,
+        "priority": log.priority,
+        "queue_wait": log.queue_wait,
+        "returncode": log.returncode,
+        "error_occurred": log.error_occurred,
+        "error_details": log.error_details,
+        "request_hash": log.request_hash,
+        "spawn_latency": log.spawn_latency,
+        "time_to_first_output": log.time_to_first_output,
+        "generation_time": log.generation_time,
+        "output_bytes": log.output_bytes,
+        "output_tokens": log.output_tokens,
+        "tokens_per_second": log.tokens_per_second,
+        "predicted_duration": log.predicted_duration,
+        "request": log_request(log, contents or {}),
+    }
+    if include_response:
+        result["response"] = log_response(log)
+    return result
+
+def query_logs(session_maker=None, before: int = None, limit: int = 100, include_response: bool = False,
+               **filters) -> Dict[str, Any]:
+    """
+    One page of request log records, newest first. Pages are keyed on the
+    record id rather than an offset: pass the returned `next` as `before` to
+    get the following page, which costs the same however deep it is.
+    """
+    if session_maker is None:
+        session_maker = get_default_session_maker()
+    criteria = log_filters(**filters)
+    if before is not None:
+        criteria.append(APIRequestLog.id < before)
+    session = session_maker()
+    try:
+        logs = (
+            session.query(APIRequestLog).filter(*criteria)
+            .order_by(APIRequestLog.id.desc()).limit(limit + 1).all()
+        )
+        contents = load_contents(session, logs[:limit])
+        page = [log_to_dict(log, include_response, contents) for log in logs[:limit]]
+    finally:
+        session.close()
+    return {"logs": page, "next": page[-1]["id"] if len(logs) > limit else None}
+
+def recent_generations(model: str, limit: int, session_maker=None) -> List[Tuple[Dict[str, Any], float]]:
+    """
+    The requests and generation times of the model's latest `limit`
+    successful executor runs, oldest first, to fit a runtime predictor on.
+    """
+    if session_maker is None:
+        session_maker = get_default_session_maker()
+    session = session_maker()
+    try:
+        logs = (
+            session.query(APIRequestLog)
+            .filter(APIRequestLog.model == model, APIRequestLog.error_occurred.is_(False),
+                    APIRequestLog.generation_time.isnot(None))
+            .order_by(APIRequestLog.timestamp.desc()).limit(limit).all()
+        )
+        contents = load_contents(session, logs)
+        runs = []
+        for log in reversed(logs):
+            request = log_request(log, contents)
+            if request is not None:
+                runs.append((json.loads(request), log.generation_time))
+        return runs
+    finally:
+        session.close()
+
+def log_stats(session_maker=None, percentiles=(0.5, 0.9, 0.99), **filters) -> Dict[str, Any]:
+    """
+    Counts, durations, queue waits and executor timings of the matching
+    request log records, all computed in the database. Percentiles are
+    nearest-rank, all read in one pass over the durations in order (along
+    the duration index), which stops at the highest rank asked for.
+    """
+    if session_maker is None:
+        session_maker = get_default_session_maker()
+    criteria = log_filters(**filters)
+    session = session_maker()
+    try:
+        (count, errors, timed_count, mean, longest, mean_wait, mean_first_output, mean_spawn,
+         mean_rate) = session.query(
+            func.count(APIRequestLog.id),
+            func.count(APIRequestLog.id).filter(APIRequestLog.error_occurred.is_(True)),
+            func.count(APIRequestLog.duration),
+            func.avg(APIRequestLog.duration),
+            func.max(APIRequestLog.duration),
+            func.avg(APIRequestLog.queue_wait),
+            func.avg(APIRequestLog.time_to_first_output),
+            func.avg(APIRequestLog.spawn_latency),
+            func.avg(APIRequestLog.tokens_per_second),
+        ).filter(*criteria).one()
+        duration = {"mean": mean, "max": longest}
+        ranks = {}
+        for p in percentiles:
+            duration[f"p{p * 100:g}"] = None
+            ranks.setdefault(max(0, math.ceil(p * timed_count) - 1), []).append(p)
+        if timed_count and ranks:
+            ordered = session.query(APIRequestLog.duration).filter(
+                *criteria, APIRequestLog.duration.isnot(None)
+            ).order_by(APIRequestLog.duration).limit(max(ranks) + 1).yield_per(1000)
+            for rank, (value,) in enumerate(ordered):
+                for p in ranks.get(rank, ()):
+                    duration[f"p{p * 100:g}"] = value
+        by_model = {
+            model: {"count": model_count, "errors": model_errors}
+            for model, model_count, model_errors in session.query(
+                APIRequestLog.model,
+                func.count(APIRequestLog.id),
+                func.count(APIRequestLog.id).filter(APIRequestLog.error_occurred.is_(True)),
+            ).filter(*criteria).group_by(APIRequestLog.model)
+        }
+    finally:
+        session.close()
+    return {"count": count, "errors": errors, "duration": duration, "queue_wait": {"mean": mean_wait},
+            "spawn_latency": {"mean": mean_spawn}, "time_to_first_output": {"mean": mean_first_output},
+            "tokens_per_second": {"mean": mean_rate}, "models": by_model}
+
 class SessionManager:
     def __init__(self, log, session_maker=None):
         if session_maker is None:
-            session_maker = get_session_maker()
+            session_maker = get_default_session_maker()
         self.session = session_maker()
         self.log = log
 
     def __enter__(self):
+        store_contents(self.session, compact_logs([self.log]))
         self.session.add(self.log)
         return self.session
 
@@ -52,4 +445,90 @@ class SessionManager:
             self.session.close()
 
         # Return False to propagate the exception, if one occurred.
-        return False
\ No newline at end of file
+        return False
+
+class LogWriter:
+    """
+    Collects APIRequestLog records in memory and writes them from a background
+    task in batched transactions, so request handlers never wait on a commit.
+
+    A batch is flushed once it reaches `batch_size` records or `flush_interval`
+    seconds after its first record, whichever comes first. The commit itself
+    runs in a thread. `stop()` flushes everything still queued.
+    """
+
+    def __init__(self, session_maker=None, batch_size=100, flush_interval=1.0, max_pending=10000):
+        self.session_maker = session_maker
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self._queue = None
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        if self.session_maker is None:
+            self.session_maker = get_default_session_maker()
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, log):
+        # Blocks only when max_pending records are already waiting, i.e. the
+        # database can't keep up; that backpressure is preferable to unbounded memory.
+        await self._queue.put(log)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    log = self._queue.get_nowait() if remaining <= 0 else await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if log is None:
+                    stopping = True
+                    break
+                batch.append(log)
+            await asyncio.to_thread(self.write_batch, batch)
+
+    def write_batch(self, batch):
+        session = self.session_maker()
+        try:
+            with metrics.stage("log_commit"):
+                add_logs(session, batch)
+                session.commit()
+            self.written += len(batch)
+            self.batches += 1
+        except SQLAlchemyError:
+            session.rollback()
+            self.failed += len(batch)
+            logger.exception("Failed to write %d request log records", len(batch))
+        finally:
+            session.close()
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
@@ -0,0 +1,334 @@
+import asyncio
+import itertools
+import logging
+import math
+import time
+from typing import List
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from gull_api import config
+
+logger = logging.getLogger(__name__)
+
+# Headers that describe one connection rather than the message, so they are
+# not passed through in either direction.
+HOP_BY_HOP = frozenset({
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+    "transfer-encoding", "upgrade",
+})
+
+# A backend that fails like this is marked down and the request is sent to
+# the next one. Read timeouts are not among them: the generation may still
+# be running there.
+FAILOVER_ERRORS = (httpx.NetworkError, httpx.RemoteProtocolError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+class Backend:
+    """
+    One gull_api node as the dispatcher sees it: whether its last poll
+    succeeded, the slots and queue it reported then, and the requests this
+    dispatcher has in flight on it. Each has its own pool of keep-alive
+    connections.
+    """
+
+    def __init__(self, url: str, timeout: httpx.Timeout, max_connections: int, transport=None):
+        self.url = url.rstrip("/")
+        self.client = httpx.AsyncClient(
+            base_url=self.url, timeout=timeout, transport=transport,
+            # Below uvicorn's 5 second keep-alive, so the backend never closes a connection as it is reused.
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                                keepalive_expiry=4.0),
+        )
+        self.healthy = False
+        self.active = 0
+        self.waiting = 0
+        self.capacity = 1
+        self.in_flight = 0
+        self._in_flight_at_poll = 0
+        self.forwarded = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_checked = None
+
+    @property
+    def load(self) -> float:
+        """
+        Generations running or queued per slot: as reported at the last poll,
+        corrected for the requests sent here or finished since.
+        """
+        queued = self.active + self.waiting + self.in_flight - self._in_flight_at_poll
+        return max(queued, self.in_flight) / self.capacity
+
+    def update(self, ready: bool, status: dict):
+        # Models share the node's cores, so their queues are added up.
+        admission = (status.get("admission") or {}).values()
+        self.active = sum(model["active"] for model in admission)
+        self.waiting = sum(model["waiting"] for model in admission)
+        self.capacity = max((model["max_concurrency"] for model in admission), default=1)
+        self._in_flight_at_poll = self.in_flight
+        self.healthy = ready
+        self.last_error = None if ready else "not ready"
+        self.last_checked = time.time()
+
+    def fail(self, error: Exception):
+        self.healthy = False
+        self.failures += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "active": self.active,
+            "waiting": self.waiting,
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "load": self.load,
+            "forwarded": self.forwarded,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_checked": self.last_checked,
+        }
+
+def forward_headers(request: Request) -> dict:
+    headers = {
+        name: value for name, value in request.headers.items()
+        if name not in HOP_BY_HOP and name not in ("host", "content-length")
+    }
+    host = request.client.host if request.client else None
+    if host is not None:
+        forwarded_for = headers.get("x-forwarded-for")
+        headers["x-forwarded-for"] = f"{forwarded_for}, {host}" if forwarded_for else host
+        # Backends tell callers without a key or client id apart by address,
+        # which would otherwise be the dispatcher's for all of them.
+        client_id_header = config.CLIENT_ID_HEADER.lower()
+        if not (headers.get("x-api-key") or headers.get("authorization") or headers.get(client_id_header)):
+            headers[client_id_header] = host
+    return headers
+
+def response_headers(response: httpx.Response) -> dict:
+    return {name: value for name, value in response.headers.items() if name not in HOP_BY_HOP}
+
+async def wait_for_disconnect(request: Request):
+    # The body has already been read, so the next message is the disconnect
+    # (or, once the response has been sent, a synthetic one).
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+class Dispatcher:
+    """
+    Forwards requests to the least-loaded healthy backend. Every
+    `health_interval` seconds each backend's /ready and /status are polled;
+    one that can't be reached, or isn't ready, gets no requests until a
+    later poll succeeds.
+
+    A request that can't be delivered, or that a backend turns away with a
+    503 because its queue is full, is tried on the next backend in order of
+    load. Responses are streamed back as they arrive. A client that goes
+    away before the backend answers has its request cancelled there.
+    """
+
+    def __init__(self, urls: List[str], health_interval: float = 1.0, connect_timeout: float = 2.0,
+                 timeout: float = None, max_connections: int = 100, transport=None):
+        self.health_interval = health_interval
+        self.connect_timeout = connect_timeout
+        request_timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.backends = [Backend(url, request_timeout, max_connections, transport) for url in urls]
+        self.failovers = 0
+        self.unavailable = 0
+        self.disconnected = 0
+        self._turn = itertools.count()
+        self._task = None
+
+    @property
+    def ready(self) -> bool:
+        return any(backend.healthy for backend in self.backends)
+
+    async def check(self, backend: Backend):
+        try:
+            ready = await backend.client.get("/ready", timeout=self.connect_timeout)
+            status = await backend.client.get("/status", timeout=self.connect_timeout)
+            status.raise_for_status()
+            backend.update(ready.status_code == 200, status.json())
+        except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+            if backend.healthy:
+                logger.warning("Backend %s failed its health check: %s", backend.url, e)
+            backend.fail(e)
+            backend.last_checked = time.time()
+
+    async def check_all(self):
+        await asyncio.gather(*(self.check(backend) for backend in self.backends))
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_all()
+
+    async def start(self):
+        await self.check_all()
+        self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for backend in self.backends:
+            await backend.client.aclose()
+
+    def candidates(self) -> List[Backend]:
+        """Healthy backends, least loaded first; ties are taken in turn."""
+        healthy = [backend for backend in self.backends if backend.healthy]
+        if not healthy:
+            return []
+        turn = next(self._turn) % len(healthy)
+        return sorted(healthy[turn:] + healthy[:turn], key=lambda backend: backend.load)
+
+    async def forward(self, request: Request) -> Response:
+        body = await request.body()
+        headers = forward_headers(request)
+        rejected = None
+        for backend in self.candidates():
+            backend.in_flight += 1
+            try:
+                response = await self.send(backend, request, headers, body)
+            except FAILOVER_ERRORS as e:
+                backend.in_flight -= 1
+                logger.warning("Backend %s failed, trying the next one: %s", backend.url, e)
+                backend.fail(e)
+                self.failovers += 1
+                continue
+            except BaseException:
+                backend.in_flight -= 1
+                raise
+            if response is None:
+                backend.in_flight -= 1
+                self.disconnected += 1
+                # Nobody is listening for this response; the status only shows up in access logs.
+                return Response(status_code=499)
+            if response.status_code == 503:
+                # Turned away before anything ran; another backend may have room.
+                content = await response.aread()
+                await response.aclose()
+                backend.in_flight -= 1
+                rejected = Response(content, status_code=503, headers=response_headers(response))
+                self.failovers += 1
+                continue
+            backend.forwarded += 1
+            return self.relay(backend, response)
+        self.unavailable += 1
+        if rejected is not None:
+            return rejected
+        return JSONResponse(
+            {"detail": "No backend is available."}, status_code=503,
+            headers={"Retry-After": str(math.ceil(self.health_interval))},
+        )
+
+    async def send(self, backend: Backend, request: Request, headers: dict, body: bytes):
+        """
+        Send the request to `backend` and return its response once the headers
+        are in, or None if the client disconnects first. A /llm response only
+        starts once the generation is done, so the send is cancelled then:
+        that drops the connection, and the backend cancels the generation.
+        """
+        sending = asyncio.ensure_future(backend.client.send(backend.client.build_request(
+            request.method, request.url.path, params=request.query_params.multi_items(),
+            headers=headers, content=body,
+        ), stream=True))
+        watcher = asyncio.ensure_future(wait_for_disconnect(request))
+        try:
+            await asyncio.wait({sending, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            watcher.cancel()
+            if not sending.done():
+                sending.cancel()
+                await asyncio.wait({sending})
+        if sending.cancelled():
+            return None
+        return sending.result()
+
+    def relay(self, backend: Backend, response: httpx.Response) -> StreamingResponse:
+        released = False
+
+        async def release():
+            nonlocal released
+            if not released:
+                released = True
+                backend.in_flight -= 1
+                # Closing an unfinished response drops its connection, so a backend
+                # cancels the generation of a client that went away.
+                await response.aclose()
+
+        async def body():
+            try:
+                async for chunk in response.aiter_raw():
+                    yield chunk
+            finally:
+                await release()
+
+        return StreamingResponse(
+            body(), status_code=response.status_code, headers=response_headers(response),
+            background=BackgroundTask(release),
+        )
+
+    def stats(self) -> dict:
+        return {
+            "backends": [backend.stats() for backend in self.backends],
+            "failovers": self.failovers,
+            "unavailable": self.unavailable,
+            "disconnected": self.disconnected,
+        }
+
+app = FastAPI()
+
+# Set at startup from DISPATCH_BACKENDS.
+dispatcher = None
+
+@app.on_event("startup")
+async def start_dispatcher():
+    global dispatcher
+    urls = [url.strip() for url in config.DISPATCH_BACKENDS.split(",") if url.strip()]
+    if not urls:
+        raise RuntimeError("DISPATCH_BACKENDS names no backends")
+    dispatcher = Dispatcher(
+        urls,
+        health_interval=config.DISPATCH_HEALTH_INTERVAL,
+        connect_timeout=config.DISPATCH_CONNECT_TIMEOUT,
+        timeout=config.DISPATCH_TIMEOUT or None,
+        max_connections=config.DISPATCH_MAX_CONNECTIONS,
+    )
+    await dispatcher.start()
+
+@app.on_event("shutdown")
+async def stop_dispatcher():
+    global dispatcher
+    if dispatcher is not None:
+        await dispatcher.stop()
+        dispatcher = None
+
+@app.get("/ready")
+def get_ready():
+    """200 while at least one backend is healthy, 503 otherwise."""
+    healthy = sum(backend.healthy for backend in dispatcher.backends)
+    body = {"ready": healthy > 0, "healthy_backends": healthy}
+    if not healthy:
+        return JSONResponse(body, status_code=503)
+    return body
+
+@app.get("/status")
+def get_status():
+    return {"dispatcher": dispatcher.stats()}
+
+@app.get("/api")
+async def get_api(request: Request):
+    return await dispatcher.forward(request)
+
+@app.post("/llm")
+async def post_llm(request: Request):
+    return await dispatcher.forward(request)
+
+@app.post("/llm/{path:path}")
+async def post_llm_path(request: Request, path: str):
+    """/llm/stream, /llm/batch and the per-model routes."""
+    return await dispatcher.forward(request)
@@ -0,0 +1,284 @@
+import asyncio
+import codecs
+import os
+import re
+import signal
+import subprocess
+import tempfile
+import time
+from typing import AsyncIterator, List, Optional, Tuple
+import anyio
+from gull_api import config
+from gull_api.spawner import posix_spawn_exec
+
+class TruncatedText(str):
+    """Captured output that hit its size cap; `limit` is the cap in bytes."""
+
+    truncated = True
+
+    def __new__(cls, text: str, limit: int):
+        obj = super().__new__(cls, text)
+        obj.limit = limit
+        return obj
+
+def cap_text(text: str, max_bytes: int) -> str:
+    """Cut `text` to at most `max_bytes` of UTF-8 (0 means no cap), as a TruncatedText if it was cut."""
+    if not max_bytes or len(text) * 4 <= max_bytes:
+        return text
+    data = text.encode("utf-8")
+    if len(data) <= max_bytes:
+        return text
+    return TruncatedText(data[:max_bytes].decode("utf-8", errors="ignore"), max_bytes)
+
+class BoundedBuffer:
+    """
+    Collects a byte stream in memory until it passes `spill_bytes`, then in a
+    temporary file. At most `max_bytes` are kept (0 means no cap); the rest is
+    read and dropped so the writer never blocks, and `truncated` is set.
+    """
+
+    def __init__(self, max_bytes: int, spill_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.truncated = False
+        self._file = tempfile.SpooledTemporaryFile(max_size=spill_bytes)
+
+    def write(self, data: bytes):
+        if self.max_bytes and self.size + len(data) > self.max_bytes:
+            data = data[:self.max_bytes - self.size]
+            self.truncated = True
+        if data:
+            self._file.write(data)
+            self.size += len(data)
+
+    def text(self) -> str:
+        self._file.seek(0)
+        text = self._file.read().decode("utf-8", errors="replace")
+        self._file.close()
+        return TruncatedText(text, self.max_bytes) if self.truncated else text
+
+# llama.cpp's timing report on stderr, e.g.
+# "llama_print_timings:        eval time =  1234.56 ms /    99 runs   (...)".
+EVAL_TIMING = re.compile(r"^\S+:\s+eval time\s*=\s*([\d.]+) ms\s*/\s*(\d+) (?:runs|tokens)", re.MULTILINE)
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for executables that don't report one: words and punctuation marks."""
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+class GenerationTiming:
+    """
+    Where the time in one executor run went. Times are taken with
+    time.monotonic() from just before the spawn: `spawned` once the process
+    exists, `first_output` when its first stdout bytes arrive and `finished`
+    once it has exited.
+
+    The token count comes from llama.cpp's timing report on stderr when the
+    executable prints one, and is estimated from the output otherwise.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.spawned = None
+        self.first_output = None
+        self.finished = None
+        self.output_bytes = 0
+        self.tokens = None
+        self.tokens_reported = False
+        self._eval_seconds = None
+
+    def mark_spawned(self):
+        self.spawned = time.monotonic()
+
+    def mark_output(self, size: int):
+        if self.first_output is None and size:
+            self.first_output = time.monotonic()
+        self.output_bytes += size
+
+    def mark_finished(self):
+        self.finished = time.monotonic()
+
+    def count_tokens(self, stdout: str, stderr: str):
+        report = EVAL_TIMING.findall(stderr or "")
+        if report:
+            milliseconds, tokens = report[-1]
+            self.tokens = int(tokens)
+            self.tokens_reported = True
+            self._eval_seconds = float(milliseconds) / 1000
+        else:
+            self.tokens = estimate_tokens(stdout or "")
+
+    def _since(self, start: Optional[float], end: Optional[float]) -> Optional[float]:
+        if start is None or end is None:
+            return None
+        return round(end - start, 6)
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        if self._eval_seconds:
+            return round(self.tokens / self._eval_seconds, 3)
+        # Decoding speed: tokens over the time from the first output to exit.
+        decoding = self._since(self.first_output or self.spawned, self.finished)
+        if not self.tokens or not decoding:
+            return None
+        return round(self.tokens / decoding, 3)
+
+    def stats(self) -> dict:
+        return {
+            "spawn_latency": self._since(self.started, self.spawned),
+            "time_to_first_output": self._since(self.started, self.first_output),
+            "generation_time": self._since(self.started, self.finished),
+            "output_bytes": self.output_bytes,
+            "output_tokens": self.tokens,
+            "tokens_reported": self.tokens_reported,
+            "tokens_per_second": self.tokens_per_second,
+        }
+
+async def spawn_process(command: List[str]):
+    """
+    Start an executor process in a session of its own (so the whole process
+    group can be signalled) with stdout and stderr piped, using SPAWN_METHOD.
+    """
+    if config.SPAWN_METHOD == "posix_spawn":
+        return await posix_spawn_exec(command)
+    return await asyncio.create_subprocess_exec(
+        *command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True
+    )
+
+async def drain(stream, buffer: BoundedBuffer, chunk_size: int = 65536, timing: GenerationTiming = None):
+    while True:
+        data = await stream.read(chunk_size)
+        if not data:
+            return
+        if timing is not None:
+            timing.mark_output(len(data))
+        buffer.write(data)
+
+async def capture_output(process, timing: GenerationTiming = None) -> Tuple[BoundedBuffer, BoundedBuffer]:
+    """
+    Read a process's stdout and stderr to EOF under the STDOUT_MAX_BYTES and
+    STDERR_MAX_BYTES caps, then wait for it to exit. A bounded replacement
+    for `process.communicate()`. Output arrival and exit are marked on
+    `timing` if given.
+    """
+    stdout = BoundedBuffer(config.STDOUT_MAX_BYTES, config.OUTPUT_SPILL_BYTES)
+    stderr = BoundedBuffer(config.STDERR_MAX_BYTES, config.OUTPUT_SPILL_BYTES)
+    await asyncio.gather(drain(process.stdout, stdout, timing=timing), drain(process.stderr, stderr))
+    await process.wait()
+    if timing is not None:
+        timing.mark_finished()
+    return stdout, stderr
+
+async def terminate_process(process, grace: float = None):
+    """
+    Stop a child started with start_new_session=True and reap it: SIGTERM to
+    its process group, then SIGKILL to the group once the leader has exited or
+    `grace` seconds have passed, so no grandchildren outlive it.
+    """
+    if process.returncode is not None:
+        return
+    if grace is None:
+        grace = config.KILL_GRACE_PERIOD
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    try:
+        await asyncio.wait_for(process.wait(), timeout=grace)
+    except asyncio.TimeoutError:
+        pass
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    await process.wait()
+
+class StreamingProcess:
+    """
+    Runs a command and yields its stdout as text while the process writes it.
+
+    Bytes are decoded incrementally, so a multibyte UTF-8 character split
+    across two reads is emitted whole in the later chunk. stderr is drained
+    in the background so a chatty child can't block on a full pipe. Once
+    `chunks()` is exhausted, `stdout`, `stderr` and `returncode` hold the
+    complete result, with the stored copies capped at STDOUT_MAX_BYTES and
+    STDERR_MAX_BYTES (the client still receives every chunk).
+    """
+
+    def __init__(self, command: List[str], timeout: float, chunk_size: int = 4096):
+        self.command = command
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.process = None
+        self.returncode = None
+        self.stderr = ""
+        self._stdout_parts = []
+        self._stdout_size = 0
+        self.stdout_truncated = False
+        self._stderr = None
+        self._stderr_task = None
+        self._deadline = None
+        self.timing = None
+
+    @property
+    def stdout(self) -> str:
+        text = "".join(self._stdout_parts)
+        return TruncatedText(text, config.STDOUT_MAX_BYTES) if self.stdout_truncated else text
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._deadline = loop.time() + self.timeout
+        self.timing = GenerationTiming()
+        self.process = await spawn_process(self.command)
+        self.timing.mark_spawned()
+        self._stderr = BoundedBuffer(config.STDERR_MAX_BYTES, config.OUTPUT_SPILL_BYTES)
+        self._stderr_task = asyncio.create_task(drain(self.process.stderr, self._stderr))
+
+    def _remaining(self) -> float:
+        remaining = self._deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            raise asyncio.TimeoutError
+        return remaining
+
+    async def chunks(self) -> AsyncIterator[str]:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        try:
+            while True:
+                data = await asyncio.wait_for(self.process.stdout.read(self.chunk_size), timeout=self._remaining())
+                self.timing.mark_output(len(data))
+                text = decoder.decode(data, final=not data)
+                if text:
+                    self._keep(text)
+                    yield text
+                if not data:
+                    break
+            await asyncio.wait_for(self._stderr_task, timeout=self._remaining())
+            self.stderr = self._stderr.text()
+            self.returncode = await asyncio.wait_for(self.process.wait(), timeout=self._remaining())
+            self.timing.mark_finished()
+            self.timing.count_tokens(self.stdout, self.stderr)
+        finally:
+            if self.returncode is None:
+                # Timed out, failed or the consumer went away: don't leave the child running.
+                await self.kill()
+
+    def _keep(self, text: str):
+        limit = config.STDOUT_MAX_BYTES
+        if self.stdout_truncated:
+            return
+        if limit:
+            data = text.encode("utf-8")
+            room = limit - self._stdout_size
+            if len(data) > room:
+                text = data[:room].decode("utf-8", errors="ignore")
+                self.stdout_truncated = True
+            self._stdout_size += min(len(data), room)
+        self._stdout_parts.append(text)
+
+    async def kill(self):
+        # Shielded: a disconnect cancels the response through an anyio cancel
+        # scope, which would cancel every await here too and skip the SIGKILL.
+        with anyio.CancelScope(shield=True):
+            if self.process is not None and self.process.returncode is None:
+                await terminate_process(self.process)
+        if self._stderr_task is not None and not self._stderr_task.done():
+            self._stderr_task.cancel()
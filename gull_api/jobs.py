@@ -0,0 +1,352 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from sqlalchemy import delete, or_, update
+from sqlalchemy.exc import SQLAlchemyError
+from gull_api.db import Job, get_default_session_maker
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+# Seconds between prunes of finished jobs.
+PRUNE_INTERVAL = 60
+
+class JobRetry(Exception):
+    """Raised by a job handler to put the job back in the queue for `delay` seconds, e.g. when at capacity."""
+
+    def __init__(self, delay: float):
+        super().__init__(f"retry in {delay}s")
+        self.delay = delay
+
+def job_to_dict(job: Job) -> Dict[str, Any]:
+    result = {
+        "id": job.id,
+        "model": job.model,
+        "status": job.status,
+        "attempts": job.attempts,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+    if job.status == SUCCEEDED:
+        result["response"] = job.response
+        if job.truncated:
+            result["truncated"] = True
+    elif job.status == FAILED:
+        result["error"] = job.error
+        result["status_code"] = job.status_code
+    return result
+
+class JobQueue:
+    """
+    The jobs table, used as a queue shared by every server process on the
+    same database.
+
+    A process claims a queued job with a conditional UPDATE, so when several
+    try at once exactly one wins. The claim carries a lease that the runner
+    renews while the job runs; if the process dies, the lease runs out and
+    the job is queued again, up to `max_attempts` runs. Results are only
+    accepted from the process that holds the claim. Finished jobs, with
+    their results, are kept for `retention` seconds (0 keeps them forever).
+
+    Methods other than `wait` do blocking database work; call them in a thread.
+    """
+
+    def __init__(self, session_maker=None, worker_id: str = None, lease: float = 30.0, max_attempts: int = 3,
+                 retention: float = 0):
+        self.session_maker = session_maker
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.pruned = 0
+        # Set when a job finishes in this process, to wake long-polls early;
+        # kept only while someone is waiting on the job.
+        self._finished = {}
+        self._waiters = {}
+
+    def _session(self):
+        if self.session_maker is None:
+            self.session_maker = get_default_session_maker()
+        return self.session_maker()
+
+    def _update(self, *criteria, **values) -> int:
+        session = self._session()
+        try:
+            result = session.execute(update(Job).where(*criteria).values(**values))
+            session.commit()
+            return result.rowcount
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def submit(self, model: str, request: Dict[str, Any], timeout: float = None,
+               client_id: str = None, priority: str = None) -> Dict[str, Any]:
+        now = time.time()
+        job = Job(
+            id=uuid.uuid4().hex, model=model, request=json.dumps(request), status=QUEUED, timeout=timeout,
+            client_id=client_id, priority=priority, attempts=0, available_at=now, created_at=now,
+        )
+        session = self._session()
+        try:
+            session.add(job)
+            session.commit()
+            return job_to_dict(job)
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        session = self._session()
+        try:
+            job = session.get(Job, job_id)
+            return job_to_dict(job) if job is not None else None
+        finally:
+            session.close()
+
+    def claim(self, limit: int = 1) -> List[Dict[str, Any]]:
+        """Claim up to `limit` of the oldest runnable jobs; returns them with their payloads."""
+        now = time.time()
+        session = self._session()
+        try:
+            candidates = [
+                job_id for (job_id,) in session.query(Job.id)
+                .filter(Job.status == QUEUED, or_(Job.available_at.is_(None), Job.available_at <= now))
+                .order_by(Job.created_at)
+                .limit(limit * 2)
+            ]
+        finally:
+            session.close()
+        claimed = []
+        for job_id in candidates:
+            if len(claimed) >= limit:
+                break
+            won = self._update(
+                Job.id == job_id, Job.status == QUEUED,
+                status=RUNNING, worker=self.worker_id, lease_expires=now + self.lease,
+                started_at=now, attempts=Job.attempts + 1,
+            )
+            if won:
+                claimed.append(job_id)
+        if not claimed:
+            return []
+        session = self._session()
+        try:
+            jobs = session.query(Job).filter(Job.id.in_(claimed)).order_by(Job.created_at).all()
+            return [dict(job_to_dict(job), request=json.loads(job.request), timeout=job.timeout,
+                         client_id=job.client_id, priority=job.priority) for job in jobs]
+        finally:
+            session.close()
+
+    def heartbeat(self, job_ids: List[str]):
+        if job_ids:
+            self._update(Job.id.in_(job_ids), Job.worker == self.worker_id, Job.status == RUNNING,
+                         lease_expires=time.time() + self.lease)
+
+    def finish(self, job_id: str, status: str, response: str = None, truncated: bool = False,
+               error: str = None, status_code: int = None) -> bool:
+        """Record a result; False if this process no longer holds the job."""
+        return bool(self._update(
+            Job.id == job_id, Job.worker == self.worker_id, Job.status == RUNNING,
+            status=status, response=response, truncated=truncated, error=error,
+            status_code=status_code, finished_at=time.time(), lease_expires=None,
+        ))
+
+    def retry(self, job_id: str, delay: float = 0.0):
+        """Hand a claimed job back to the queue without counting the attempt."""
+        self._update(
+            Job.id == job_id, Job.worker == self.worker_id, Job.status == RUNNING,
+            status=QUEUED, worker=None, lease_expires=None, started_at=None,
+            available_at=time.time() + delay, attempts=Job.attempts - 1,
+        )
+
+    def recover_expired(self) -> int:
+        """Requeue, or fail after max_attempts, jobs whose runner stopped renewing its lease."""
+        now = time.time()
+        expired = (Job.status == RUNNING, Job.lease_expires < now)
+        failed = self._update(
+            *expired, Job.attempts >= self.max_attempts,
+            status=FAILED, error="The job's worker stopped while running it.", status_code=500,
+            finished_at=now, lease_expires=None,
+        )
+        requeued = self._update(
+            *expired, status=QUEUED, worker=None, lease_expires=None, started_at=None, available_at=now,
+        )
+        return failed + requeued
+
+    def prune(self) -> int:
+        """Delete jobs that finished more than `retention` seconds ago; returns how many."""
+        if self.retention <= 0:
+            return 0
+        session = self._session()
+        try:
+            result = session.execute(delete(Job).where(
+                Job.finished_at < time.time() - self.retention, Job.status.in_(FINISHED),
+            ))
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        self.pruned += result.rowcount
+        return result.rowcount
+
+    def notify_finished(self, job_id: str):
+        event = self._finished.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def wait(self, job_id: str, timeout: float, poll_interval: float = 1.0) -> Optional[Dict[str, Any]]:
+        """
+        Return the job once it has finished, or as it stands after `timeout`
+        seconds. Jobs finished by this process wake the wait immediately;
+        ones finished elsewhere are noticed within `poll_interval`.
+        """
+        deadline = time.monotonic() + timeout
+        self._waiters[job_id] = self._waiters.get(job_id, 0) + 1
+        try:
+            while True:
+                job = await asyncio.to_thread(self.get, job_id)
+                remaining = deadline - time.monotonic()
+                if job is None or job["status"] in FINISHED or remaining <= 0:
+                    return job
+                event = self._finished.setdefault(job_id, asyncio.Event())
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(poll_interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # Jobs finished by another process, or never, are not notified here.
+            self._waiters[job_id] -= 1
+            if not self._waiters[job_id]:
+                del self._waiters[job_id]
+                self._finished.pop(job_id, None)
+
+class JobRunner:
+    """
+    Claims jobs from a JobQueue and runs up to `concurrency` of them at once
+    with `handler`, which returns the fields for `JobQueue.finish` or raises
+    JobRetry. Leases of running jobs are renewed in the background, finished
+    jobs past the queue's retention are pruned every PRUNE_INTERVAL seconds,
+    and jobs still running at `stop()` are handed back to the queue.
+    """
+
+    def __init__(self, queue: JobQueue, handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+                 concurrency: int, poll_interval: float = 1.0):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self._running = {}
+        self._wakeup = None
+        self._tasks = []
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._claim_loop()), asyncio.create_task(self._lease_loop())]
+
+    def notify(self):
+        """Look for work now rather than at the next poll, e.g. after a local submit."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        running = dict(self._running)
+        for task in running.values():
+            task.cancel()
+        await asyncio.gather(*running.values(), return_exceptions=True)
+        for job_id in running:
+            await asyncio.to_thread(self.queue.retry, job_id)
+
+    async def _claim_loop(self):
+        while True:
+            self._wakeup.clear()
+            free = self.concurrency - len(self._running)
+            if free > 0:
+                try:
+                    jobs = await asyncio.to_thread(self.queue.claim, free)
+                except SQLAlchemyError:
+                    logger.exception("Failed to claim jobs")
+                    jobs = []
+                for job in jobs:
+                    self._running[job["id"]] = asyncio.create_task(self._run(job))
+                if jobs and len(jobs) == free:
+                    continue
+            # A timer rather than wait_for, which on Python 3.11 can swallow the
+            # cancellation from stop() when it lands as the timeout fires.
+            timer = asyncio.get_running_loop().call_later(self.poll_interval, self._wakeup.set)
+            try:
+                await self._wakeup.wait()
+            finally:
+                timer.cancel()
+
+    async def _lease_loop(self):
+        pruned_at = time.monotonic()
+        while True:
+            await asyncio.sleep(self.queue.lease / 3)
+            try:
+                await asyncio.to_thread(self.queue.heartbeat, list(self._running))
+                await asyncio.to_thread(self.queue.recover_expired)
+            except SQLAlchemyError:
+                logger.exception("Failed to renew job leases")
+            if time.monotonic() - pruned_at >= PRUNE_INTERVAL:
+                pruned_at = time.monotonic()
+                try:
+                    await asyncio.to_thread(self.queue.prune)
+                except SQLAlchemyError:
+                    logger.exception("Failed to prune finished jobs")
+
+    async def _run(self, job: Dict[str, Any]):
+        try:
+            try:
+                outcome = await self.handler(job)
+            except JobRetry as e:
+                self.retried += 1
+                await asyncio.to_thread(self.queue.retry, job["id"], e.delay)
+                return
+            except Exception as e:
+                logger.exception("Job %s failed", job["id"])
+                outcome = {"status": FAILED, "error": str(e), "status_code": 500}
+            if outcome["status"] == SUCCEEDED:
+                self.completed += 1
+            else:
+                self.failed += 1
+            if not await asyncio.to_thread(self.queue.finish, job["id"], **outcome):
+                logger.warning("Job %s was taken over by another worker; result discarded", job["id"])
+            self.queue.notify_finished(job["id"])
+        finally:
+            self._running.pop(job["id"], None)
+            self.notify()
+
+    def stats(self) -> dict:
+        return {
+            "worker": self.queue.worker_id,
+            "running": len(self._running),
+            "concurrency": self.concurrency,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "pruned": self.queue.pruned,
+        }
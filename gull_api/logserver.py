@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+from typing import Any, Dict
+from gull_api import config
+from gull_api.db import APIRequestLog, LogWriter, get_default_session_maker
+
+logger = logging.getLogger(__name__)
+
+def log_to_record(log: APIRequestLog) -> Dict[str, Any]:
+    """The column values of an unwritten log record, for sending to the log writer process."""
+    return {
+        column.name: getattr(log, column.name) for column in APIRequestLog.__table__.columns
+        if column.name != "id" and getattr(log, column.name) is not None
+    }
+
+class SocketLogWriter:
+    """
+    Stands in for LogWriter in LOG_MODE "socket": instead of writing to the
+    database, each server process sends its log records as JSON lines over a
+    Unix socket to one log writer process, so only one process ever writes
+    to the SQLite file.
+
+    Records wait in memory while the writer is unreachable and are sent once
+    it is back. Like LogWriter, `submit` only blocks once `max_pending`
+    records are waiting, and `stop` returns once the log server has
+    received everything.
+    """
+
+    def __init__(self, path: str, max_pending: int = 10000, batch_size: int = 100, retry_interval: float = 1.0):
+        self.path = path
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.sent = 0
+        self.reconnects = 0
+        self._queue = None
+        self._task = None
+        self._reader = None
+        self._writer = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, log):
+        await self._queue.put(log_to_record(log))
+
+    async def stop(self, timeout: float = 10.0):
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error("Log writer at %s unreachable; dropping %d log records", self.path, self._queue.qsize())
+        self._task = None
+
+    async def _connect(self):
+        while True:
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+                return
+            except OSError as e:
+                logger.warning("Cannot reach log writer at %s (%s); retrying", self.path, e)
+                await asyncio.sleep(self.retry_interval)
+
+    async def _run(self):
+        try:
+            stopping = False
+            while not stopping:
+                batch = [await self._queue.get()]
+                while len(batch) < self.batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                if batch[-1] is None:
+                    stopping = True
+                    batch.pop()
+                if not batch:
+                    continue
+                data = "".join(json.dumps(record) + "\n" for record in batch).encode("utf-8")
+                while True:
+                    if self._writer is None:
+                        await self._connect()
+                    try:
+                        self._writer.write(data)
+                        await self._writer.drain()
+                        break
+                    except OSError:
+                        # The writer process restarted; resend the whole batch on a new connection.
+                        self.reconnects += 1
+                        self._writer = None
+                self.sent += len(batch)
+            if self._writer is not None:
+                # Half-close and wait for the log server to close its side, which it
+                # does only after reading every record: until then they may still
+                # be sitting in the socket buffer.
+                self._writer.write_eof()
+                await self._reader.read()
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "sent": self.sent,
+            "reconnects": self.reconnects,
+            "socket": self.path,
+        }
+
+class LogServer:
+    """
+    The log writer process: accepts connections from SocketLogWriter on a
+    Unix socket and writes the records it receives with a LogWriter, in
+    batched transactions.
+    """
+
+    def __init__(self, path: str, session_maker=None, batch_size: int = 100, flush_interval: float = 1.0):
+        self.path = path
+        self.log_writer = LogWriter(session_maker, batch_size=batch_size, flush_interval=flush_interval)
+        self.received = 0
+        self.rejected = 0
+        self._server = None
+        self._connections = set()
+
+    async def start(self):
+        await self.log_writer.start()
+        if os.path.exists(self.path):
+            # Left behind by a writer that didn't shut down cleanly.
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+
+    async def stop(self, timeout: float = 10.0):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._connections:
+            # Let connected processes finish sending what they already wrote.
+            _, unfinished = await asyncio.wait(self._connections, timeout=timeout)
+            for task in unfinished:
+                task.cancel()
+        await self.log_writer.stop()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    log = APIRequestLog(**json.loads(line))
+                except (ValueError, TypeError):
+                    self.rejected += 1
+                    logger.warning("Ignoring malformed log record: %.200r", line)
+                    continue
+                self.received += 1
+                await self.log_writer.submit(log)
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+async def serve(path: str):
+    server = LogServer(path, get_default_session_maker(), config.LOG_BATCH_SIZE, config.LOG_FLUSH_INTERVAL)
+    await server.start()
+    logger.info("Writing request logs to %s, received on %s", config.DB_URI, path)
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopped.set)
+    await stopped.wait()
+    # Flush everything received before exiting.
+    await server.stop()
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Write GULL-API request logs sent by server processes over a Unix socket.')
+    parser.add_argument('--socket', default=config.LOG_SOCKET, type=str, help='Unix socket to listen on (default: LOG_SOCKET)')
+    return parser
+
+def main():
+    args = create_parser().parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args.socket))
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
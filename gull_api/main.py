@@ -1,94 +1,465 @@
-from fastapi import FastAPI, Depends, HTTPException
-from pydantic import BaseModel, Field, create_model
-from typing import Dict, Any
+from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+from typing import Dict, Any, List
+from pydantic import ValidationError
+import hmac
 import json
-import subprocess
+import logging
+import os
 import asyncio
-from gull_api.db import APIRequestLog, SessionManager
+import time
+import shlex
+import anyio
+from sqlalchemy.exc import SQLAlchemyError
+from gull_api.db import (
+    APIRequestLog, SessionManager, LogWriter, canonical_json, get_default_session_maker, log_stats, query_logs,
+    recent_generations, write_logs,
+)
+from gull_api.logserver import SocketLogWriter
+from gull_api.pool import WorkerPool
+from gull_api.predictor import RuntimePredictor, request_size
+from gull_api.prewarm import Prewarmer
+from gull_api.retention import LogRetention
+from gull_api.executor import (
+    GenerationTiming, StreamingProcess, capture_output, cap_text, spawn_process, terminate_process,
+)
+from gull_api.placement import Placement, claim_partition, partition_cores, with_threads
+from gull_api.jobs import JobQueue, JobRunner, JobRetry, FAILED, SUCCEEDED
+from gull_api.admission import AdmissionController, AdmissionRejected, ANONYMOUS, BATCH, INTERACTIVE
+from gull_api.clients import (
+    ClientRegistry, RateLimited, RequestContext, UnknownApiKey, current_request, lower_priority,
+)
+from gull_api.cache import ResponseCache, SingleFlight, is_deterministic, request_key
+from gull_api import metrics
+from gull_api.schema import (
+    get_single_key, create_llm_request_model, convert_request_to_cli_command,
+    convert_cli_json_to_api_format, get_schema, get_catalog,
+)
 from gull_api import config
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI()
 
-def get_single_key(dictionary: Dict[str, Any]) -> str:
-    return list(dictionary.keys())[0]
+if config.METRICS:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+# Warm worker pools by model name, created at startup for models with a
+# non-zero pool size; models without one spawn a subprocess per request.
+pools = {}
+
+# Set at startup when LOG_MODE is "batched" or "socket"; otherwise logs are committed inline.
+log_writer = None
+
+# Set at startup when LOG_RETENTION_DAYS is non-zero.
+log_retention = None
+
+# Admission controllers by model name, so each model is scheduled in isolation.
+admissions = {}
+
+# Runtime predictors by model name, fitted on each model's completed generations.
+predictors = {}
+
+# Set at startup when PREWARM is on; /ready waits for it.
+prewarmer = None
+prewarm_task = None
+
+response_cache = ResponseCache(
+    max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=config.RESPONSE_CACHE_MAX_BYTES,
+    ttl=config.RESPONSE_CACHE_TTL,
+    persist=config.RESPONSE_CACHE_PERSIST,
+) if config.RESPONSE_CACHE else None
+
+coalescer = SingleFlight() if config.COALESCE_REQUESTS else None
+
+# The database-backed /jobs queue, and the runner set up at startup when JOBS is on.
+job_queue = None
+job_runner = None
+
+# Core slots for executor processes when PLACEMENT is on. With several worker
+# processes each claims its own share of the cores, held through placement_lock.
+placement = None
+placement_lock = None
+if config.PLACEMENT:
+    placement_cpus = sorted(os.sched_getaffinity(0))
+    if config.PLACEMENT_WORKERS > 1:
+        partition, placement_lock = claim_partition(config.PLACEMENT_WORKERS, config.PLACEMENT_LOCK_DIR)
+        placement_cpus = partition_cores(placement_cpus, config.PLACEMENT_WORKERS, partition)
+    placement = Placement(
+        config.PLACEMENT_CORES_PER_SLOT or len(placement_cpus) // config.MAX_CONCURRENCY, cpus=placement_cpus
+    )
+
+client_registry = ClientRegistry()
+
+metrics.registry.register(metrics.Gauge(
+    "gull_admission_active", "Generations currently holding a slot, by model.", ("model",),
+    lambda: {(name,): controller.active for name, controller in admissions.items()},
+))
+metrics.registry.register(metrics.Gauge(
+    "gull_core_slots_busy", "Core slots held by an executor process.", (),
+    lambda: {(): sum(slot.busy for slot in placement.slots)} if placement is not None else {},
+))
+metrics.registry.register(metrics.Gauge(
+    "gull_admission_waiting", "Requests waiting for a slot, by model.", ("model",),
+    lambda: {(name,): controller.waiting for name, controller in admissions.items()},
+))
+
+def get_admission(schema) -> AdmissionController:
+    max_concurrency = schema.max_concurrency or config.MAX_CONCURRENCY
+    controller = admissions.get(schema.name)
+    if controller is None:
+        controller = admissions[schema.name] = AdmissionController(
+            max_concurrency, config.MAX_QUEUE, queue_timeout=config.QUEUE_TIMEOUT,
+            shortest_first=config.SCHEDULING == "sjf", aging=config.SJF_AGING,
+        )
+    # Pick up max_concurrency changes from a reloaded cli.json.
+    controller.max_concurrency = max_concurrency
+    return controller
+
+def get_predictor(schema) -> RuntimePredictor:
+    predictor = predictors.get(schema.name)
+    if predictor is None:
+        predictor = predictors[schema.name] = RuntimePredictor()
+    return predictor
+
+def get_pool(schema):
+    return pools.get(schema.name)
+
+def place_command(schema, command, threads):
+    """Pass the model's thread-count flag, if it has one, matching the cores a process gets."""
+    flag = schema.threads_flag or config.THREADS_FLAG
+    if not flag or not threads:
+        return command
+    return with_threads(command, flag, threads)
+
+def release_core_slot(core_slot):
+    if core_slot is not None:
+        core_slot.release()
+
+@app.on_event("startup")
+async def start_worker_pools():
+    try:
+        catalog = get_catalog()
+    except OSError:
+        if config.WORKER_POOL_SIZE > 0:
+            raise
+        return
+    for schema in catalog.models.values():
+        size = schema.worker_pool_size if schema.worker_pool_size is not None else config.WORKER_POOL_SIZE
+        if size > 0:
+            # Warm workers keep their core slots for as long as they run.
+            core_slots = [placement.try_acquire() for _ in range(size)] if placement is not None else None
+            if core_slots is not None and None in core_slots:
+                logger.warning("Not enough core slots to pin every %s worker", schema.name)
+            pools[schema.name] = WorkerPool(
+                shlex.split(schema.worker_command or schema.executable or config.WORKER_COMMAND),
+                size=size,
+                max_requests=config.WORKER_MAX_REQUESTS,
+                health_interval=config.WORKER_HEALTH_INTERVAL,
+                core_slots=core_slots,
+            )
+            await pools[schema.name].start()
+
+@app.on_event("shutdown")
+async def stop_worker_pools():
+    while pools:
+        _, pool = pools.popitem()
+        await pool.stop()
+
+@app.on_event("startup")
+async def start_log_writer():
+    global log_writer
+    if config.LOG_MODE == "off":
+        return
+    # Create the engine and tables once, up front, instead of on the first request.
+    get_default_session_maker()
+    if config.LOG_MODE == "batched":
+        log_writer = LogWriter(batch_size=config.LOG_BATCH_SIZE, flush_interval=config.LOG_FLUSH_INTERVAL)
+        await log_writer.start()
+    elif config.LOG_MODE == "socket":
+        log_writer = SocketLogWriter(config.LOG_SOCKET, batch_size=config.LOG_BATCH_SIZE)
+        await log_writer.start()
+
+@app.on_event("shutdown")
+async def stop_log_writer():
+    global log_writer
+    if log_writer is not None:
+        await log_writer.stop()
+        log_writer = None
+
+def seed_runtime_predictors(catalog):
+    """Fit each model's runtime predictor on its latest logged generations."""
+    for schema in catalog.models.values():
+        predictor = get_predictor(schema)
+        for request, duration in recent_generations(schema.name, config.RUNTIME_HISTORY):
+            try:
+                predictor.observe(request_size(schema, schema.validate(request)), duration)
+            except ValidationError:
+                # Logged under an older cli.json.
+                continue
+
+@app.on_event("startup")
+async def start_runtime_predictors():
+    if config.LOG_MODE == "off" or config.RUNTIME_HISTORY <= 0:
+        return
+    try:
+        catalog = get_catalog()
+    except OSError:
+        return
+    try:
+        await asyncio.to_thread(seed_runtime_predictors, catalog)
+    except SQLAlchemyError:
+        logger.exception("Failed to load past generation times; runtime predictions start from scratch")
+
+async def warm_up(schema) -> float:
+    """Run WARMUP_REQUEST on a model outside the cache and request log; returns how long it took."""
+    validated_request = schema.validate(json.loads(config.WARMUP_REQUEST))
+    started = time.monotonic()
+    stdout, stderr, return_code = await execute(schema, schema.build_command(validated_request))
+    if return_code != 0:
+        raise RuntimeError(f"Warm-up generation for {schema.name} exited with {return_code}: {stderr}")
+    return time.monotonic() - started
+
+@app.on_event("startup")
+async def start_prewarm():
+    global prewarmer, prewarm_task
+    if not config.PREWARM:
+        return
+    prewarmer = Prewarmer(lock=config.PREWARM_MLOCK)
+    # In the background, so /ready and /status can answer while it runs.
+    prewarm_task = asyncio.create_task(prewarmer.run(get_catalog(), warm_up if config.WARMUP_REQUEST else None))
+
+@app.on_event("shutdown")
+async def stop_prewarm():
+    global prewarmer, prewarm_task
+    if prewarm_task is not None:
+        prewarm_task.cancel()
+        await asyncio.gather(prewarm_task, return_exceptions=True)
+        prewarm_task = None
+    if prewarmer is not None:
+        prewarmer.release()
+        prewarmer = None
+
+@app.on_event("startup")
+async def start_log_retention():
+    global log_retention
+    if config.LOG_MODE == "off" or config.LOG_RETENTION_DAYS <= 0:
+        return
+    log_retention = LogRetention(config.LOG_RETENTION_DAYS, config.LOG_ARCHIVE_DIR or None, config.LOG_COMPACT_INTERVAL)
+    await log_retention.start()
+
+@app.on_event("shutdown")
+async def stop_log_retention():
+    global log_retention
+    if log_retention is not None:
+        await log_retention.stop()
+        log_retention = None
+
+def get_job_queue() -> JobQueue:
+    global job_queue
+    if job_queue is None:
+        job_queue = JobQueue(lease=config.JOB_LEASE, max_attempts=config.JOB_MAX_ATTEMPTS,
+                             retention=config.JOB_RETENTION)
+    return job_queue
+
+@app.on_event("startup")
+async def start_job_runner():
+    global job_runner
+    if not config.JOBS:
+        return
+    job_runner = JobRunner(get_job_queue(), run_job, config.JOB_CONCURRENCY, config.JOB_POLL_INTERVAL)
+    await job_runner.start()
+
+@app.on_event("shutdown")
+async def stop_job_runner():
+    global job_runner
+    if job_runner is not None:
+        # Jobs still running go back to the queue for another process, or the next start.
+        await job_runner.stop()
+        job_runner = None
 
 def load_cli_json():
     with open(config.CLI_JSON_PATH, "r") as f:
         return json.load(f)
 
-def create_llm_request_model(cli_json: Dict[str, Any]) -> BaseModel:
-    fields = {}
-    for param in cli_json[get_single_key(cli_json)]:
-        param_name = param["name"]
-        field_kwargs = {"description": param["description"]}
-        if "default" in param:
-            field_kwargs["default"] = param["default"]
-        else:
-            if param.get('required', True) is False:
-                field_kwargs["default"] = None
-        if "min" in param and "max" in param:
-            field_kwargs["gt"] = param["min"]
-            field_kwargs["lt"] = param["max"]
-        fields[param["name"]] = (param["type"], Field(**field_kwargs))
-    return create_model("LLMRequest", **fields)
-
-def convert_request_to_cli_command(request: BaseModel, cli_json: Dict[str, Any]) -> str:
-    cli_args = []
-    command = [config.EXECUTABLE]  # use executable from config
-    for param in cli_json[get_single_key(cli_json)]:
-        param_name = param["name"]
-        if param_name in request.dict():
-            value = request.dict()[param_name]
-            flag = param["flag"]
-            if param["type"] == "bool":
-                if value:
-                    cli_args.append(flag)
-            else:
-                cli_args.append(flag)
-                cli_args.append(str(value))
-    command += cli_args
-    return command
-
-def convert_cli_json_to_api_format(cli_json: Dict[str, Any]) -> Dict[str, Any]:
-    key = get_single_key(cli_json)
-    api_json = {key: []}
-    for param in cli_json[key]:
-        if not param.get("hidden", False):
-            api_param = {
-                "name": param["name"],
-                "type": param["type"],
-                "description": param["description"],
-            }
-            if "default" in param:
-                api_param["default"] = param["default"]
-            if "min" in param and "max" in param:
-                api_param["min"] = param["min"]
-                api_param["max"] = param["max"]
-                if param["type"] == "int" or param["type"] == "float":
-                    api_param["step"] = param.get("step", 1 if param["type"] == "int" else 0.01)  # respect "step" if provided in cli_json
-            if param.get("required", False):
-                api_param["required"] = param["required"]  # respect "required" if provided in cli_json
-            api_json[key].append(api_param)
-    return api_json
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip, i.e. names it without q=0."""
+    for coding in accept_encoding.split(","):
+        name, *params = [part.strip() for part in coding.split(";")]
+        if name.lower() != "gzip":
+            continue
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
 
 @app.get("/api")
-def get_api(cli_json=Depends(load_cli_json)):
-    api_json = convert_cli_json_to_api_format(cli_json)
-    return api_json
+def get_api(catalog=Depends(get_catalog), http_request: Request = None):
+    """
+    The parameters of every model, served from bytes serialized once per
+    cli.json version, with an ETag for conditional requests and gzip for
+    clients that accept it.
+    """
+    document = catalog.api_document
+    headers = {"Cache-Control": config.API_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    request_headers = http_request.headers if http_request is not None else {}
+    use_gzip = document.gzip_body is not None and accepts_gzip(request_headers.get("accept-encoding", ""))
+    headers["ETag"] = document.gzip_etag if use_gzip else document.etag
+    if document.matches(request_headers.get("if-none-match", "")):
+        return Response(status_code=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(document.gzip_body, media_type="application/json", headers=headers)
+    return Response(document.body, media_type="application/json", headers=headers)
+
+def get_model_schema(model: str, catalog=Depends(get_catalog)):
+    schema = catalog.get(model)
+    if schema is None:
+        raise HTTPException(status_code=404, detail=f"Unknown model: {model}")
+    return schema
+
+@app.get("/ready")
+def get_ready():
+    """For load balancer health checks: 200 once the model files and executors are warm, 503 until then."""
+    if prewarmer is None:
+        return {"ready": True}
+    body = {"ready": prewarmer.ready, "state": prewarmer.state, "error": prewarmer.error}
+    if not prewarmer.ready:
+        return JSONResponse(body, status_code=503)
+    return body
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/status")
+def get_status():
+    return {
+        "admission": {name: controller.stats() for name, controller in admissions.items()},
+        "pools": {name: pool.stats() for name, pool in pools.items()},
+        "log_writer": log_writer.stats() if log_writer is not None else None,
+        "cache": response_cache.stats() if response_cache is not None else None,
+        "coalescing": coalescer.stats() if coalescer is not None else None,
+        "clients": client_registry.stats(),
+        "placement": placement.stats() if placement is not None else None,
+        "jobs": job_runner.stats() if job_runner is not None else None,
+        "log_retention": log_retention.stats() if log_retention is not None else None,
+        "runtime_prediction": {name: predictor.stats() for name, predictor in predictors.items()},
+        "prewarm": prewarmer.stats() if prewarmer is not None else None,
+    }
+
+def begin_request(http_request, default_priority=INTERACTIVE) -> RequestContext:
+    """
+    Identify the client behind `http_request` and settle its priority class:
+    the endpoint's default, lowered by the client's configured class or an
+    X-Priority header, never raised.
+    """
+    if http_request is None:
+        context = RequestContext(client_registry.default_client(ANONYMOUS), default_priority)
+    else:
+        host = http_request.client.host if http_request.client else None
+        try:
+            client = client_registry.identify(http_request.headers, host)
+        except UnknownApiKey:
+            raise HTTPException(status_code=401, detail="Unknown API key.", headers={"WWW-Authenticate": "Bearer"})
+        priority = lower_priority(default_priority, client.priority, http_request.headers.get("x-priority"))
+        context = RequestContext(client, priority)
+    current_request.set(context)
+    return context
 
 async def create_log_object(request, stdout, stderr, returncode):
-    return APIRequestLog(
-        request=str(request),
+    # Stored text is held to the same caps as captured output.
+    stdout = cap_text(stdout, config.STDOUT_MAX_BYTES)
+    stderr = cap_text(stderr, config.STDERR_MAX_BYTES)
+    if returncode != 0:
+        error_details = stderr
+    elif getattr(stdout, "truncated", False):
+        error_details = f"Output truncated at {stdout.limit} bytes."
+    else:
+        error_details = None
+    context = current_request.get()
+    log = APIRequestLog(
+        request=canonical_json(request),
         response=stdout if returncode == 0 else None,
         error_occurred=returncode != 0,
-        error_details=stderr if returncode != 0 else None,
+        error_details=error_details,
+        returncode=returncode,
+        timestamp=time.time(),
     )
+    if context is not None:
+        log.client_id = context.client.id
+        log.priority = context.priority
+        log.queue_wait = context.queue_wait
+        log.model = context.model
+        log.request_hash = context.request_hash
+        log.predicted_duration = context.predicted_duration
+        log.duration = log.timestamp - context.started_at
+        log.timestamp = context.started_at
+        if context.timing is not None:
+            timing = context.timing.stats()
+            log.spawn_latency = timing["spawn_latency"]
+            log.time_to_first_output = timing["time_to_first_output"]
+            log.generation_time = timing["generation_time"]
+            log.output_bytes = timing["output_bytes"]
+            log.output_tokens = timing["output_tokens"]
+            log.tokens_per_second = timing["tokens_per_second"]
+    return log
+
+def track_timing(timing: GenerationTiming) -> GenerationTiming:
+    """Attach an executor run's timing to the current request, for its log record and response."""
+    context = current_request.get()
+    if context is not None:
+        context.timing = timing
+    return timing
+
+def timing_block() -> Dict[str, Any]:
+    """The current request's executor timing, for responses that asked for it; None for cached responses."""
+    context = current_request.get()
+    if context is None or context.timing is None:
+        return None
+    return context.timing.stats()
+
+def track_request(schema, key, validated_request):
+    """
+    Note the model, request hash and predicted runtime of the current
+    request, for scheduling and its log record.
+    """
+    context = current_request.get()
+    if context is not None:
+        context.model = schema.name
+        context.request_hash = key
+        context.size = request_size(schema, validated_request)
+        context.predicted_duration = get_predictor(schema).predict(context.size)
+
+def observe_generation(schema, timing: GenerationTiming):
+    """Record a successful run's timing in /metrics and in the model's runtime predictor."""
+    metrics.observe_timing(schema.name, timing)
+    context = current_request.get()
+    duration = timing.stats()["generation_time"]
+    if context is None or context.size is None or duration is None:
+        return
+    get_predictor(schema).observe(context.size, duration, context.predicted_duration)
+    if context.predicted_duration is not None:
+        metrics.prediction_error.observe(abs(context.predicted_duration - duration), schema.name)
 
 # Helper function to create and log the API request
 async def create_and_log(request, stdout="", stderr="", returncode=0):
     log = await create_log_object(request, stdout, stderr, returncode)
-    with SessionManager(log) as session:
-        pass
+    if config.LOG_MODE == "off":
+        return log
+    if log_writer is not None:
+        await log_writer.submit(log)
+    else:
+        with metrics.stage("log_commit"):
+            with SessionManager(log) as session:
+                pass
     return log
 
 async def handle_error(request, status_code, detail, stderr="", returncode=1):
@@ -105,29 +476,565 @@ async def handle_error(request, status_code, detail, stderr="", returncode=1):
     log = await create_and_log(request, stderr=stderr, returncode=returncode)
     raise HTTPException(status_code=status_code, detail=detail)
 
+class ClientDisconnected(Exception):
+    pass
+
+# Logged as error_details for runs stopped because the caller went away.
+CANCELLED_DETAIL = "Cancelled: client disconnected before the generation finished."
+
+def resolve_timeout(schema, requested: float = None) -> float:
+    """
+    Deadline for one generation: the model's "timeout" from cli.json, or
+    LLM_TIMEOUT, optionally shortened (never extended) per request.
+    """
+    limit = schema.timeout or config.LLM_TIMEOUT
+    if requested is not None and requested > 0:
+        return min(requested, limit)
+    return limit
+
+async def wait_for_disconnect(http_request):
+    # The body has already been read, so the next message is the disconnect
+    # (or, once the response has been sent, a synthetic one).
+    while (await http_request.receive())["type"] != "http.disconnect":
+        pass
+
+async def unless_disconnected(http_request, awaitable):
+    """
+    Await `awaitable`, cancelling it and raising ClientDisconnected if the
+    client goes away first. Cancelling a generation kills its process.
+    """
+    if http_request is None:
+        return await awaitable
+    work = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(wait_for_disconnect(http_request))
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not work.done():
+            work.cancel()
+            # Let the process be killed and reaped before the request is logged.
+            await asyncio.wait({work})
+    if work.cancelled():
+        raise ClientDisconnected()
+    return work.result()
+
+def check_rate(client):
+    try:
+        client_registry.check_rate(client)
+    except RateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def acquire_slot(schema, rate_checked=False):
+    # Overload and rate limit rejections are answered straight away and not written
+    # to the request log, so a burst doesn't also turn into a burst of DB writes.
+    context = current_request.get() or begin_request(None)
+    client = context.client
+    if not rate_checked:
+        check_rate(client)
+    try:
+        slot = await get_admission(schema).acquire(
+            client.id, client.weight, client.max_concurrency, context.priority, cost=context.predicted_duration
+        )
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=503, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+    context.queue_wait = slot.wait
+    metrics.queue_wait.observe(slot.wait, schema.name)
+    return slot
+
+async def execute(schema, command, timeout=None, rate_checked=False):
+    """
+    Run one generation in an admission slot of its model and return
+    (stdout, stderr, returncode).
+    """
+    timeout = timeout or resolve_timeout(schema)
+    async with await acquire_slot(schema, rate_checked):
+        try:
+            result = await run_command(schema, command, timeout)
+        except asyncio.TimeoutError:
+            metrics.generations.inc(schema.name, "timeout")
+            raise
+        except asyncio.CancelledError:
+            metrics.generations.inc(schema.name, "cancelled")
+            raise
+        except Exception:
+            metrics.generations.inc(schema.name, "error")
+            raise
+        metrics.generations.inc(schema.name, "ok" if result[2] == 0 else "nonzero_exit")
+        return result
+
+async def execute_shared(schema, command, timeout=None):
+    """execute(), also returning the run's timing for the callers that joined it."""
+    result = await execute(schema, command, timeout, rate_checked=True)
+    context = current_request.get()
+    return result, context.timing if context is not None else None
+
+async def run_in_pool(schema, pool, command, timeout):
+    # No spawn and no streaming: the warm worker answers with the whole generation at once.
+    timing = track_timing(GenerationTiming())
+    timing.mark_spawned()
+    with metrics.stage("generate"):
+        # The worker already has the executable (and model) loaded; send only the flags.
+        stdout, stderr, return_code = await pool.run(command[1:], timeout=timeout)
+    timing.output_bytes = len(stdout.encode("utf-8"))
+    timing.mark_finished()
+    timing.count_tokens(stdout, stderr)
+    if return_code == 0:
+        observe_generation(schema, timing)
+    return stdout, stderr, return_code
+
+async def run_command(schema, command, timeout):
+    pool = get_pool(schema)
+    if pool is not None:
+        if placement is not None:
+            command = place_command(schema, command, placement.cores_per_slot)
+        # The pool caps its replies as captured output is capped.
+        return await run_in_pool(schema, pool, command, timeout)
+    core_slot = None
+    try:
+        if placement is not None:
+            with metrics.stage("placement"):
+                core_slot = await placement.acquire()
+            command = place_command(schema, command, core_slot.threads)
+        with metrics.stage("spawn"):
+            timing = track_timing(GenerationTiming())
+            process = await spawn_process(command)
+            timing.mark_spawned()
+            if core_slot is not None:
+                core_slot.pin(process.pid)
+        try:
+            with metrics.stage("generate"):
+                stdout, stderr = await asyncio.wait_for(capture_output(process, timing), timeout=timeout)
+        except BaseException:
+            # Timed out, failed or cancelled: don't leave the generation running or unreaped.
+            # Shielded so a second cancellation can't abandon the kill half way.
+            await asyncio.shield(terminate_process(process))
+            raise
+    finally:
+        release_core_slot(core_slot)
+    with metrics.stage("decode"):
+        stdout, stderr = stdout.text(), stderr.text()
+    timing.count_tokens(stdout, stderr)
+    if process.returncode == 0:
+        observe_generation(schema, timing)
+    return stdout, stderr, process.returncode
+
+async def generate(schema, validated_request, command, use_cache=True, timeout=None):
+    """
+    Produce (stdout, stderr, returncode) for a validated request, from the
+    response cache when possible, otherwise by executing it, sharing the run
+    with any identical request already in flight.
+    """
+    key = request_key(schema, validated_request)
+    track_request(schema, key, validated_request)
+    cache_key = None
+    # Only a repeatable generation may be served again; a sampled one would repeat one sample.
+    if response_cache is not None and use_cache and is_deterministic(schema, validated_request):
+        cache_key = key
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            return cached, "", 0
+
+    if coalescer is not None:
+        # Only requests with the same deadline share a run, so none is held to another's.
+        flight_key = f"{key}:{timeout}"
+        # Every caller is charged here, before joining, so one over its limit
+        # can't fail a run that others share.
+        check_rate((current_request.get() or begin_request(None)).client)
+        (stdout, stderr, return_code), run_timing = await coalescer.do(
+            flight_key, lambda: execute_shared(schema, command, timeout)
+        )
+        context = current_request.get()
+        if context is not None and context.timing is None:
+            context.timing = run_timing
+    else:
+        stdout, stderr, return_code = await execute(schema, command, timeout)
+
+    # A truncated response isn't what a fresh run would return, so it's never cached.
+    if cache_key is not None and return_code == 0 and not getattr(stdout, "truncated", False):
+        await response_cache.put(cache_key, stdout)
+    return stdout, stderr, return_code
+
 @app.post("/llm")
-async def post_llm(request: Dict[str, Any], cli_json=Depends(load_cli_json)):
-    LLMRequest = create_llm_request_model(cli_json)
-    validated_request = LLMRequest(**request)
-    command = convert_request_to_cli_command(validated_request, cli_json)
+async def post_llm(request: Dict[str, Any], schema=Depends(get_schema), no_cache: bool = False,
+                   timeout: float = None, http_request: Request = None, timing: bool = False):
+    metrics.observe_parse()
+    begin_request(http_request)
+    with metrics.stage("validate"):
+        validated_request = schema.validate(request)
+    with metrics.stage("build_command"):
+        command = schema.build_command(validated_request)
     
     return_code = None
+    deadline = resolve_timeout(schema, timeout)
     
     try:
-        process = await asyncio.create_subprocess_exec(*command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout_bytes, stderr_bytes = await asyncio.wait_for(process.communicate(), timeout=60)
-        stdout = stdout_bytes.decode("utf-8")
-        stderr = stderr_bytes.decode("utf-8")
-        return_code = process.returncode
+        stdout, stderr, return_code = await unless_disconnected(
+            http_request, generate(schema, validated_request, command, use_cache=not no_cache, timeout=deadline)
+        )
+    except HTTPException:
+        raise
+    except ClientDisconnected:
+        # Nobody is listening for this response; the status only shows up in access logs and metrics.
+        await handle_error(request, status_code=499, detail="Client disconnected.", stderr=CANCELLED_DETAIL)
     except asyncio.TimeoutError:
-        await handle_error(request, status_code=504, detail="Server processing timed out.", returncode=return_code)
+        await handle_error(request, status_code=504, detail="Server processing timed out.",
+                           stderr=f"Timed out after {deadline:g}s; process killed.", returncode=return_code)
     except Exception as e:
         await handle_error(request, status_code=500, detail="Internal Server Error", stderr=str(e), returncode=return_code)
     else:
         if return_code != 0:
             await handle_error(request, status_code=422, detail=stderr, stderr=stderr, returncode=return_code)
-    
+
     # Logging successful response
     await create_and_log(request, stdout=stdout, returncode=return_code)
     
-    return {'response': stdout}
\ No newline at end of file
+    result = {'response': stdout}
+    if getattr(stdout, "truncated", False):
+        result['truncated'] = True
+    if timing:
+        result['timing'] = timing_block()
+    return result
+
+def ndjson_line(obj: Dict[str, Any]) -> str:
+    return json.dumps(obj) + "\n"
+
+def done_line(include_timing: bool) -> Dict[str, Any]:
+    return {"done": True, "timing": timing_block()} if include_timing else {"done": True}
+
+async def stream_llm(request, schema, run, include_timing=False):
+    """
+    Forward generated text as NDJSON lines of the form {"text": ...}, followed
+    by one terminating line: {"done": true} on success (plus the run's
+    "timing" if asked for), or {"error": ..., "status_code": ...} with the
+    status /llm would have used. The request is logged once the stream ends.
+    """
+    try:
+        async for text in run.chunks():
+            yield ndjson_line({"text": text})
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client disconnected mid-stream. Shielded, as the response's cancel
+        # scope would otherwise cancel the kill and the log write as well.
+        with anyio.CancelScope(shield=True):
+            await run.kill()
+            metrics.generations.inc(schema.name, "cancelled")
+            await create_and_log(request, stdout=run.stdout, stderr=CANCELLED_DETAIL, returncode=1)
+        raise
+    except asyncio.TimeoutError:
+        metrics.generations.inc(schema.name, "timeout")
+        await create_and_log(request, stdout=run.stdout, stderr=f"Timed out after {run.timeout:g}s; process killed.",
+                             returncode=run.returncode or 1)
+        yield ndjson_line({"error": "Server processing timed out.", "status_code": 504})
+        return
+    except Exception as e:
+        metrics.generations.inc(schema.name, "error")
+        await create_and_log(request, stderr=str(e), returncode=run.returncode or 1)
+        yield ndjson_line({"error": "Internal Server Error", "status_code": 500})
+        return
+
+    metrics.generations.inc(schema.name, "ok" if run.returncode == 0 else "nonzero_exit")
+    if run.returncode == 0:
+        observe_generation(schema, run.timing)
+    await create_and_log(request, stdout=run.stdout, stderr=run.stderr, returncode=run.returncode)
+    if run.returncode != 0:
+        yield ndjson_line({"error": run.stderr, "status_code": 422})
+    else:
+        yield ndjson_line(done_line(include_timing))
+
+async def stream_pooled(request, schema, pool, command, timeout, include_timing=False):
+    # Pool workers answer with the whole generation at once, so it goes out as a single chunk.
+    try:
+        stdout, stderr, return_code = await run_in_pool(schema, pool, command, timeout)
+    except asyncio.CancelledError:
+        # The pool restarts the worker, which stops the abandoned generation.
+        metrics.generations.inc(schema.name, "cancelled")
+        with anyio.CancelScope(shield=True):
+            await create_and_log(request, stderr=CANCELLED_DETAIL, returncode=1)
+        raise
+    except asyncio.TimeoutError:
+        metrics.generations.inc(schema.name, "timeout")
+        await create_and_log(request, stderr=f"Timed out after {timeout:g}s; worker restarted.", returncode=1)
+        yield ndjson_line({"error": "Server processing timed out.", "status_code": 504})
+        return
+    except Exception as e:
+        metrics.generations.inc(schema.name, "error")
+        await create_and_log(request, stderr=str(e), returncode=1)
+        yield ndjson_line({"error": "Internal Server Error", "status_code": 500})
+        return
+    metrics.generations.inc(schema.name, "ok" if return_code == 0 else "nonzero_exit")
+    await create_and_log(request, stdout=stdout, stderr=stderr, returncode=return_code)
+    if return_code != 0:
+        yield ndjson_line({"error": stderr, "status_code": 422})
+        return
+    if stdout:
+        yield ndjson_line({"text": stdout})
+    yield ndjson_line(done_line(include_timing))
+
+def release_slots(slot, core_slot=None):
+    slot.release()
+    release_core_slot(core_slot)
+
+def stream_response(body, slot, core_slot=None) -> StreamingResponse:
+    """
+    Stream `body` as NDJSON, releasing the slots once it is closed: when it
+    ends, fails, or the client goes away mid-stream or before it starts.
+    """
+    released = False
+
+    async def release():
+        nonlocal released
+        if not released:
+            released = True
+            # Close the inner generator now rather than at garbage collection, so
+            # a disconnect kills the generation straight away; the slots are only
+            # given back once its process has been reaped.
+            with anyio.CancelScope(shield=True):
+                await body.aclose()
+            release_slots(slot, core_slot)
+
+    async def lines():
+        try:
+            async for line in body:
+                yield line
+        finally:
+            await release()
+
+    # Starlette abandons the body on a disconnect but still runs the background task.
+    return StreamingResponse(lines(), media_type="application/x-ndjson", background=BackgroundTask(release))
+
+@app.post("/llm/stream")
+async def post_llm_stream(request: Dict[str, Any], schema=Depends(get_schema), timeout: float = None,
+                          http_request: Request = None, timing: bool = False):
+    metrics.observe_parse()
+    begin_request(http_request)
+    with metrics.stage("validate"):
+        validated_request = schema.validate(request)
+    with metrics.stage("build_command"):
+        command = schema.build_command(validated_request)
+    track_request(schema, request_key(schema, validated_request), validated_request)
+
+    deadline = resolve_timeout(schema, timeout)
+    slot = await acquire_slot(schema)
+    core_slot = None
+    try:
+        pool = get_pool(schema)
+        if pool is not None:
+            if placement is not None:
+                command = place_command(schema, command, placement.cores_per_slot)
+            body = stream_pooled(request, schema, pool, command, deadline, timing)
+        else:
+            if placement is not None:
+                with metrics.stage("placement"):
+                    core_slot = await placement.acquire()
+                command = place_command(schema, command, core_slot.threads)
+            run = StreamingProcess(command, timeout=deadline)
+            try:
+                # Spawn before committing to a 200 so launch failures still get a real error status.
+                with metrics.stage("spawn"):
+                    await run.start()
+                    track_timing(run.timing)
+                    if core_slot is not None:
+                        core_slot.pin(run.process.pid)
+            except Exception as e:
+                await handle_error(request, status_code=500, detail="Internal Server Error", stderr=str(e))
+            body = stream_llm(request, schema, run, timing)
+    except BaseException:
+        release_slots(slot, core_slot)
+        raise
+    return stream_response(body, slot, core_slot)
+
+async def run_batch_item(index, request, schema, validated_request, timeout=None):
+    """
+    Run one batch entry and return its NDJSON result plus the log record to
+    write for it (None for requests rejected by admission control).
+    """
+    command = schema.build_command(validated_request)
+    try:
+        stdout, stderr, return_code = await generate(schema, validated_request, command, timeout=timeout)
+    except HTTPException as e:
+        return {"index": index, "error": e.detail, "status_code": e.status_code}, None
+    except asyncio.TimeoutError:
+        log = await create_log_object(request, "", f"Timed out after {timeout or resolve_timeout(schema):g}s; process killed.", 1)
+        return {"index": index, "error": "Server processing timed out.", "status_code": 504}, log
+    except Exception as e:
+        log = await create_log_object(request, "", str(e), 1)
+        return {"index": index, "error": "Internal Server Error", "status_code": 500}, log
+    log = await create_log_object(request, stdout, stderr, return_code)
+    if return_code != 0:
+        return {"index": index, "error": stderr, "status_code": 422}, log
+    if getattr(stdout, "truncated", False):
+        return {"index": index, "response": stdout, "truncated": True}, log
+    return {"index": index, "response": stdout}, log
+
+async def stream_batch(requests, schema, validated_requests, parallelism, timeout=None, client_context=None):
+    semaphore = asyncio.Semaphore(parallelism)
+    logs = []
+
+    async def limited(index):
+        if client_context is not None:
+            # Each entry runs in its own task, so it gets its own queue_wait.
+            current_request.set(RequestContext(client_context.client, client_context.priority))
+        async with semaphore:
+            return await run_batch_item(index, requests[index], schema, validated_requests[index], timeout)
+
+    tasks = [asyncio.create_task(limited(index)) for index in range(len(requests))]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result, log = await next_done
+            if log is not None:
+                logs.append(log)
+            yield ndjson_line(result)
+    finally:
+        for task in tasks:
+            task.cancel()
+        if logs and isinstance(log_writer, SocketLogWriter):
+            # Only the log writer process may write to the database.
+            for log in logs:
+                await log_writer.submit(log)
+        elif logs and config.LOG_MODE != "off":
+            # One transaction for the whole batch rather than one per prompt.
+            await asyncio.to_thread(write_logs, logs)
+
+@app.post("/llm/batch")
+async def post_llm_batch(requests: List[Dict[str, Any]], schema=Depends(get_schema), parallelism: int = None,
+                         timeout: float = None, http_request: Request = None):
+    """
+    Validate every request up front, then run them with up to `parallelism`
+    in flight (capped at BATCH_PARALLELISM) and stream NDJSON results in
+    completion order, each tagged with the index of its request. `timeout`
+    applies to each entry separately.
+    """
+    client_context = begin_request(http_request, BATCH)
+    if len(requests) > config.BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {config.BATCH_MAX_SIZE} requests.")
+    validated_requests = []
+    errors = []
+    for index, request in enumerate(requests):
+        try:
+            validated_requests.append(schema.validate(request))
+        except ValidationError as e:
+            errors.append({"index": index, "errors": e.errors()})
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+
+    parallelism = min(parallelism or config.BATCH_PARALLELISM, config.BATCH_PARALLELISM)
+    return StreamingResponse(
+        stream_batch(requests, schema, validated_requests, max(parallelism, 1), resolve_timeout(schema, timeout),
+                     client_context),
+        media_type="application/x-ndjson",
+    )
+
+async def run_job(job):
+    """JobRunner handler: run one claimed job and return its outcome for JobQueue.finish."""
+    schema = get_catalog().get(job["model"])
+    if schema is None:
+        return {"status": FAILED, "error": f"Unknown model: {job['model']}", "status_code": 404}
+    request = job["request"]
+    try:
+        validated_request = schema.validate(request)
+    except ValidationError as e:
+        # cli.json changed since the job was queued.
+        return {"status": FAILED, "error": str(e), "status_code": 422}
+    command = schema.build_command(validated_request)
+    current_request.set(RequestContext(client_registry.by_id(job["client_id"]), job["priority"] or BATCH))
+    deadline = job["timeout"] or config.JOB_TIMEOUT
+    try:
+        stdout, stderr, return_code = await generate(schema, validated_request, command, timeout=deadline)
+    except HTTPException as e:
+        if e.status_code in (429, 503):
+            # At capacity or over the client's rate: try again later rather than fail.
+            raise JobRetry(float((e.headers or {}).get("Retry-After", 1)))
+        return {"status": FAILED, "error": str(e.detail), "status_code": e.status_code}
+    except asyncio.TimeoutError:
+        await create_and_log(request, stderr=f"Timed out after {deadline:g}s; process killed.", returncode=1)
+        return {"status": FAILED, "error": "Server processing timed out.", "status_code": 504}
+    except Exception as e:
+        await create_and_log(request, stderr=str(e), returncode=1)
+        return {"status": FAILED, "error": "Internal Server Error", "status_code": 500}
+    await create_and_log(request, stdout=stdout, stderr=stderr, returncode=return_code)
+    if return_code != 0:
+        return {"status": FAILED, "error": stderr, "status_code": 422}
+    return {"status": SUCCEEDED, "response": stdout, "truncated": getattr(stdout, "truncated", False)}
+
+def check_jobs_api():
+    if not config.JOBS:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@app.post("/jobs", status_code=202, dependencies=[Depends(check_jobs_api)])
+async def post_job(request: Dict[str, Any], model: str = None, timeout: float = None,
+                   catalog=Depends(get_catalog), http_request: Request = None):
+    """
+    Queue a generation with the same payload as /llm and return its id at
+    once. Jobs may run for up to JOB_TIMEOUT seconds (`timeout` can shorten
+    that) and survive restarts.
+    """
+    schema = catalog.default if model is None else get_model_schema(model, catalog)
+    try:
+        schema.validate(request)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+    context = begin_request(http_request, BATCH)
+    deadline = min(timeout, config.JOB_TIMEOUT) if timeout and timeout > 0 else config.JOB_TIMEOUT
+    job = await asyncio.to_thread(
+        get_job_queue().submit, schema.name, request, timeout=deadline,
+        client_id=context.client.id, priority=context.priority,
+    )
+    if job_runner is not None:
+        job_runner.notify()
+    return job
+
+@app.get("/jobs/{job_id}", dependencies=[Depends(check_jobs_api)])
+async def get_job(job_id: str, wait: float = 0):
+    """Return a job's status and, once finished, its result; `wait` long-polls for up to that many seconds."""
+    queue = get_job_queue()
+    wait = min(max(wait, 0), config.JOB_MAX_WAIT)
+    job = await queue.wait(job_id, wait, config.JOB_POLL_INTERVAL)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+def check_logs_api(http_request: Request):
+    if not config.LOGS_API:
+        raise HTTPException(status_code=404, detail="Not Found")
+    key = http_request.headers.get("x-admin-key", "")
+    if config.LOGS_API_KEY and not hmac.compare_digest(key.encode(), config.LOGS_API_KEY.encode()):
+        raise HTTPException(status_code=403, detail="A valid X-Admin-Key is required.")
+
+@app.get("/logs", dependencies=[Depends(check_logs_api)])
+async def get_logs(before: int = None, limit: int = None, since: float = None, until: float = None,
+                   error: bool = None, model: str = None, client_id: str = None, include_response: bool = False):
+    """
+    Request log records, newest first, optionally limited to a time range
+    (Unix times, `since` inclusive), error state, model or client. Pass the
+    returned `next` as `before` for the following page.
+    """
+    limit = max(1, min(limit or config.LOGS_PAGE_SIZE, config.LOGS_MAX_PAGE_SIZE))
+    return await asyncio.to_thread(
+        query_logs, before=before, limit=limit, include_response=include_response,
+        since=since, until=until, error=error, model=model, client_id=client_id,
+    )
+
+@app.get("/logs/stats", dependencies=[Depends(check_logs_api)])
+async def get_log_stats(since: float = None, until: float = None, error: bool = None, model: str = None,
+                        client_id: str = None):
+    """Request counts and latency percentiles over the request log, with the same filters as /logs."""
+    return await asyncio.to_thread(
+        log_stats, since=since, until=until, error=error, model=model, client_id=client_id,
+    )
+
+# Per-model routes. Registered last so /llm/stream and /llm/batch take precedence.
+
+@app.post("/llm/{model}")
+async def post_model_llm(request: Dict[str, Any], schema=Depends(get_model_schema), no_cache: bool = False,
+                         timeout: float = None, http_request: Request = None, timing: bool = False):
+    return await post_llm(request, schema, no_cache, timeout, http_request, timing)
+
+@app.post("/llm/{model}/stream")
+async def post_model_llm_stream(request: Dict[str, Any], schema=Depends(get_model_schema), timeout: float = None,
+                                http_request: Request = None, timing: bool = False):
+    return await post_llm_stream(request, schema, timeout, http_request, timing)
+
+@app.post("/llm/{model}/batch")
+async def post_model_llm_batch(requests: List[Dict[str, Any]], schema=Depends(get_model_schema), parallelism: int = None,
+                               timeout: float = None, http_request: Request = None):
+    return await post_llm_batch(requests, schema, parallelism, timeout, http_request)
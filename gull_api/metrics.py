@@ -0,0 +1,205 @@
+import bisect
+import contextvars
+import threading
+import time
+from typing import Callable, Dict, Iterable, Tuple
+
+# Latency buckets in seconds, from sub-millisecond stages up to long generations.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        label_values = tuple(map(str, label_values))
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in sorted(self._values.items()):
+            yield f"{self.name}{format_labels(self.labels, label_values)} {value}"
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        label_values = tuple(map(str, label_values))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *label_values) -> int:
+        series = self._series.get(label_values)
+        return series[2] if series is not None else 0
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                bucket_labels = format_labels(self.labels, label_values, 'le="' + le + '"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labels, label_values)} {total}"
+            yield f"{self.name}_count{format_labels(self.labels, label_values)} {count}"
+
+class Gauge:
+    """A gauge whose samples are read from a callback at scrape time."""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], collect: Callable[[], Dict[Tuple, float]]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        samples = {tuple(map(str, label_values)): value for label_values, value in self.collect().items()}
+        for label_values, value in sorted(samples.items()):
+            yield f"{self.name}{format_labels(self.labels, label_values)} {value}"
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+stage_duration = registry.register(Histogram(
+    "gull_stage_duration_seconds", "Time spent in each stage of an /llm request.", ("stage",)
+))
+http_requests = registry.register(Counter(
+    "gull_http_requests_total", "HTTP requests by handler and status code.", ("handler", "status")
+))
+http_duration = registry.register(Histogram(
+    "gull_http_request_duration_seconds", "Total HTTP request time by handler.", ("handler",)
+))
+generations = registry.register(Counter(
+    "gull_generations_total",
+    "Executed generations by model and outcome (ok, timeout, cancelled, nonzero_exit, error).",
+    ("model", "outcome"),
+))
+time_to_first_output = registry.register(Histogram(
+    "gull_time_to_first_output_seconds", "Time from spawning the executable to its first output, by model.", ("model",)
+))
+tokens_per_second = registry.register(Histogram(
+    "gull_tokens_per_second", "Decoding speed of successful generations, by model.", ("model",),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+))
+
+queue_wait = registry.register(Histogram(
+    "gull_queue_wait_seconds", "Time generations waited for an admission slot, by model.", ("model",)
+))
+prediction_error = registry.register(Histogram(
+    "gull_runtime_prediction_error_seconds",
+    "Absolute difference between predicted and actual generation time, by model.", ("model",),
+))
+
+def observe_timing(model: str, timing):
+    """Record a finished run's GenerationTiming."""
+    stats = timing.stats()
+    if stats["time_to_first_output"] is not None:
+        time_to_first_output.observe(stats["time_to_first_output"], model)
+    if stats["tokens_per_second"] is not None:
+        tokens_per_second.observe(stats["tokens_per_second"], model)
+
+# Set by MetricsMiddleware when a request arrives, so handlers can tell how
+# long the request spent in body reading, JSON parsing and dependency resolution.
+request_started = contextvars.ContextVar("request_started", default=None)
+
+class stage:
+    """Context manager timing one stage; a plain class is cheaper than @contextmanager."""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        stage_duration.observe(time.perf_counter() - self.start, self.name)
+        return False
+
+def observe_parse():
+    started = request_started.get()
+    if started is not None:
+        stage_duration.observe(time.perf_counter() - started, "parse")
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per-handler request counts, status codes and
+    total latency. The handler label is the endpoint function's name, which
+    keeps label cardinality bounded regardless of path parameters.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        token = request_started.set(start)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_started.reset(token)
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", "unmatched")
+            http_requests.inc(handler, str(status))
+            http_duration.observe(time.perf_counter() - start, handler)
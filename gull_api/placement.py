@@ -0,0 +1,189 @@
+import asyncio
+import fcntl
+import glob
+import logging
+import os
+import re
+from typing import IO, Iterable, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+NODE_CPULIST = "/sys/devices/system/node/node*/cpulist"
+
+def parse_cpulist(text: str) -> Set[int]:
+    """Parse the kernel's CPU list format, e.g. "0-3,8,10-11"."""
+    cpus = set()
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        cpus.update(range(int(start), int(end or start) + 1))
+    return cpus
+
+def numa_nodes(pattern: str = NODE_CPULIST) -> List[Set[int]]:
+    """CPU sets of the host's NUMA nodes, in node order; empty if not exposed."""
+    def node_number(path):
+        return int(re.search(r"node(\d+)", path).group(1))
+    nodes = []
+    for path in sorted(glob.glob(pattern), key=node_number):
+        with open(path) as f:
+            nodes.append(parse_cpulist(f.read()))
+    return nodes
+
+def with_threads(command: List[str], flag: str, threads: int) -> List[str]:
+    """Set `flag` to `threads` in an argv, replacing any value the request asked for."""
+    placed = []
+    skip = False
+    for arg in command:
+        if skip:
+            skip = False
+        elif arg == flag:
+            skip = True
+        else:
+            placed.append(arg)
+    return placed + [flag, str(threads)]
+
+def partition_cores(cpus: Sequence[int], parts: int, index: int) -> List[int]:
+    """
+    The `index`th of `parts` equal, contiguous shares of `cpus`, so that
+    neighbouring (usually same-node) cores stay together. Leftover cores are
+    left out; with more parts than cores, parts share single cores.
+    """
+    cpus = sorted(cpus)
+    size = max(1, len(cpus) // parts)
+    start = (index * size) % len(cpus)
+    return cpus[start:start + size]
+
+def claim_partition(parts: int, lock_dir: str) -> Tuple[int, Optional[IO]]:
+    """
+    Claim one of `parts` core shares for this process by holding an exclusive
+    lock on its file in `lock_dir` for as long as the process lives. Returns
+    the share's index and the locked file, which must be kept open.
+    """
+    os.makedirs(lock_dir, exist_ok=True)
+    for index in range(parts):
+        lock_file = open(os.path.join(lock_dir, f"partition-{index}.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            continue
+        return index, lock_file
+    # More processes than shares, e.g. a replacement worker starting before the
+    # old one has exited; share a partition rather than refuse to start.
+    index = os.getpid() % parts
+    logger.warning("All %d core partitions are claimed; sharing partition %d", parts, index)
+    return index, None
+
+class CoreSlot:
+    """A fixed set of cores, all on one NUMA node where possible, for one process at a time."""
+
+    def __init__(self, index: int, cpus: Sequence[int], node: Optional[int]):
+        self.index = index
+        self.cpus = tuple(cpus)
+        self.node = node
+        self.busy = False
+        self.uses = 0
+
+    @property
+    def threads(self) -> int:
+        return len(self.cpus)
+
+    def pin(self, pid: int):
+        try:
+            os.sched_setaffinity(pid, self.cpus)
+        except ProcessLookupError:
+            # Already exited; nothing left to pin.
+            pass
+
+    def stats(self) -> dict:
+        return {"cpus": list(self.cpus), "node": self.node, "busy": self.busy, "uses": self.uses}
+
+class CoreLease:
+    """One process's hold on a core slot. Releasing it more than once is a no-op."""
+
+    def __init__(self, placement: "Placement", slot: CoreSlot):
+        self._placement = placement
+        self.slot = slot
+        self.released = False
+
+    @property
+    def threads(self) -> int:
+        return self.slot.threads
+
+    def pin(self, pid: int):
+        self.slot.pin(pid)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._placement._release(self.slot)
+
+class Placement:
+    """
+    Splits the cores this process may use into slots of `cores_per_slot`,
+    never spanning NUMA nodes, and hands each executor process a slot of its
+    own. Processes beyond the number of slots wait for one, so running
+    processes times threads never exceeds the core count.
+
+    Affinity is set from the parent right after spawning; threads the child
+    starts from then on inherit it. Slots are not shared between server
+    processes, so several workers should each be given their own `cpus`
+    (see `partition_cores`).
+    """
+
+    def __init__(self, cores_per_slot: int, cpus: Iterable[int] = None, nodes: List[Set[int]] = None):
+        cpus = sorted(cpus if cpus is not None else os.sched_getaffinity(0))
+        if nodes is None:
+            nodes = numa_nodes()
+        groups = [(index, [cpu for cpu in cpus if cpu in node]) for index, node in enumerate(nodes)]
+        unassigned = [cpu for cpu in cpus if not any(cpu in node for node in nodes)]
+        if unassigned:
+            groups.append((None, unassigned))
+        cores_per_slot = max(1, min(cores_per_slot, len(cpus)))
+
+        self.slots = []
+        for node, group in groups:
+            # Leftover cores that don't fill a slot stay idle rather than oversubscribing.
+            for start in range(0, len(group) - cores_per_slot + 1, cores_per_slot):
+                self.slots.append(CoreSlot(len(self.slots), group[start:start + cores_per_slot], node))
+        if not self.slots:
+            # No node has enough cores for a whole slot; give up node locality.
+            self.slots.append(CoreSlot(0, cpus[:cores_per_slot], None))
+        self.cores_per_slot = cores_per_slot
+        self._free = None
+
+    def _queue(self) -> asyncio.Queue:
+        # Created lazily so it binds to the running event loop.
+        if self._free is None:
+            self._free = asyncio.Queue()
+            for slot in self.slots:
+                if not slot.busy:
+                    self._free.put_nowait(slot)
+        return self._free
+
+    def _take(self, slot: CoreSlot) -> CoreLease:
+        slot.busy = True
+        slot.uses += 1
+        return CoreLease(self, slot)
+
+    async def acquire(self) -> CoreLease:
+        return self._take(await self._queue().get())
+
+    def try_acquire(self) -> Optional[CoreLease]:
+        try:
+            return self._take(self._queue().get_nowait())
+        except asyncio.QueueEmpty:
+            return None
+
+    def _release(self, slot: CoreSlot):
+        slot.busy = False
+        self._queue().put_nowait(slot)
+
+    def stats(self) -> dict:
+        return {
+            "cores_per_slot": self.cores_per_slot,
+            "slots": len(self.slots),
+            "busy": sum(slot.busy for slot in self.slots),
+            "occupancy": [slot.stats() for slot in self.slots],
+        }
@@ -0,0 +1,207 @@
+import asyncio
+import json
+import logging
+import subprocess
+from typing import List, Tuple
+import anyio
+from gull_api import config
+from gull_api.executor import BoundedBuffer, cap_text, terminate_process
+
+logger = logging.getLogger(__name__)
+
+# Replies are read in pieces of this size, so a long one needs no larger buffer.
+READ_CHUNK_BYTES = 64 * 1024
+
+class WorkerCrashedError(Exception):
+    pass
+
+class WorkerReplyTooLarge(Exception):
+    pass
+
+def reply_limit() -> int:
+    """
+    Largest reply line read from a worker: room for stdout and stderr at
+    their caps, doubled for JSON escaping (0 when either is uncapped).
+    """
+    if not config.STDOUT_MAX_BYTES or not config.STDERR_MAX_BYTES:
+        return 0
+    return 2 * (config.STDOUT_MAX_BYTES + config.STDERR_MAX_BYTES) + READ_CHUNK_BYTES
+
+class Worker:
+    """
+    One long-lived executor process speaking the line-delimited JSON protocol:
+
+        -> {"argv": ["-n", "128", "--prompt", "Hello"]}
+        <- {"stdout": "...", "stderr": "", "returncode": 0}
+
+        -> {"ping": true}
+        <- {"pong": true}
+
+    The process is expected to keep the model resident between requests.
+    With a `core_slot`, it is pinned to that slot's cores on every start.
+    """
+
+    def __init__(self, command: List[str], core_slot=None):
+        self.command = command
+        self.core_slot = core_slot
+        self.process = None
+        self.requests_served = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, limit=READ_CHUNK_BYTES,
+            start_new_session=True,
+        )
+        if self.core_slot is not None:
+            self.core_slot.pin(self.process.pid)
+        self.requests_served = 0
+
+    async def stop(self, grace: float = 5.0):
+        process, self.process = self.process, None
+        if process is None or process.returncode is not None:
+            return
+        try:
+            process.stdin.close()
+            await asyncio.wait_for(process.wait(), timeout=grace)
+        except (asyncio.TimeoutError, ProcessLookupError, ConnectionError):
+            await terminate_process(process, grace=0)
+
+    async def restart(self):
+        await self.stop(grace=0)
+        await self.start()
+
+    async def _call(self, message: dict) -> dict:
+        if not self.alive:
+            raise WorkerCrashedError("worker process is not running")
+        self.process.stdin.write(json.dumps(message).encode("utf-8") + b"\n")
+        await self.process.stdin.drain()
+        return json.loads(await self._read_reply())
+
+    async def _read_reply(self) -> str:
+        # Held like captured output, in a temporary file past OUTPUT_SPILL_BYTES.
+        # A reply past the limit is still read to its end, so the worker never
+        # blocks on a full pipe and can be stopped.
+        line = BoundedBuffer(reply_limit(), config.OUTPUT_SPILL_BYTES)
+        while True:
+            try:
+                line.write(await self.process.stdout.readuntil(b"\n"))
+                break
+            except asyncio.LimitOverrunError as e:
+                line.write(await self.process.stdout.readexactly(e.consumed))
+            except asyncio.IncompleteReadError:
+                raise WorkerCrashedError("worker process exited mid-request")
+        text = line.text()
+        if line.truncated:
+            raise WorkerReplyTooLarge(f"worker reply exceeded {line.max_bytes} bytes")
+        return text
+
+    async def run(self, argv: List[str]) -> Tuple[str, str, int]:
+        reply = await self._call({"argv": argv})
+        self.requests_served += 1
+        return (
+            cap_text(reply.get("stdout", ""), config.STDOUT_MAX_BYTES),
+            cap_text(reply.get("stderr", ""), config.STDERR_MAX_BYTES),
+            reply.get("returncode", 0),
+        )
+
+    async def ping(self, timeout: float) -> bool:
+        try:
+            reply = await asyncio.wait_for(self._call({"ping": True}), timeout=timeout)
+        except Exception:
+            return False
+        return reply.get("pong") is True
+
+class WorkerPool:
+    """
+    Keeps `size` warm workers and hands each request to an idle one.
+
+    A worker is restarted when it crashes, times out or fails a health check,
+    and recycled after `max_requests` requests (0 disables recycling).
+    """
+
+    def __init__(self, command: List[str], size: int, max_requests: int = 0,
+                 health_interval: float = 30.0, health_timeout: float = 5.0, core_slots: List = None):
+        self.command = command
+        self.size = size
+        self.max_requests = max_requests
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        core_slots = core_slots or [None] * size
+        self.workers = [Worker(command, core_slots[index]) for index in range(size)]
+        self.restarts = 0
+        self._idle = None
+        self._health_task = None
+
+    async def start(self):
+        self._idle = asyncio.Queue()
+        for worker in self.workers:
+            await worker.start()
+            self._idle.put_nowait(worker)
+        if self.health_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self, grace: float = 5.0):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        await asyncio.gather(*(worker.stop(grace) for worker in self.workers))
+
+    async def _restart(self, worker: Worker):
+        self.restarts += 1
+        try:
+            await worker.restart()
+        except Exception:
+            # Leave it dead; the next health check or request will try again.
+            logger.exception("Failed to restart worker %s", self.command)
+
+    async def run(self, argv: List[str], timeout: float) -> Tuple[str, str, int]:
+        worker = await self._idle.get()
+        try:
+            if not worker.alive:
+                await self._restart(worker)
+            try:
+                result = await asyncio.wait_for(worker.run(argv), timeout=timeout)
+            except BaseException:
+                # The worker may still be mid-generation or dead; either way its
+                # stdout can no longer be trusted to line up with requests.
+                # Shielded, so a disconnect's cancel scope can't cut the restart short.
+                with anyio.CancelScope(shield=True):
+                    await self._restart(worker)
+                raise
+            if self.max_requests and worker.requests_served >= self.max_requests:
+                await self._restart(worker)
+            return result
+        finally:
+            self._idle.put_nowait(worker)
+
+    async def check_health(self):
+        # Only idle workers are checked; busy ones prove their health by answering.
+        for _ in range(self._idle.qsize()):
+            worker = self._idle.get_nowait()
+            try:
+                if not await worker.ping(self.health_timeout):
+                    logger.warning("Worker failed health check, restarting")
+                    await self._restart(worker)
+            finally:
+                self._idle.put_nowait(worker)
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_health()
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            "alive": sum(worker.alive for worker in self.workers),
+            "restarts": self.restarts,
+        }
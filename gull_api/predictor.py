@@ -0,0 +1,130 @@
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import BaseModel
+from gull_api import config
+
+# Features are scaled to thousands so the ridge term weighs them evenly.
+SCALE = 1000.0
+
+def request_size(schema, validated_request: BaseModel) -> Tuple[float, float]:
+    """
+    What a request's runtime mostly depends on: the number of tokens it may
+    generate (the value of the model's length flag, "-n" by default) and the
+    total length of its text parameters, the prompt among them.
+    """
+    values = validated_request.dict()
+    length_flag = schema.length_flag or config.LENGTH_FLAG
+    max_tokens = 0.0
+    text_length = 0
+    for param in schema.params:
+        value = values.get(param["name"])
+        if value is None:
+            continue
+        if param["flag"] == length_flag and isinstance(value, (int, float)):
+            max_tokens = float(value)
+        elif isinstance(value, str):
+            text_length += len(value)
+    return max_tokens, float(text_length)
+
+def solve(matrix: List[List[float]], vector: List[float]) -> Optional[List[float]]:
+    """Solve a small linear system by Gaussian elimination; None if it is singular."""
+    n = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(n)]
+    for column in range(n):
+        pivot = max(range(column, n), key=lambda row: abs(rows[row][column]))
+        if abs(rows[pivot][column]) < 1e-12:
+            return None
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        for row in range(column + 1, n):
+            factor = rows[row][column] / rows[column][column]
+            for k in range(column, n + 1):
+                rows[row][k] -= factor * rows[column][k]
+    solution = [0.0] * n
+    for row in reversed(range(n)):
+        solution[row] = (rows[row][n] - sum(rows[row][k] * solution[k] for k in range(row + 1, n))) / rows[row][row]
+    return solution
+
+class RuntimePredictor:
+    """
+    Predicts how long a generation of one model will run from its
+    `request_size`, as base + a * max_tokens + b * text_length, fitted by
+    least squares on the run times of completed generations. Each new run
+    discounts the weight of earlier ones by `decay`, so the fit follows
+    changes in load or hardware.
+
+    Until `min_samples` runs have been seen it predicts their mean, and
+    before the first one nothing at all.
+    """
+
+    def __init__(self, decay: float = 0.99, min_samples: int = 5, ridge: float = 1e-5):
+        self.decay = decay
+        self.min_samples = min_samples
+        self.ridge = ridge
+        self.samples = 0
+        # Weighted normal equations over the features (1, max_tokens, text_length).
+        self._xtx = [[0.0] * 3 for _ in range(3)]
+        self._xty = [0.0] * 3
+        self._coefficients = None
+        self.predictions = 0
+        self.total_abs_error = 0.0
+        self.total_error = 0.0
+        self.total_relative_error = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _features(size: Tuple[float, float]) -> List[float]:
+        return [1.0, size[0] / SCALE, size[1] / SCALE]
+
+    def _fit(self) -> Optional[List[float]]:
+        if self._coefficients is None and self.samples >= self.min_samples:
+            matrix = [row[:] for row in self._xtx]
+            # A little ridge on the slopes keeps the fit defined while every
+            # request so far has had the same size.
+            for i in (1, 2):
+                matrix[i][i] += self.ridge * matrix[0][0]
+            self._coefficients = solve(matrix, self._xty)
+        return self._coefficients
+
+    def predict(self, size: Tuple[float, float]) -> Optional[float]:
+        """Predicted seconds for a request of this size, or None before any runs."""
+        with self._lock:
+            if not self.samples:
+                return None
+            coefficients = self._fit()
+            if coefficients is None:
+                return self._xty[0] / self._xtx[0][0]
+            x = self._features(size)
+            return max(0.0, sum(c * v for c, v in zip(coefficients, x)))
+
+    def observe(self, size: Tuple[float, float], duration: float, predicted: float = None):
+        """Add a completed run, and score the prediction made for it if there was one."""
+        x = self._features(size)
+        with self._lock:
+            for i in range(3):
+                self._xty[i] = self.decay * self._xty[i] + x[i] * duration
+                for j in range(3):
+                    self._xtx[i][j] = self.decay * self._xtx[i][j] + x[i] * x[j]
+            self.samples += 1
+            self._coefficients = None
+            if predicted is not None:
+                self.predictions += 1
+                self.total_abs_error += abs(predicted - duration)
+                self.total_error += predicted - duration
+                if duration > 0:
+                    self.total_relative_error += abs(predicted - duration) / duration
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            coefficients = self._fit()
+            predictions = self.predictions
+            return {
+                "samples": self.samples,
+                "base_seconds": coefficients[0] if coefficients else None,
+                "seconds_per_1k_tokens": coefficients[1] if coefficients else None,
+                "seconds_per_1k_chars": coefficients[2] if coefficients else None,
+                "predictions": predictions,
+                "mean_abs_error_seconds": self.total_abs_error / predictions if predictions else None,
+                # Positive when runs tend to be shorter than predicted.
+                "mean_error_seconds": self.total_error / predictions if predictions else None,
+                "mean_relative_error": self.total_relative_error / predictions if predictions else None,
+            }
@@ -0,0 +1,146 @@
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import mmap
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+COLD = "cold"
+WARMING = "warming"
+WARM = "warm"
+FAILED = "failed"
+
+def model_paths(catalog) -> List[str]:
+    """
+    Files the models in `catalog` will load: the defaults of string
+    parameters, such as the hidden "Model" one, that name an existing file.
+    """
+    paths = []
+    for schema in catalog.models.values():
+        for param in schema.params:
+            default = param.get("default")
+            if param["type"] == "str" and isinstance(default, str) and os.path.isfile(default):
+                path = os.path.realpath(default)
+                if path not in paths:
+                    paths.append(path)
+    return paths
+
+def read_file(path: str, chunk_size: int = 1 << 20) -> int:
+    """Read a whole file so it ends up in the page cache; returns its size."""
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            # Let the kernel read ahead as far as it likes while we go.
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        buffer = bytearray(chunk_size)
+        size = 0
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                return size
+            size += read
+
+class LockedFile:
+    """A read-only shared mapping of a file, held in memory with mlock until `release`."""
+
+    def __init__(self, path: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.mmap.restype = ctypes.c_void_p
+        libc.mmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long)
+        libc.mlock.argtypes = libc.munmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+        self._libc = libc
+        self.path = path
+        self.size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            address = libc.mmap(None, self.size, mmap.PROT_READ, mmap.MAP_SHARED, f.fileno(), 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        self.address = address
+        # The pages are the page cache's own, so the executor processes use them too.
+        if libc.mlock(address, self.size) != 0:
+            error = ctypes.get_errno()
+            self.release()
+            raise OSError(error, f"mlock failed: {os.strerror(error)}", path)
+
+    def release(self):
+        if self.address is not None:
+            self._libc.munmap(self.address, self.size)
+            self.address = None
+
+class Prewarmer:
+    """
+    Takes a server from cold to warm after a deploy: reads the model files
+    named in cli.json into the page cache, optionally locking them there
+    with `lock`, then runs one `warm_up` generation per model. Until that
+    has succeeded the server isn't `ready`.
+    """
+
+    def __init__(self, lock: bool = False):
+        self.lock = lock
+        self.state = COLD
+        self.error = None
+        self.files = {}
+        self.warm_ups = {}
+        self.started_at = None
+        self.finished_at = None
+        self._locked = []
+
+    @property
+    def ready(self) -> bool:
+        return self.state == WARM
+
+    def warm_file(self, path: str) -> Dict[str, Any]:
+        """Blocking; run in a thread."""
+        started = time.monotonic()
+        result = {"bytes": read_file(path), "locked": False}
+        if self.lock:
+            try:
+                self._locked.append(LockedFile(path))
+                result["locked"] = True
+            except OSError as e:
+                # Without CAP_IPC_LOCK or enough RLIMIT_MEMLOCK; the file is still cached.
+                logger.warning("Could not lock %s in memory: %s", path, e)
+                result["lock_error"] = str(e)
+        result["seconds"] = round(time.monotonic() - started, 3)
+        return result
+
+    async def run(self, catalog, warm_up: Callable[[Any], Awaitable[float]] = None):
+        """
+        Warm every model file, then run `warm_up(schema)` for each model,
+        which returns the seconds it took or raises.
+        """
+        self.state = WARMING
+        self.started_at = time.time()
+        try:
+            for path in model_paths(catalog):
+                self.files[path] = await asyncio.to_thread(self.warm_file, path)
+                logger.info("Warmed %s (%d bytes) in %.1fs", path, self.files[path]["bytes"], self.files[path]["seconds"])
+            if warm_up is not None:
+                for schema in catalog.models.values():
+                    self.warm_ups[schema.name] = round(await warm_up(schema), 3)
+        except Exception as e:
+            logger.exception("Warm-up failed; not reporting ready")
+            self.state = FAILED
+            self.error = str(e)
+        else:
+            self.state = WARM
+        self.finished_at = time.time()
+
+    def release(self):
+        while self._locked:
+            self._locked.pop().release()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "error": self.error,
+            "files": self.files,
+            "warm_up_seconds": self.warm_ups,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
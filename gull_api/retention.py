@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List
+import sqlalchemy
+from sqlalchemy import or_
+from sqlalchemy.exc import SQLAlchemyError
+from gull_api import config
+from gull_api.db import APIRequestLog, LogContent, get_default_session_maker, load_contents, log_to_dict
+
+logger = logging.getLogger(__name__)
+
+def archive_batch(rows: List[Dict[str, Any]], archive_dir: str) -> str:
+    """Write log records to a gzipped JSONL file named after their id range; returns its path."""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"api_request_log-{rows[0]['id']:012d}-{rows[-1]['id']:012d}.jsonl.gz")
+    partial = path + ".partial"
+    with gzip.open(partial, "wt", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    # Renamed into place only once complete, so an archive file is never half written.
+    os.replace(partial, path)
+    return path
+
+def compact_log_table(older_than: float, archive_dir: str = None, session_maker=None,
+                      batch_size: int = 1000) -> Dict[str, Any]:
+    """
+    Remove request log records from before `older_than` (Unix time; records
+    without a timestamp predate it too) in batches of `batch_size`, first
+    writing each batch to `archive_dir` as compressed JSONL if given. Then
+    drop stored request contents that no remaining record refers to.
+
+    A batch is only deleted after its archive file is complete, so an
+    interrupted run loses nothing and can simply be run again.
+    """
+    if session_maker is None:
+        session_maker = get_default_session_maker()
+    old = or_(APIRequestLog.timestamp < older_than, APIRequestLog.timestamp.is_(None))
+    result = {"archived": 0, "deleted": 0, "contents_deleted": 0, "files": []}
+    while True:
+        session = session_maker()
+        try:
+            logs = session.query(APIRequestLog).filter(old).order_by(APIRequestLog.id).limit(batch_size).all()
+            if not logs:
+                break
+            if archive_dir:
+                contents = load_contents(session, logs)
+                rows = [log_to_dict(log, include_response=True, contents=contents) for log in logs]
+                result["files"].append(archive_batch(rows, archive_dir))
+                result["archived"] += len(rows)
+            ids = [log.id for log in logs]
+            session.query(APIRequestLog).filter(APIRequestLog.id.in_(ids)).delete(synchronize_session=False)
+            session.commit()
+            result["deleted"] += len(ids)
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    session = session_maker()
+    try:
+        referenced = session.query(APIRequestLog.request_content).filter(APIRequestLog.request_content.isnot(None))
+        # Only contents older than the cutoff, so one a writer is reusing right now is left alone.
+        result["contents_deleted"] = session.query(LogContent).filter(
+            LogContent.created_at < older_than, LogContent.hash.notin_(referenced),
+        ).delete(synchronize_session=False)
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    return result
+
+class LogRetention:
+    """
+    Runs `compact_log_table` every `interval` seconds in the background,
+    keeping `retention_days` of request log records.
+    """
+
+    def __init__(self, retention_days: float, archive_dir: str = None, interval: float = 3600,
+                 session_maker=None):
+        self.retention_days = retention_days
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self.session_maker = session_maker
+        self.runs = 0
+        self.archived = 0
+        self.deleted = 0
+        self.last_run = None
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def run_once(self) -> Dict[str, Any]:
+        cutoff = time.time() - self.retention_days * 86400
+        result = compact_log_table(cutoff, self.archive_dir, self.session_maker)
+        self.runs += 1
+        self.archived += result["archived"]
+        self.deleted += result["deleted"]
+        self.last_run = time.time()
+        return result
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except (SQLAlchemyError, OSError):
+                logger.exception("Request log compaction failed")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "retention_days": self.retention_days,
+            "runs": self.runs,
+            "archived": self.archived,
+            "deleted": self.deleted,
+            "last_run": self.last_run,
+        }
+
+def vacuum(session_maker=None):
+    """Return the space freed by deleted rows to the filesystem (SQLite only)."""
+    if session_maker is None:
+        session_maker = get_default_session_maker()
+    engine = session_maker.kw["bind"]
+    if engine.dialect.name == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(sqlalchemy.text("VACUUM"))
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Prune old GULL-API request log records, optionally archiving them.')
+    parser.add_argument('--older-than-days', default=config.LOG_RETENTION_DAYS or 30, type=float,
+                        help='Remove records older than this many days (default: LOG_RETENTION_DAYS, or 30)')
+    parser.add_argument('--archive-dir', default=config.LOG_ARCHIVE_DIR or None, type=str,
+                        help='Write removed records here as gzipped JSONL first (default: LOG_ARCHIVE_DIR)')
+    parser.add_argument('--batch-size', default=1000, type=int, help='Records per archive file and transaction (default: 1000)')
+    parser.add_argument('--vacuum', action='store_true', help='Compact the SQLite database file afterwards')
+    return parser
+
+def main():
+    args = create_parser().parse_args()
+    result = compact_log_table(time.time() - args.older_than_days * 86400, args.archive_dir, batch_size=args.batch_size)
+    if args.vacuum:
+        vacuum()
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -1,4 +1,8 @@
 import argparse
+import os
+import subprocess
+import sys
+import time
 
 
 def create_parser():
@@ -11,6 +15,11 @@ def create_parser():
     parser.add_argument('--workers', default=1, type=int, help='Number of worker processes (default: 1)')
     parser.add_argument('--reload', action='store_true', help='Enable auto-reload')
     parser.add_argument('--reload-dir', default=None, type=str, help='Set reload directories explicitly, instead of using the current working directory')
+    parser.add_argument('--log-writer', action='store_true', help='Write request logs from a single separate process, for --workers > 1 with SQLite')
+    parser.add_argument('--log-socket', default=None, type=str, help='Unix socket for --log-writer (default: LOG_SOCKET)')
+    parser.add_argument('--prewarm', action='store_true', help='Read the model files into the page cache at startup; /ready reports 503 until done')
+    parser.add_argument('--warmup-request', default=None, type=str, help='JSON payload to run once per model after --prewarm (default: WARMUP_REQUEST)')
+    parser.add_argument('--dispatch', nargs='*', default=None, metavar='URL', help='Run as a dispatcher forwarding /llm to the least-loaded of these gull_api backends (default: DISPATCH_BACKENDS)')
     
     return parser
 
@@ -18,7 +27,7 @@ def create_parser():
 def run_uvicorn(args, uvicorn_module):
     # Call uvicorn.run with the user-specified options
     uvicorn_module.run(
-        "gull_api.main:app",
+        "gull_api.dispatcher:app" if args.dispatch is not None else "gull_api.main:app",
         host=args.host,
         port=args.port,
         log_level=args.log_level,
@@ -28,13 +37,82 @@ def run_uvicorn(args, uvicorn_module):
     )
 
 
+def configure_prewarm(args):
+    # The worker processes read these through the environment.
+    if args.prewarm:
+        os.environ['PREWARM'] = 'true'
+    if args.warmup_request:
+        os.environ['WARMUP_REQUEST'] = args.warmup_request
+
+
+def configure_placement(args):
+    # Each worker claims its own share of the cores instead of all of them.
+    if args.workers > 1:
+        os.environ['PLACEMENT_WORKERS'] = str(args.workers)
+
+
+def configure_dispatch(args):
+    # The dispatcher's worker processes read the backends through the environment.
+    if args.dispatch:
+        os.environ['DISPATCH_BACKENDS'] = ','.join(args.dispatch)
+
+
+def prepare_database():
+    # Create the schema once before the workers start, rather than in all of them at once.
+    from gull_api import db
+    engine = db.get_engine()
+    try:
+        db.create_schema(engine)
+    finally:
+        engine.dispose()
+
+
+def start_log_writer(socket_path, timeout=10.0):
+    """
+    Start the log writer process and point the server processes at it. The
+    workers inherit LOG_MODE and LOG_SOCKET through the environment.
+    """
+    process = subprocess.Popen([sys.executable, '-m', 'gull_api.logserver', '--socket', socket_path])
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(socket_path):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError(f'Log writer failed to start on {socket_path}')
+        time.sleep(0.05)
+    os.environ['LOG_MODE'] = 'socket'
+    os.environ['LOG_SOCKET'] = socket_path
+    return process
+
+
+def stop_log_writer(process, timeout=30.0):
+    # SIGTERM makes the writer flush what it has received before exiting.
+    process.terminate()
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
 def main():
     parser = create_parser()
     args = parser.parse_args()
     
     # Import uvicorn here so it can be mocked in tests
     import uvicorn
-    run_uvicorn(args, uvicorn)
+    configure_prewarm(args)
+    configure_placement(args)
+    configure_dispatch(args)
+    if args.workers > 1 and args.dispatch is None:
+        prepare_database()
+    if not args.log_writer or args.dispatch is not None:
+        run_uvicorn(args, uvicorn)
+        return
+    from gull_api import config
+    log_writer = start_log_writer(os.path.abspath(args.log_socket or config.LOG_SOCKET))
+    try:
+        run_uvicorn(args, uvicorn)
+    finally:
+        stop_log_writer(log_writer)
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -0,0 +1,272 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from pydantic import BaseModel, Field, create_model
+from gull_api import config
+
+logger = logging.getLogger(__name__)
+
+def get_single_key(dictionary: Dict[str, Any]) -> str:
+    return list(dictionary.keys())[0]
+
+def create_llm_request_model(cli_json: Dict[str, Any]) -> BaseModel:
+    fields = {}
+    for param in cli_json[get_single_key(cli_json)]:
+        param_name = param["name"]
+        field_kwargs = {"description": param["description"]}
+        if "default" in param:
+            field_kwargs["default"] = param["default"]
+        else:
+            if param.get('required', True) is False:
+                field_kwargs["default"] = None
+        if "min" in param and "max" in param:
+            field_kwargs["gt"] = param["min"]
+            field_kwargs["lt"] = param["max"]
+        fields[param["name"]] = (param["type"], Field(**field_kwargs))
+    return create_model("LLMRequest", **fields)
+
+def convert_request_to_cli_command(request: BaseModel, cli_json: Dict[str, Any]) -> str:
+    cli_args = []
+    command = [config.EXECUTABLE]  # use executable from config
+    for param in cli_json[get_single_key(cli_json)]:
+        param_name = param["name"]
+        if param_name in request.dict():
+            value = request.dict()[param_name]
+            flag = param["flag"]
+            if param["type"] == "bool":
+                if value:
+                    cli_args.append(flag)
+            else:
+                cli_args.append(flag)
+                cli_args.append(str(value))
+    command += cli_args
+    return command
+
+def convert_cli_json_to_api_format(cli_json: Dict[str, Any]) -> Dict[str, Any]:
+    key = get_single_key(cli_json)
+    api_json = {key: []}
+    for param in cli_json[key]:
+        if not param.get("hidden", False):
+            api_param = {
+                "name": param["name"],
+                "type": param["type"],
+                "description": param["description"],
+            }
+            if "default" in param:
+                api_param["default"] = param["default"]
+            if "min" in param and "max" in param:
+                api_param["min"] = param["min"]
+                api_param["max"] = param["max"]
+                if param["type"] == "int" or param["type"] == "float":
+                    api_param["step"] = param.get("step", 1 if param["type"] == "int" else 0.01)  # respect "step" if provided in cli_json
+            if param.get("required", False):
+                api_param["required"] = param["required"]  # respect "required" if provided in cli_json
+            api_json[key].append(api_param)
+    return api_json
+
+def schema_version(cli_json: Dict[str, Any]) -> str:
+    canonical = json.dumps(cli_json, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+def split_model_entry(entry: Any) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    A model entry in cli.json is either the list of parameters, or an object
+    with a "params" list plus per-model settings ("executable",
+    "max_concurrency", "worker_pool_size", "worker_command", "timeout",
+    "threads_flag", "length_flag", "temperature_flag", "seed_flag").
+    """
+    if isinstance(entry, list):
+        return entry, {}
+    settings = {key: value for key, value in entry.items() if key != "params"}
+    return entry["params"], settings
+
+class CompiledSchema:
+    """
+    Everything derived from one model's entry in cli.json, built once and
+    shared by every request that sees this version.
+
+    Instances are never mutated after construction, so a request that grabbed
+    a schema keeps a consistent view even if the registry swaps in a newer one
+    while it is still running.
+    """
+
+    def __init__(self, cli_json: Dict[str, Any], version: str = None):
+        self.name = get_single_key(cli_json)
+        self.params, settings = split_model_entry(cli_json[self.name])
+        self.cli_json = {self.name: self.params}
+        self.version = version or schema_version(cli_json)
+        self.executable = settings.get("executable")
+        self.max_concurrency = settings.get("max_concurrency")
+        self.worker_pool_size = settings.get("worker_pool_size")
+        self.worker_command = settings.get("worker_command")
+        self.timeout = settings.get("timeout")
+        self.threads_flag = settings.get("threads_flag")
+        self.length_flag = settings.get("length_flag")
+        self.temperature_flag = settings.get("temperature_flag")
+        self.seed_flag = settings.get("seed_flag")
+        self.request_model = create_llm_request_model(self.cli_json)
+        self.api_json = convert_cli_json_to_api_format(self.cli_json)
+        # (name, flag, is_bool) in cli.json order, so argv building is a single pass.
+        self._flags = [(param["name"], param["flag"], param["type"] == "bool") for param in self.params]
+
+    def validate(self, request: Dict[str, Any]) -> BaseModel:
+        return self.request_model(**request)
+
+    def build_command(self, validated_request: BaseModel) -> List[str]:
+        values = validated_request.dict()
+        command = [self.executable or config.EXECUTABLE]
+        for name, flag, is_bool in self._flags:
+            if name not in values:
+                continue
+            value = values[name]
+            if is_bool:
+                if value:
+                    command.append(flag)
+            else:
+                command.append(flag)
+                command.append(str(value))
+        return command
+
+class ApiDocument:
+    """
+    The /api response, serialized once per catalog: the JSON bytes, their
+    gzip encoding and a strong ETag for each. The tag is a hash of the
+    content, so it only changes when the API description does.
+    """
+
+    def __init__(self, api_json: Dict[str, Any]):
+        # Same encoding FastAPI's JSONResponse would produce.
+        self.body = json.dumps(api_json, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        # mtime=0 so the compressed bytes, like the tag, depend only on the content.
+        gzipped = gzip.compress(self.body, compresslevel=9, mtime=0)
+        self.gzip_body = gzipped if len(gzipped) < len(self.body) else None
+        self.gzip_etag = f'"{digest}-gzip"'
+
+    def matches(self, if_none_match: str) -> bool:
+        """Whether an If-None-Match header names either representation (weak comparison, as RFC 9110 requires)."""
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or self.etag in tags or self.gzip_etag in tags
+
+class ModelCatalog:
+    """
+    The compiled schemas of every model defined in cli.json, in file order.
+    The first model is the default one served by the unprefixed routes.
+    """
+
+    def __init__(self, cli_json: Dict[str, Any]):
+        if not cli_json:
+            raise ValueError("cli.json defines no models")
+        self.models = {name: CompiledSchema({name: entry}) for name, entry in cli_json.items()}
+        self.default = next(iter(self.models.values()))
+        self.version = schema_version(cli_json)
+        self.api_json = {}
+        for schema in self.models.values():
+            self.api_json.update(schema.api_json)
+        self.api_document = ApiDocument(self.api_json)
+
+    def get(self, name: str) -> Optional[CompiledSchema]:
+        return self.models.get(name)
+
+def load_cli_json_path(path: str) -> Dict[str, Any]:
+    """
+    Load a cli.json file, or merge every *.json file in a directory (in
+    filename order) into one model mapping.
+    """
+    if not os.path.isdir(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    merged = {}
+    for filename in sorted(os.listdir(path)):
+        if filename.endswith(".json"):
+            with open(os.path.join(path, filename), "r") as f:
+                for name, entry in json.load(f).items():
+                    if name in merged:
+                        logger.warning("Model %s in %s overrides an earlier definition", name, filename)
+                    merged[name] = entry
+    return merged
+
+def path_stamp(path: str) -> Tuple:
+    """Changes whenever the file, or any *.json file in the directory, changes."""
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    stamp = []
+    for filename in sorted(os.listdir(path)):
+        if filename.endswith(".json"):
+            stat = os.stat(os.path.join(path, filename))
+            stamp.append((filename, stat.st_mtime_ns, stat.st_size))
+    return tuple(stamp)
+
+class SchemaRegistry:
+    """
+    Holds the current ModelCatalog for a cli.json file (or a directory of
+    them) and recompiles it when the file changes on disk.
+
+    The path is stat()ed at most once every `poll_interval` seconds; it is only
+    re-read and recompiled when an mtime or size changed. If a changed file
+    fails to parse, the last good catalog keeps being served.
+    """
+
+    def __init__(self, path: str = None, poll_interval: float = None):
+        self._path = path
+        self.poll_interval = config.CLI_JSON_POLL_INTERVAL if poll_interval is None else poll_interval
+        self._catalog = None
+        self._stamp = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return self._path or config.CLI_JSON_PATH
+
+    def get(self) -> ModelCatalog:
+        catalog = self._catalog
+        if catalog is not None and time.monotonic() - self._checked_at < self.poll_interval:
+            return catalog
+        return self.refresh()
+
+    def refresh(self, force: bool = False) -> ModelCatalog:
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._catalog is not None and now - self._checked_at < self.poll_interval:
+                return self._catalog
+            self._checked_at = now
+            try:
+                stamp = path_stamp(self.path)
+            except OSError:
+                if self._catalog is None:
+                    raise
+                logger.warning("cli.json at %s is unavailable, keeping schema %s", self.path, self._catalog.version)
+                return self._catalog
+            if force or stamp != self._stamp:
+                try:
+                    cli_json = load_cli_json_path(self.path)
+                    if not force and self._catalog is not None and schema_version(cli_json) == self._catalog.version:
+                        # Touched but not changed: keep the compiled catalog and its serialized /api.
+                        self._stamp = stamp
+                        return self._catalog
+                    catalog = ModelCatalog(cli_json)
+                except Exception:
+                    if self._catalog is None:
+                        raise
+                    logger.exception("Failed to reload %s, keeping schema %s", self.path, self._catalog.version)
+                    return self._catalog
+                # Single attribute assignment: in-flight requests keep the schema they already hold.
+                self._catalog = catalog
+                self._stamp = stamp
+            return self._catalog
+
+registry = SchemaRegistry()
+
+def get_catalog() -> ModelCatalog:
+    return registry.get()
+
+def get_schema() -> CompiledSchema:
+    return registry.get().default
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import threading
+from typing import List
+
+class SpawnedProcess:
+    """
+    A child started with `posix_spawn`, with the parts of
+    asyncio.subprocess.Process the executor uses: `pid`, `stdout` and
+    `stderr` stream readers, `returncode` and `wait()`.
+
+    Its exit is noticed through a pidfd registered with the event loop, or
+    on kernels without pidfd_open by a thread blocked in waitpid.
+    """
+
+    def __init__(self, pid: int, stdout_fd: int, stderr_fd: int):
+        self.pid = pid
+        self.returncode = None
+        self.stdout = asyncio.StreamReader()
+        self.stderr = asyncio.StreamReader()
+        self._loop = asyncio.get_running_loop()
+        self._stdout_fd = stdout_fd
+        self._stderr_fd = stderr_fd
+        self._exited = self._loop.create_future()
+        self._pidfd = None
+
+    async def _connect(self):
+        for reader, fd in ((self.stdout, self._stdout_fd), (self.stderr, self._stderr_fd)):
+            await self._loop.connect_read_pipe(
+                lambda reader=reader: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, "rb", 0)
+            )
+        try:
+            self._pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            threading.Thread(target=self._wait_in_thread, daemon=True).start()
+        else:
+            self._loop.add_reader(self._pidfd, self._on_exit)
+
+    def _reap(self) -> int:
+        try:
+            _, status = os.waitpid(self.pid, 0)
+        except ChildProcessError:
+            # Reaped by someone else, e.g. a child watcher that waits for any pid.
+            return 255
+        return os.waitstatus_to_exitcode(status)
+
+    def _on_exit(self):
+        self._loop.remove_reader(self._pidfd)
+        os.close(self._pidfd)
+        self._set_returncode(self._reap())
+
+    def _wait_in_thread(self):
+        returncode = self._reap()
+        try:
+            self._loop.call_soon_threadsafe(self._set_returncode, returncode)
+        except RuntimeError:
+            # The loop has been closed.
+            pass
+
+    def _set_returncode(self, returncode: int):
+        self.returncode = returncode
+        if not self._exited.done():
+            self._exited.set_result(returncode)
+
+    async def wait(self) -> int:
+        return await asyncio.shield(self._exited)
+
+async def posix_spawn_exec(command: List[str]) -> SpawnedProcess:
+    """
+    Start `command` in a new session with its stdout and stderr piped, like
+    create_subprocess_exec(..., start_new_session=True), but with
+    posix_spawn. glibc implements that with a vfork-style clone, so its cost
+    doesn't grow with the size of the server process the way fork's does.
+
+    Only inheritable descriptors are passed on, and Python creates them
+    non-inheritable by default.
+    """
+    stdout_r, stdout_w = os.pipe()
+    stderr_r, stderr_w = os.pipe()
+    try:
+        pid = os.posix_spawnp(
+            command[0], command, os.environ,
+            file_actions=[(os.POSIX_SPAWN_DUP2, stdout_w, 1), (os.POSIX_SPAWN_DUP2, stderr_w, 2)],
+            setsid=True,
+        )
+    except BaseException:
+        os.close(stdout_r)
+        os.close(stderr_r)
+        raise
+    finally:
+        os.close(stdout_w)
+        os.close(stderr_w)
+    process = SpawnedProcess(pid, stdout_r, stderr_r)
+    await process._connect()
+    return process
@@ -0,0 +1,216 @@
+import asyncio
+import pytest
+from gull_api.admission import AdmissionController, AdmissionRejected, BATCH, INTERACTIVE
+
+
+@pytest.mark.asyncio
+async def test_admits_up_to_max_concurrency_immediately():
+    admission = AdmissionController(max_concurrency=2, max_queue=0)
+    first = await admission.acquire()
+    second = await admission.acquire()
+
+    assert admission.stats()["active"] == 2
+    with pytest.raises(AdmissionRejected) as exc_info:
+        await admission.acquire()
+    assert exc_info.value.retry_after >= 1
+    assert admission.rejected == 1
+
+    first.release()
+    second.release()
+    assert admission.active == 0
+
+
+@pytest.mark.asyncio
+async def test_waiters_are_served_in_arrival_order():
+    admission = AdmissionController(max_concurrency=1, max_queue=2)
+    slot = await admission.acquire()
+    order = []
+
+    async def waiter(name):
+        async with await admission.acquire():
+            order.append(name)
+
+    tasks = [asyncio.create_task(waiter(name)) for name in ("a", "b")]
+    await asyncio.sleep(0)
+    assert admission.waiting == 2
+
+    slot.release()
+    await asyncio.gather(*tasks)
+
+    assert order == ["a", "b"]
+    assert admission.active == 0
+    assert admission.admitted == 3
+
+
+@pytest.mark.asyncio
+async def test_release_is_idempotent():
+    admission = AdmissionController(max_concurrency=1, max_queue=0)
+    slot = await admission.acquire()
+    slot.release()
+    slot.release()
+
+    assert admission.active == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_timeout_rejects_waiter():
+    admission = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=0.05)
+    slot = await admission.acquire()
+
+    with pytest.raises(AdmissionRejected):
+        await admission.acquire()
+
+    assert admission.timed_out == 1
+    assert admission.waiting == 0
+    slot.release()
+    assert admission.active == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_leak_slot():
+    admission = AdmissionController(max_concurrency=1, max_queue=1)
+    slot = await admission.acquire()
+    task = asyncio.create_task(admission.acquire())
+    await asyncio.sleep(0)
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    slot.release()
+
+    assert admission.waiting == 0
+    assert admission.active == 0
+
+
+async def run_in_order(admission, requests):
+    """Queue `requests` of (client_id, kwargs) behind a held slot and return the order they run in."""
+    slot = await admission.acquire()
+    order = []
+
+    async def waiter(client_id, kwargs):
+        async with await admission.acquire(client_id, **kwargs):
+            order.append(client_id)
+            await asyncio.sleep(0)
+
+    tasks = []
+    for client_id, kwargs in requests:
+        tasks.append(asyncio.create_task(waiter(client_id, kwargs)))
+        await asyncio.sleep(0)
+    slot.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+@pytest.mark.asyncio
+async def test_backlogged_clients_share_slots_by_weight():
+    admission = AdmissionController(max_concurrency=1, max_queue=20)
+    # The heavy client queues everything first, yet the light client isn't starved.
+    requests = [("heavy", {"weight": 2.0})] * 6 + [("light", {"weight": 1.0})] * 3
+    order = await run_in_order(admission, requests)
+
+    assert order[:6].count("heavy") == 4
+    assert order[:6].count("light") == 2
+    assert order.count("heavy") == 6
+
+
+@pytest.mark.asyncio
+async def test_interactive_requests_go_ahead_of_batch():
+    admission = AdmissionController(max_concurrency=1, max_queue=10)
+    requests = [("nightly", {"priority": BATCH})] * 3 + [("webapp", {"priority": INTERACTIVE})]
+    order = await run_in_order(admission, requests)
+
+    assert order[0] == "webapp"
+
+
+@pytest.mark.asyncio
+async def test_client_concurrency_limit_lets_others_through():
+    admission = AdmissionController(max_concurrency=3, max_queue=10)
+    first = await admission.acquire("greedy", max_concurrency=1)
+    blocked = asyncio.create_task(admission.acquire("greedy", max_concurrency=1))
+    await asyncio.sleep(0)
+
+    other = await admission.acquire("polite")
+    assert not blocked.done()
+    assert admission.stats()["clients"]["greedy"]["waiting"] == 1
+
+    first.release()
+    second = await blocked
+    assert second.wait > 0
+    second.release()
+    other.release()
+    assert admission.active == 0
+    assert admission.stats()["clients"]["greedy"]["admitted"] == 2
+
+
+async def run_costs_in_order(admission, costs):
+    """Queue one client's requests with the given costs behind a held slot; return the order they run in."""
+    slot = await admission.acquire()
+    order = []
+
+    async def waiter(name, cost):
+        async with await admission.acquire("webapp", cost=cost):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    tasks = []
+    for name, cost in costs:
+        tasks.append(asyncio.create_task(waiter(name, cost)))
+        await asyncio.sleep(0)
+    slot.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+@pytest.mark.asyncio
+async def test_shortest_first_runs_short_requests_ahead_of_long_ones():
+    admission = AdmissionController(max_concurrency=1, max_queue=10, shortest_first=True, aging=0)
+    admission.avg_service_time = 10.0
+    costs = [("long", 60.0), ("unknown", None), ("short", 0.5), ("medium", 5.0)]
+    order = await run_costs_in_order(admission, costs)
+
+    assert order == ["short", "medium", "unknown", "long"]
+    waits = admission.stats()["waits_by_predicted_runtime"]
+    assert waits["under_1s"]["admitted"] == 1
+    assert waits["longer"]["admitted"] == 1
+    assert waits["unpredicted"]["admitted"] == 2
+
+
+@pytest.mark.asyncio
+async def test_fifo_ignores_cost():
+    admission = AdmissionController(max_concurrency=1, max_queue=10)
+    order = await run_costs_in_order(admission, [("long", 60.0), ("short", 0.5)])
+
+    assert order == ["long", "short"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("waited, expected", [(0, ["short", "long"]), (3, ["long", "short"])])
+async def test_aging_lets_a_long_request_overtake_new_short_ones(waited, expected):
+    admission = AdmissionController(max_concurrency=1, max_queue=10, shortest_first=True, aging=1.0)
+    slot = await admission.acquire()
+    order = []
+
+    async def waiter(name, cost):
+        async with await admission.acquire("webapp", cost=cost):
+            order.append(name)
+
+    tasks = [asyncio.create_task(waiter("long", 2.0))]
+    await asyncio.sleep(0)
+    # Once it has waited longer than its predicted runtime, it beats any new arrival.
+    admission._queues["webapp"].waiters[0][0].enqueued -= waited
+    tasks.append(asyncio.create_task(waiter("short", 0.1)))
+    await asyncio.sleep(0)
+    slot.release()
+    await asyncio.gather(*tasks)
+
+    assert order == expected
+
+
+@pytest.mark.asyncio
+async def test_shortest_first_keeps_clients_fair_shares():
+    admission = AdmissionController(max_concurrency=1, max_queue=20, shortest_first=True, aging=0)
+    requests = [("heavy", {"cost": float(10 - i)}) for i in range(6)] + [("light", {"cost": 100.0})] * 3
+    order = await run_in_order(admission, requests)
+
+    assert order[:6].count("heavy") == 3
+    assert order[:6].count("light") == 3
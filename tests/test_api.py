@@ -1,6 +1,7 @@
 from fastapi import HTTPException
 from gull_api.main import get_api, create_llm_request_model, convert_request_to_cli_command, load_cli_json
 from gull_api.db import SessionManager, APIRequestLog
+from gull_api.schema import CompiledSchema, ModelCatalog
 from pydantic import BaseModel
 from typing import Dict, Any
 from unittest import mock
@@ -9,6 +10,7 @@ import gull_api.config as config
 import json
 import pytest
 import subprocess
+import asyncio
 from asyncio import TimeoutError
 
 @pytest.fixture
@@ -19,6 +21,7 @@ def mock_db(monkeypatch):
 
     monkeypatch.setattr('gull_api.db.get_engine', lambda: mock_engine)
     monkeypatch.setattr('gull_api.db.get_session_maker', lambda engine=None: mock_session_maker)
+    monkeypatch.setattr('gull_api.db._session_maker', None)
     monkeypatch.setattr(mock_session_maker, 'return_value', mock_session)
 
     return mock_session
@@ -134,7 +137,7 @@ def test_get_api():
         ]
     }
 
-    api_json = get_api(cli_json)
+    api_json = json.loads(get_api(ModelCatalog(cli_json)).body)
     assert api_json == expected_api_json
 
 @pytest.fixture
@@ -286,41 +289,49 @@ sample_llm_request = {
     "Top P": 0.95
 }
 
+class MockPipe:
+    """Minimal stand-in for a subprocess's stdout/stderr StreamReader."""
+
+    def __init__(self, data=b'', error=None, delay=0):
+        self.data = data
+        self.error = error
+        self.delay = delay
+
+    async def read(self, n=-1):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+            self.delay = 0
+        if self.error is not None:
+            raise self.error
+        n = len(self.data) if n < 0 else n
+        data, self.data = self.data[:n], self.data[n:]
+        return data
+
+def mock_process(stdout=b'', stderr=b'', returncode=0, error=None, delay=0):
+    process = mock.MagicMock()
+    process.stdout = MockPipe(stdout, error, delay)
+    process.stderr = MockPipe(stderr)
+    process.returncode = returncode
+    process.wait = mock.AsyncMock(return_value=returncode)
+    return process
+
 @pytest.mark.asyncio
 @mock.patch('asyncio.create_subprocess_exec')
 async def test_post_llm_valid_run(mock_create_subprocess_exec, mock_db):
-    class MockProcess:
-        def __init__(self, stdout='', stderr='', returncode=0):
-            self.stdout = stdout.encode('utf-8')
-            self.stderr = stderr.encode('utf-8')
-            self.returncode = returncode
-
-        async def communicate(self):
-            return self.stdout, self.stderr
-
     expected = "Hello! How can I assist you today?"
-    mock_create_subprocess_exec.return_value = MockProcess(stdout=expected)
+    mock_create_subprocess_exec.return_value = mock_process(stdout=expected.encode('utf-8'))
 
-    result = await main.post_llm(sample_llm_request, cli_json)
+    result = await main.post_llm(sample_llm_request, CompiledSchema(cli_json))
     assert result == {"response": expected}
 
 
 @pytest.mark.asyncio
 @mock.patch('asyncio.create_subprocess_exec')
 async def test_post_llm_run_with_errors(mock_create_subprocess_exec, mock_db):
-    class MockProcess:
-        def __init__(self, stdout='', stderr='', returncode=0):
-            self.stdout = stdout.encode('utf-8')
-            self.stderr = stderr.encode('utf-8')
-            self.returncode = returncode
-
-        async def communicate(self):
-            return self.stdout, self.stderr
-
-    mock_create_subprocess_exec.return_value = MockProcess(stderr='Error occurred', returncode=1)
+    mock_create_subprocess_exec.return_value = mock_process(stderr=b'Error occurred', returncode=1)
 
     with pytest.raises(HTTPException) as exc_info:
-        await main.post_llm(sample_llm_request, cli_json)
+        await main.post_llm(sample_llm_request, CompiledSchema(cli_json))
 
     assert exc_info.value.status_code == 422 
     assert exc_info.value.detail == 'Error occurred'
@@ -328,17 +339,11 @@ async def test_post_llm_run_with_errors(mock_create_subprocess_exec, mock_db):
 @pytest.mark.asyncio
 @mock.patch('asyncio.create_subprocess_exec')
 async def test_post_llm_timeout(mock_create_subprocess_exec, mock_db):
-    # Set up the mock process to raise an exception when communicate is called
-    class TimeoutMockProcess:
-        returncode = 1
-
-        async def communicate(self):
-            raise TimeoutError
-
-    mock_create_subprocess_exec.return_value = TimeoutMockProcess()
+    # Set up the mock process to raise an exception when its output is read
+    mock_create_subprocess_exec.return_value = mock_process(returncode=1, error=TimeoutError())
 
     with pytest.raises(HTTPException) as exc_info:
-        await main.post_llm(sample_llm_request, cli_json)
+        await main.post_llm(sample_llm_request, CompiledSchema(cli_json))
 
     assert exc_info.value.status_code == 504
     assert exc_info.value.detail == 'Server processing timed out.'
@@ -346,17 +351,11 @@ async def test_post_llm_timeout(mock_create_subprocess_exec, mock_db):
 @pytest.mark.asyncio
 @mock.patch('asyncio.create_subprocess_exec')
 async def test_post_llm_generic_exception(mock_create_subprocess_exec, mock_db):
-    # Setup the mock process to raise an exception when communicate is called
-    class GenericExceptionMockProcess:
-        returncode = 1
-
-        async def communicate(self):
-            raise Exception("Generic exception occurred")
-
-    mock_create_subprocess_exec.return_value = GenericExceptionMockProcess()
+    # Setup the mock process to raise an exception when its output is read
+    mock_create_subprocess_exec.return_value = mock_process(returncode=1, error=Exception("Generic exception occurred"))
 
     with pytest.raises(HTTPException) as exc_info:
-        await main.post_llm(sample_llm_request, cli_json)
+        await main.post_llm(sample_llm_request, CompiledSchema(cli_json))
 
     assert exc_info.value.status_code == 500
     assert exc_info.value.detail == "Internal Server Error"
@@ -365,30 +364,750 @@ async def test_post_llm_generic_exception(mock_create_subprocess_exec, mock_db):
 mock_request = {"test_param": "test_value"}
 
 @pytest.mark.asyncio
-@mock.patch('gull_api.main.create_llm_request_model')
-@mock.patch('gull_api.main.convert_request_to_cli_command')
 @mock.patch('asyncio.create_subprocess_exec', new_callable=mock.AsyncMock)
-async def test_post_llm(mock_create_subprocess_exec, mock_convert_request_to_cli_command, mock_create_llm_request_model, mock_db):
-    # Mock the process communicate function
-    process_mock = mock.AsyncMock()
-    process_mock.communicate = mock.AsyncMock(return_value=(b'OK', b''))
-    process_mock.returncode = 0
-    mock_create_subprocess_exec.return_value = process_mock
+async def test_post_llm(mock_create_subprocess_exec, mock_db, monkeypatch):
+    mock_create_subprocess_exec.return_value = mock_process(stdout=b'OK')
+
+    mock_schema = mock.MagicMock(max_concurrency=None, timeout=None)
+    monkeypatch.setattr(main, 'admissions', {})
+    monkeypatch.setattr(main, 'predictors', {})
 
     # Call the function with the mocked request data
-    result = await main.post_llm(request=mock_request, cli_json=mock_cli_json)
+    result = await main.post_llm(request=mock_request, schema=mock_schema)
 
-    # Assert create_llm_request_model was called with the correct arguments
-    mock_create_llm_request_model.assert_called_once_with(mock_cli_json)
-    validated_request = mock_create_llm_request_model.return_value(**mock_request)
-    
-    # Assert convert_request_to_cli_command was called with the correct arguments
-    mock_convert_request_to_cli_command.assert_called_once_with(validated_request, mock_cli_json)
+    # Assert the precompiled schema was used for validation and argv building
+    mock_schema.validate.assert_called_once_with(mock_request)
+    mock_schema.build_command.assert_called_once_with(mock_schema.validate.return_value)
 
     # Assert subprocess command was called correctly
     mock_create_subprocess_exec.assert_called_once_with(
-        *mock_convert_request_to_cli_command.return_value, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        *mock_schema.build_command.return_value, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        start_new_session=True,
     )
 
     # Assert the result is correct
-    assert result == {"response": 'OK'}
\ No newline at end of file
+    assert result == {"response": 'OK'}
+
+@pytest.mark.asyncio
+@mock.patch('asyncio.create_subprocess_exec')
+async def test_post_llm_uses_worker_pool(mock_create_subprocess_exec, mock_db, monkeypatch):
+    mock_pool = mock.MagicMock()
+    mock_pool.run = mock.AsyncMock(return_value=("pooled", "", 0))
+    monkeypatch.setattr(main, 'pools', {'LLaMA-7B': mock_pool})
+
+    schema = CompiledSchema(cli_json)
+    result = await main.post_llm(sample_llm_request, schema)
+
+    command = schema.build_command(schema.validate(sample_llm_request))
+    mock_pool.run.assert_called_once_with(command[1:], timeout=60)
+    mock_create_subprocess_exec.assert_not_called()
+    assert result == {"response": "pooled"}
+
+@mock.patch('asyncio.create_subprocess_exec')
+def test_post_llm_stream(mock_create_subprocess_exec, mock_db):
+    from fastapi.testclient import TestClient
+
+    class MockStream:
+        def __init__(self, parts):
+            self.parts = list(parts)
+
+        async def read(self, n=-1):
+            return self.parts.pop(0) if self.parts else b''
+
+    class MockProcess:
+        returncode = None
+
+        def __init__(self):
+            # "é" split across two reads
+            self.stdout = MockStream([b'caf\xc3', b'\xa9 ok'])
+            self.stderr = MockStream([])
+
+        async def wait(self):
+            self.returncode = 0
+            return 0
+
+    mock_create_subprocess_exec.return_value = MockProcess()
+    main.app.dependency_overrides[main.get_schema] = lambda: CompiledSchema(cli_json)
+    try:
+        response = TestClient(main.app).post("/llm/stream", json=sample_llm_request)
+    finally:
+        main.app.dependency_overrides.clear()
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert "".join(line.get("text", "") for line in lines) == "café ok"
+    assert lines[-1] == {"done": True}
+    mock_db.add.assert_called_once()
+    assert mock_db.add.call_args[0][0].response == "café ok"
+
+@pytest.mark.asyncio
+async def test_post_llm_rejects_when_queue_full(mock_db, monkeypatch):
+    from gull_api.admission import AdmissionController
+    admission = AdmissionController(max_concurrency=1, max_queue=0)
+    monkeypatch.setattr(main, 'admissions', {'LLaMA-7B': admission})
+    slot = await admission.acquire()
+
+    with pytest.raises(HTTPException) as exc_info:
+        await main.post_llm(sample_llm_request, CompiledSchema(cli_json))
+
+    slot.release()
+    assert exc_info.value.status_code == 503
+    assert int(exc_info.value.headers["Retry-After"]) >= 1
+    mock_db.add.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_create_and_log_submits_to_log_writer(mock_db, monkeypatch):
+    writer = mock.MagicMock()
+    writer.submit = mock.AsyncMock()
+    monkeypatch.setattr(main, 'log_writer', writer)
+
+    log = await main.create_and_log(mock_request, stdout="OK")
+
+    writer.submit.assert_called_once_with(log)
+    mock_db.add.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_create_and_log_disabled(mock_db, monkeypatch):
+    monkeypatch.setattr(config, 'LOG_MODE', 'off')
+
+    await main.create_and_log(mock_request, stdout="OK")
+
+    mock_db.add.assert_not_called()
+
+@pytest.mark.asyncio
+@mock.patch('asyncio.create_subprocess_exec', new_callable=mock.AsyncMock)
+async def test_post_llm_response_cache(mock_create_subprocess_exec, mock_db, monkeypatch):
+    from gull_api.cache import ResponseCache
+    monkeypatch.setattr(main, 'response_cache', ResponseCache())
+    mock_create_subprocess_exec.side_effect = lambda *args, **kwargs: mock_process(stdout=b'cached')
+    seed = {"name": "Seed", "type": "int", "flag": "--seed", "default": -1, "description": "RNG seed"}
+    schema = CompiledSchema({"LLaMA-7B": cli_json["LLaMA-7B"] + [seed]})
+    greedy = {**sample_llm_request, "Seed": 42}
+
+    first = await main.post_llm(greedy, schema)
+    second = await main.post_llm(greedy, schema)
+    bypassed = await main.post_llm(greedy, schema, no_cache=True)
+    assert first == second == bypassed == {"response": "cached"}
+    assert mock_create_subprocess_exec.call_count == 2
+    assert main.response_cache.stats()["hits"] == 1
+
+    # Sampled generations (random seed) are never served again.
+    for _ in range(2):
+        await main.post_llm(sample_llm_request, schema)
+    assert mock_create_subprocess_exec.call_count == 4
+    assert main.response_cache.stats()["entries"] == 1
+
+@pytest.mark.asyncio
+@mock.patch('asyncio.create_subprocess_exec', new_callable=mock.AsyncMock)
+async def test_post_llm_coalesces_identical_requests(mock_create_subprocess_exec, mock_db, monkeypatch):
+    import asyncio
+    from gull_api.admission import AdmissionController
+    from gull_api.cache import SingleFlight
+    monkeypatch.setattr(main, 'coalescer', SingleFlight())
+    monkeypatch.setattr(main, 'admissions', {'LLaMA-7B': AdmissionController(max_concurrency=4, max_queue=4)})
+
+    mock_create_subprocess_exec.return_value = mock_process(stdout=b'shared', delay=0.05)
+    schema = CompiledSchema(cli_json)
+
+    results = await asyncio.gather(*(main.post_llm(sample_llm_request, schema) for _ in range(3)))
+
+    assert results == [{"response": "shared"}] * 3
+    mock_create_subprocess_exec.assert_called_once()
+    # Every caller is still logged.
+    assert mock_db.add.call_count == 3
+
+@pytest.mark.asyncio
+@mock.patch('asyncio.create_subprocess_exec', new_callable=mock.AsyncMock)
+async def test_coalesced_requests_keep_own_deadline_rate_limit_and_timing(mock_create_subprocess_exec, mock_db,
+                                                                            monkeypatch):
+    import asyncio
+    from gull_api.admission import AdmissionController
+    from gull_api.cache import SingleFlight
+    from gull_api.clients import RateLimited
+    monkeypatch.setattr(main, 'coalescer', SingleFlight())
+    monkeypatch.setattr(main, 'admissions', {'LLaMA-7B': AdmissionController(max_concurrency=4, max_queue=4)})
+    mock_create_subprocess_exec.side_effect = lambda *args, **kwargs: mock_process(stdout=b'shared', delay=0.05)
+    schema = CompiledSchema(cli_json)
+
+    results = await asyncio.gather(
+        main.post_llm(sample_llm_request, schema, timing=True),
+        main.post_llm(sample_llm_request, schema, timing=True),
+        main.post_llm(sample_llm_request, schema, timeout=5, timing=True),
+    )
+
+    # The request with its own deadline ran separately; the joiner got the shared run's timing.
+    assert mock_create_subprocess_exec.call_count == 2
+    assert all(result["timing"] is not None for result in results)
+
+    calls = []
+    def check_rate(client):
+        calls.append(client)
+        if len(calls) > 1:
+            raise RateLimited(client.id, 3)
+    monkeypatch.setattr(main.client_registry, 'check_rate', check_rate)
+    mock_create_subprocess_exec.reset_mock()
+
+    outcomes = await asyncio.gather(*(main.post_llm(sample_llm_request, schema) for _ in range(2)),
+                                    return_exceptions=True)
+
+    assert mock_create_subprocess_exec.call_count == 1
+    assert outcomes.count({"response": "shared"}) == 1
+    assert [outcome.status_code for outcome in outcomes if isinstance(outcome, HTTPException)] == [429]
+
+@mock.patch('gull_api.main.write_logs')
+@mock.patch('asyncio.create_subprocess_exec', new_callable=mock.AsyncMock)
+def test_post_llm_batch(mock_create_subprocess_exec, mock_write_logs, monkeypatch):
+    from fastapi.testclient import TestClient
+    from gull_api.admission import AdmissionController
+    monkeypatch.setattr(main, 'admissions', {'LLaMA-7B': AdmissionController(max_concurrency=2, max_queue=2)})
+
+    def make_process(*command, **kwargs):
+        prompt = command[command.index('--prompt') + 1]
+        if prompt == 'bad':
+            return mock_process(stdout=prompt.encode(), stderr=b'failed', returncode=1)
+        return mock_process(stdout=prompt.encode())
+
+    mock_create_subprocess_exec.side_effect = make_process
+    prompts = ["one", "bad", "three"]
+    main.app.dependency_overrides[main.get_schema] = lambda: CompiledSchema(cli_json)
+    try:
+        response = TestClient(main.app).post("/llm/batch", json=[{"Prompt": prompt} for prompt in prompts])
+    finally:
+        main.app.dependency_overrides.clear()
+
+    results = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda r: r["index"])
+    assert results == [
+        {"index": 0, "response": "one"},
+        {"index": 1, "error": "failed", "status_code": 422},
+        {"index": 2, "response": "three"},
+    ]
+    # All three rows go to the database in one call.
+    mock_write_logs.assert_called_once()
+    assert len(mock_write_logs.call_args[0][0]) == 3
+
+
+@mock.patch('asyncio.create_subprocess_exec', new_callable=mock.AsyncMock)
+def test_post_llm_batch_validates_everything_first(mock_create_subprocess_exec):
+    from fastapi.testclient import TestClient
+    main.app.dependency_overrides[main.get_schema] = lambda: CompiledSchema(cli_json)
+    try:
+        response = TestClient(main.app).post("/llm/batch", json=[{"Prompt": "ok"}, {"Maximum length": 0}])
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert response.status_code == 422
+    assert [error["index"] for error in response.json()["detail"]] == [1]
+    mock_create_subprocess_exec.assert_not_called()
+
+
+multi_model_cli_json = {
+    "LLaMA-7B": cli_json["LLaMA-7B"],
+    "LLaMA-13B": {"executable": "./main-13b", "max_concurrency": 3, "params": cli_json["LLaMA-7B"]},
+}
+
+@mock.patch('asyncio.create_subprocess_exec', new_callable=mock.AsyncMock)
+def test_post_llm_routes_by_model(mock_create_subprocess_exec, monkeypatch, mock_db):
+    from fastapi.testclient import TestClient
+    monkeypatch.setattr(main, 'admissions', {})
+    mock_create_subprocess_exec.side_effect = lambda *args, **kwargs: mock_process(stdout=b'OK')
+    main.app.dependency_overrides[main.get_catalog] = lambda: ModelCatalog(multi_model_cli_json)
+    try:
+        client = TestClient(main.app)
+        api = client.get("/api").json()
+        response = client.post("/llm/LLaMA-13B", json=sample_llm_request)
+        missing = client.post("/llm/LLaMA-65B", json=sample_llm_request)
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert list(api) == ["LLaMA-7B", "LLaMA-13B"]
+    assert response.json() == {"response": "OK"}
+    assert mock_create_subprocess_exec.call_args[0][0] == "./main-13b"
+    assert missing.status_code == 404
+    # The 13B model got its own admission controller with its own limit.
+    assert list(main.admissions) == ["LLaMA-13B"]
+    assert main.admissions["LLaMA-13B"].max_concurrency == 3
+
+@pytest.mark.asyncio
+async def test_worker_pools_start_per_model(monkeypatch):
+    import os
+    import sys
+    worker = f"{sys.executable} {os.path.join(os.path.dirname(__file__), '..', 'echo_worker.py')}"
+    catalog = ModelCatalog({
+        "LLaMA-7B": cli_json["LLaMA-7B"],
+        "LLaMA-13B": {"worker_pool_size": 1, "worker_command": worker, "params": cli_json["LLaMA-7B"]},
+    })
+    monkeypatch.setattr(main, 'get_catalog', lambda: catalog)
+    monkeypatch.setattr(config, 'WORKER_POOL_SIZE', 0)
+    monkeypatch.setattr(main, 'pools', {})
+
+    await main.start_worker_pools()
+    try:
+        assert list(main.pools) == ["LLaMA-13B"]
+        assert main.pools["LLaMA-13B"].stats()["alive"] == 1
+    finally:
+        await main.stop_worker_pools()
+
+    assert main.pools == {}
+
+@pytest.mark.asyncio
+@mock.patch('asyncio.create_subprocess_exec', new_callable=mock.AsyncMock)
+async def test_ready_only_once_prewarmed(mock_create_subprocess_exec, monkeypatch, tmp_path):
+    model_file = tmp_path / "ggml-model.bin"
+    model_file.write_bytes(b"weights")
+    params = [dict(param, default=str(model_file)) if param["name"] == "Model" else param for param in cli_json["LLaMA-7B"]]
+    monkeypatch.setattr(main, 'get_catalog', lambda: ModelCatalog({"LLaMA-7B": params}))
+    monkeypatch.setattr(main, 'admissions', {})
+    monkeypatch.setattr(config, 'PREWARM', True)
+    monkeypatch.setattr(config, 'WARMUP_REQUEST', '{"Prompt": "Hi", "Maximum length": 2}')
+    mock_create_subprocess_exec.return_value = mock_process(stdout=b'OK')
+    assert main.get_ready() == {"ready": True}
+
+    await main.start_prewarm()
+    try:
+        cold = main.get_ready()
+        await main.prewarm_task
+        warm = main.get_ready()
+        status = main.get_status()["prewarm"]
+    finally:
+        await main.stop_prewarm()
+
+    assert cold.status_code == 503
+    assert warm == {"ready": True, "state": "warm", "error": None}
+    assert list(status["files"]) == [str(model_file.resolve())]
+    command = mock_create_subprocess_exec.call_args[0]
+    assert command[command.index("-n") + 1] == "2"
+    assert main.prewarmer is None
+
+@mock.patch('asyncio.create_subprocess_exec', new_callable=mock.AsyncMock)
+def test_metrics_endpoint_reports_llm_stages(mock_create_subprocess_exec, mock_db):
+    from fastapi.testclient import TestClient
+    mock_create_subprocess_exec.return_value = mock_process(stderr=b'bad flag', returncode=2)
+    main.app.dependency_overrides[main.get_schema] = lambda: CompiledSchema(cli_json)
+    try:
+        client = TestClient(main.app)
+        client.post("/llm", json=sample_llm_request, params={"no_cache": True})
+        response = client.get("/metrics")
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert response.headers["content-type"].startswith("text/plain")
+    for stage in ("parse", "validate", "build_command", "spawn", "generate", "decode", "log_commit"):
+        assert f'gull_stage_duration_seconds_count{{stage="{stage}"}}' in response.text
+    assert 'gull_generations_total{model="LLaMA-7B",outcome="nonzero_exit"}' in response.text
+    assert 'gull_http_requests_total{handler="post_llm",status="422"}' in response.text
+
+
+def test_resolve_timeout(monkeypatch):
+    monkeypatch.setattr(config, 'LLM_TIMEOUT', 60)
+    schema = CompiledSchema(cli_json)
+    slow = ModelCatalog({"LLaMA-65B": {"timeout": 300, "params": cli_json["LLaMA-7B"]}}).default
+
+    assert main.resolve_timeout(schema) == 60
+    assert main.resolve_timeout(schema, 5) == 5
+    assert main.resolve_timeout(schema, 600) == 60
+    assert main.resolve_timeout(slow) == 300
+    assert main.resolve_timeout(slow, 0) == 300
+
+@pytest.mark.asyncio
+async def test_run_command_kills_process_on_timeout(monkeypatch):
+    import sys
+    monkeypatch.setattr(main, 'pools', {})
+    spawned = []
+    real_exec = asyncio.create_subprocess_exec
+
+    async def spy(*args, **kwargs):
+        spawned.append(await real_exec(*args, **kwargs))
+        return spawned[-1]
+
+    monkeypatch.setattr(asyncio, 'create_subprocess_exec', spy)
+    with pytest.raises(asyncio.TimeoutError):
+        await main.run_command(CompiledSchema(cli_json), [sys.executable, "-c", "import time; time.sleep(30)"], 0.2)
+
+    assert spawned[0].returncode is not None
+
+class DisconnectingRequest:
+    """Stands in for a Starlette Request whose client goes away after `delay` seconds."""
+
+    headers = {}
+    client = None
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def receive(self):
+        await asyncio.sleep(self.delay)
+        return {"type": "http.disconnect"}
+
+@pytest.mark.asyncio
+async def test_post_llm_cancels_generation_on_disconnect(mock_db, monkeypatch):
+    monkeypatch.setattr(main, 'admissions', {})
+    monkeypatch.setattr(main, 'coalescer', None)
+    cancelled = asyncio.Event()
+
+    async def slow_generate(*args, **kwargs):
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    monkeypatch.setattr(main, 'generate', slow_generate)
+    with mock.patch.object(main, 'create_and_log', new_callable=mock.AsyncMock) as log:
+        with pytest.raises(HTTPException) as exc_info:
+            await main.post_llm(sample_llm_request, CompiledSchema(cli_json), http_request=DisconnectingRequest(0.05))
+
+    assert exc_info.value.status_code == 499
+    assert cancelled.is_set()
+    log.assert_awaited_once()
+    assert log.await_args.kwargs["stderr"] == main.CANCELLED_DETAIL
+
+# Ignores SIGTERM and keeps generating, so only SIGKILL stops it.
+STUBBORN_EXECUTABLE = """#!{python}
+import os, signal, time
+signal.signal(signal.SIGTERM, signal.SIG_IGN)
+print(os.getpid(), flush=True)
+while True:
+    print("token", flush=True)
+    time.sleep(0.05)
+"""
+
+@pytest.mark.asyncio
+async def test_post_llm_stream_disconnect_reaps_process_before_freeing_slot(monkeypatch, tmp_path):
+    import os, sys, httpx, uvicorn
+    executable = tmp_path / "stubborn"
+    executable.write_text(STUBBORN_EXECUTABLE.format(python=sys.executable))
+    executable.chmod(0o755)
+    monkeypatch.setattr(config, 'EXECUTABLE', str(executable))
+    monkeypatch.setattr(config, 'KILL_GRACE_PERIOD', 0.3)
+    monkeypatch.setattr(main, 'admissions', {})
+    monkeypatch.setattr(main, 'pools', {})
+    logged = asyncio.Event()
+    seen = {}
+
+    async def create_and_log(request, stdout="", stderr="", returncode=0):
+        await asyncio.sleep(0)
+        try:
+            os.kill(seen["pid"], 0)
+            seen["reaped"] = False
+        except ProcessLookupError:
+            seen["reaped"] = True
+        seen["active"] = next(iter(main.admissions.values())).active
+        seen["stderr"] = stderr
+        logged.set()
+
+    monkeypatch.setattr(main, 'create_and_log', create_and_log)
+    main.app.dependency_overrides[main.get_schema] = lambda: CompiledSchema(cli_json)
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=0, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve())
+    try:
+        while not server.started:
+            await asyncio.sleep(0.01)
+        port = server.servers[0].sockets[0].getsockname()[1]
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+            async with client.stream("POST", "/llm/stream", json=sample_llm_request) as response:
+                lines = response.aiter_lines()
+                seen["pid"] = int(json.loads(await lines.__anext__())["text"])
+            # Leaving the block unread closes the connection, as a client going away does.
+        await asyncio.wait_for(logged.wait(), timeout=5)
+        slots = next(iter(main.admissions.values()))
+        for _ in range(100):
+            if not slots.active:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        main.app.dependency_overrides.clear()
+        server.should_exit = True
+        await task
+
+    assert seen["reaped"] is True
+    assert seen["stderr"] == main.CANCELLED_DETAIL
+    # The slot is held until the process is gone, then given back.
+    assert seen["active"] == 1
+    assert slots.active == 0
+
+@pytest.mark.asyncio
+async def test_unless_disconnected_returns_result_while_connected():
+    async def work():
+        return "done"
+
+    assert await main.unless_disconnected(DisconnectingRequest(30), work()) == "done"
+
+@pytest.mark.asyncio
+@mock.patch('asyncio.create_subprocess_exec', new_callable=mock.AsyncMock)
+async def test_post_llm_flags_truncated_output(mock_create_subprocess_exec, mock_db, monkeypatch):
+    monkeypatch.setattr(config, 'STDOUT_MAX_BYTES', 4)
+    monkeypatch.setattr(main, 'admissions', {})
+    mock_create_subprocess_exec.return_value = mock_process(stdout=b'too long')
+
+    result = await main.post_llm(sample_llm_request, CompiledSchema(cli_json), no_cache=True)
+
+    assert result == {"response": "too ", "truncated": True}
+    log = await main.create_log_object(sample_llm_request, result["response"], "", 0)
+    assert log.response == "too "
+    assert log.error_occurred is False
+    assert log.error_details == "Output truncated at 4 bytes."
+
+@pytest.mark.asyncio
+async def test_create_log_object_caps_stored_text(monkeypatch):
+    monkeypatch.setattr(config, 'STDOUT_MAX_BYTES', 3)
+    monkeypatch.setattr(config, 'STDERR_MAX_BYTES', 5)
+
+    ok = await main.create_log_object({}, "abcdef", "", 0)
+    failed = await main.create_log_object({}, "", "stderr text", 1)
+
+    assert ok.response == "abc"
+    assert failed.error_details == "stder"
+
+@mock.patch('asyncio.create_subprocess_exec', new_callable=mock.AsyncMock)
+def test_post_llm_identifies_client_and_enforces_rate(mock_create_subprocess_exec, mock_db, monkeypatch):
+    from fastapi.testclient import TestClient
+    from gull_api.clients import Client, ClientRegistry
+    registry = ClientRegistry(path="")
+    registry.keys = {"secret": Client("webapp", rate=0.01, burst=1)}
+    monkeypatch.setattr(main, 'client_registry', registry)
+    monkeypatch.setattr(main, 'admissions', {})
+    monkeypatch.setattr(main, 'coalescer', None)
+    mock_create_subprocess_exec.side_effect = lambda *args, **kwargs: mock_process(stdout=b'OK')
+    main.app.dependency_overrides[main.get_schema] = lambda: CompiledSchema(cli_json)
+    try:
+        client = TestClient(main.app)
+        ok = client.post("/llm", json=sample_llm_request, headers={"X-API-Key": "secret"})
+        limited = client.post("/llm", json=sample_llm_request, headers={"X-API-Key": "secret"})
+        unknown = client.post("/llm", json=sample_llm_request, headers={"X-API-Key": "made-up"})
+        status = client.get("/status").json()
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert ok.status_code == 200
+    assert limited.status_code == 429
+    assert unknown.status_code == 401
+    assert int(limited.headers["Retry-After"]) >= 1
+    assert status["clients"]["webapp"]["rate_limited"] == 1
+    assert status["admission"]["LLaMA-7B"]["clients"]["webapp"]["admitted"] == 1
+
+@mock.patch('asyncio.create_subprocess_exec', new_callable=mock.AsyncMock)
+def test_runtime_predictor_is_seeded_from_logs_and_scored(mock_create_subprocess_exec, monkeypatch, tmp_path):
+    from fastapi.testclient import TestClient
+    import gull_api.db as db
+    session_maker = db.get_session_maker(db.create_engine(f"sqlite:///{tmp_path / 'logs.db'}"))
+    monkeypatch.setattr(db, '_session_maker', session_maker)
+    db.write_logs([
+        db.APIRequestLog(request=json.dumps(dict(sample_llm_request, **{"Maximum length": n})), model="LLaMA-7B",
+                         error_occurred=False, generation_time=n / 100, timestamp=float(n))
+        for n in (16, 64, 128, 256, 512, 1024)
+    ], session_maker)
+    schema = CompiledSchema(cli_json)
+    monkeypatch.setattr(main, 'predictors', {})
+    monkeypatch.setattr(main, 'admissions', {})
+    monkeypatch.setattr(main, 'coalescer', None)
+    monkeypatch.setattr(config, 'LOG_MODE', 'sync')
+    main.seed_runtime_predictors(mock.MagicMock(models={"LLaMA-7B": schema}))
+    mock_create_subprocess_exec.return_value = mock_process(stdout=b'OK')
+    main.app.dependency_overrides[main.get_schema] = lambda: schema
+    try:
+        client = TestClient(main.app)
+        response = client.post("/llm", json=sample_llm_request)
+        status = client.get("/status").json()
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    prediction = status["runtime_prediction"]["LLaMA-7B"]
+    assert (prediction["samples"], prediction["predictions"]) == (7, 1)
+    assert prediction["seconds_per_1k_tokens"] == pytest.approx(10, rel=0.05)
+    assert db.query_logs(session_maker, limit=1)["logs"][0]["predicted_duration"] == pytest.approx(2.56, rel=0.01)
+
+@pytest.mark.asyncio
+async def test_log_records_client_and_queue_wait(monkeypatch):
+    from gull_api.clients import Client, RequestContext, current_request
+    context = RequestContext(Client("webapp"), "batch")
+    context.queue_wait = 0.25
+    current_request.set(context)
+
+    log = await main.create_log_object({}, "OK", "", 0)
+
+    assert (log.client_id, log.priority, log.queue_wait) == ("webapp", "batch", 0.25)
+
+@pytest.mark.asyncio
+@mock.patch('asyncio.create_subprocess_exec', new_callable=mock.AsyncMock)
+async def test_run_command_places_process_on_core_slot(mock_create_subprocess_exec, monkeypatch):
+    from gull_api.placement import Placement
+    placement = Placement(2, cpus=[0, 1, 2, 3], nodes=[])
+    monkeypatch.setattr(main, 'placement', placement)
+    monkeypatch.setattr(main, 'pools', {})
+    mock_create_subprocess_exec.return_value = mock_process(stdout=b'OK')
+    schema = ModelCatalog({"LLaMA-7B": {"threads_flag": "-t", "params": cli_json["LLaMA-7B"]}}).default
+
+    with mock.patch('gull_api.placement.CoreSlot.pin') as pin:
+        result = await main.run_command(schema, ["./main", "-t", "32", "--prompt", "hi"], 10)
+
+    assert result == ("OK", "", 0)
+    assert mock_create_subprocess_exec.call_args[0] == ("./main", "--prompt", "hi", "-t", "2")
+    pin.assert_called_once_with(mock_create_subprocess_exec.return_value.pid)
+    stats = main.get_status()["placement"]
+    assert (stats["slots"], stats["busy"]) == (2, 0)
+
+@mock.patch('asyncio.create_subprocess_exec', new_callable=mock.AsyncMock)
+def test_jobs_submit_run_and_fetch(mock_create_subprocess_exec, monkeypatch, tmp_path):
+    from fastapi.testclient import TestClient
+    import gull_api.db as db
+    from gull_api.jobs import JobQueue
+    queue = JobQueue(db.get_session_maker(db.create_engine(f"sqlite:///{tmp_path / 'jobs.db'}")))
+    monkeypatch.setattr(main, 'job_queue', queue)
+    monkeypatch.setattr(main, 'create_and_log', mock.AsyncMock())
+    monkeypatch.setattr(main, 'admissions', {})
+    monkeypatch.setattr(main, 'coalescer', None)
+    mock_create_subprocess_exec.return_value = mock_process(stdout=b'Done')
+    catalog = ModelCatalog(cli_json)
+    main.app.dependency_overrides[main.get_catalog] = lambda: catalog
+    monkeypatch.setattr(main, 'get_catalog', lambda: catalog)
+    try:
+        client = TestClient(main.app)
+        assert client.post("/jobs", json=sample_llm_request).status_code == 404
+        monkeypatch.setattr(config, 'JOBS', True)
+        submitted = client.post("/jobs", json=sample_llm_request, params={"timeout": 10 ** 6})
+        invalid = client.post("/jobs", json={"Maximum length": 0})
+        pending = client.get(f"/jobs/{submitted.json()['id']}")
+        for job in queue.claim():
+            queue.finish(job["id"], **asyncio.run(main.run_job(job)))
+        finished = client.get(f"/jobs/{submitted.json()['id']}", params={"wait": 1})
+        missing = client.get("/jobs/nope")
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert submitted.status_code == 202
+    assert submitted.json()["status"] == "queued"
+    assert invalid.status_code == 422
+    assert pending.json()["status"] == "queued"
+    assert finished.json()["status"] == "succeeded"
+    assert finished.json()["response"] == "Done"
+    assert sample_llm_request["Prompt"] in mock_create_subprocess_exec.call_args[0]
+    assert missing.status_code == 404
+
+@pytest.mark.asyncio
+async def test_log_records_timing_model_and_request_hash(monkeypatch):
+    from gull_api.clients import Client, RequestContext, current_request
+    context = RequestContext(Client("webapp"))
+    context.started_at -= 2
+    current_request.set(context)
+    schema = CompiledSchema(cli_json)
+    monkeypatch.setattr(main, 'predictors', {})
+    main.get_predictor(schema).observe((256, 12), 4.0)
+    main.track_request(schema, "abc123", schema.validate(sample_llm_request))
+
+    log = await main.create_log_object({}, "", "boom", 3)
+
+    assert (log.model, log.request_hash, log.returncode) == ("LLaMA-7B", "abc123", 3)
+    assert context.size == (256, len("models/7B/ggml-model.bin") + len("Hello, world") + len("Goodbye, world"))
+    assert log.predicted_duration == 4.0
+    assert log.timestamp == context.started_at
+    assert log.duration >= 2
+
+def test_logs_endpoints(monkeypatch, tmp_path):
+    from fastapi.testclient import TestClient
+    import gull_api.db as db
+    session_maker = db.get_session_maker(db.create_engine(f"sqlite:///{tmp_path / 'logs.db'}"))
+    monkeypatch.setattr(db, '_session_maker', session_maker)
+    db.write_logs([
+        db.APIRequestLog(request=str(i), error_occurred=i == 2, timestamp=100.0 + i, duration=float(i), model="LLaMA-7B")
+        for i in range(3)
+    ], session_maker)
+    monkeypatch.setattr(config, 'LOGS_API', True)
+    client = TestClient(main.app)
+
+    page = client.get("/logs", params={"limit": 2}).json()
+    rest = client.get("/logs", params={"limit": 2, "before": page["next"]}).json()
+    errors = client.get("/logs", params={"error": "true"}).json()
+    stats = client.get("/logs/stats", params={"since": 101}).json()
+    monkeypatch.setattr(config, 'LOGS_API_KEY', "s3cret")
+    keyed = client.get("/logs", headers={"X-Admin-Key": "s3cret"})
+
+    assert keyed.status_code == 200
+    assert [log["request"] for log in page["logs"] + rest["logs"]] == ["2", "1", "0"]
+    assert [log["request"] for log in errors["logs"]] == ["2"]
+    assert (stats["count"], stats["errors"], stats["duration"]["max"]) == (2, 1, 2.0)
+
+def test_logs_endpoints_are_off_by_default_and_can_require_a_key(monkeypatch):
+    from fastapi.testclient import TestClient
+    client = TestClient(main.app)
+    assert config.LOGS_API is False
+
+    assert [client.get(path).status_code for path in ("/logs", "/logs/stats")] == [404, 404]
+
+    monkeypatch.setattr(config, 'LOGS_API', True)
+    monkeypatch.setattr(config, 'LOGS_API_KEY', "s3cret")
+    assert [client.get(path).status_code for path in ("/logs", "/logs/stats")] == [403, 403]
+    assert client.get("/logs/stats", headers={"X-Admin-Key": "wrong"}).status_code == 403
+
+def test_get_api_serves_precomputed_bytes_with_etag():
+    from fastapi.testclient import TestClient
+    catalog = ModelCatalog(cli_json)
+    main.app.dependency_overrides[main.get_catalog] = lambda: catalog
+    try:
+        client = TestClient(main.app)
+        plain = client.get("/api", headers={"Accept-Encoding": "identity"})
+        gzipped = client.get("/api", headers={"Accept-Encoding": "gzip"})
+        not_modified = client.get("/api", headers={"If-None-Match": plain.headers["ETag"]})
+        changed = client.get("/api", headers={"If-None-Match": '"stale"', "Accept-Encoding": "gzip;q=0"})
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert plain.status_code == 200
+    assert plain.content == catalog.api_document.body
+    assert plain.json() == catalog.api_json
+    assert plain.headers["Cache-Control"] == config.API_CACHE_CONTROL
+    assert "Content-Encoding" not in plain.headers
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert gzipped.headers["ETag"] != plain.headers["ETag"]
+    assert gzipped.json() == catalog.api_json
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert changed.status_code == 200
+    assert "Content-Encoding" not in changed.headers
+
+def test_accepts_gzip():
+    assert main.accepts_gzip("gzip, deflate, br")
+    assert main.accepts_gzip("br;q=1.0, GZIP;q=0.5")
+    assert not main.accepts_gzip("gzip;q=0")
+    assert not main.accepts_gzip("deflate")
+
+@pytest.mark.asyncio
+@mock.patch('asyncio.create_subprocess_exec', new_callable=mock.AsyncMock)
+async def test_post_llm_reports_and_logs_timing(mock_create_subprocess_exec, mock_db, monkeypatch):
+    from gull_api import metrics
+    monkeypatch.setattr(main, 'admissions', {})
+    monkeypatch.setattr(config, 'LOG_MODE', 'sync')
+    monkeypatch.setattr(main, 'log_writer', None)
+    mock_create_subprocess_exec.return_value = mock_process(stdout=b'Once upon a time', delay=0.05)
+    before = metrics.time_to_first_output.count("LLaMA-7B")
+
+    result = await main.post_llm(sample_llm_request, CompiledSchema(cli_json), no_cache=True, timing=True)
+
+    assert result["response"] == "Once upon a time"
+    timing = result["timing"]
+    assert timing["time_to_first_output"] >= 0.05
+    assert (timing["output_bytes"], timing["output_tokens"]) == (16, 4)
+    log = mock_db.add.call_args[0][0]
+    assert (log.output_bytes, log.output_tokens) == (16, 4)
+    assert log.time_to_first_output == timing["time_to_first_output"]
+    assert log.tokens_per_second == timing["tokens_per_second"]
+    assert metrics.time_to_first_output.count("LLaMA-7B") == before + 1
+
+@mock.patch('asyncio.create_subprocess_exec', new_callable=mock.AsyncMock)
+def test_post_llm_stream_reports_timing(mock_create_subprocess_exec, mock_db, monkeypatch):
+    from fastapi.testclient import TestClient
+    monkeypatch.setattr(main, 'admissions', {})
+    mock_create_subprocess_exec.side_effect = lambda *args, **kwargs: mock_process(stdout=b'Once upon a time')
+    main.app.dependency_overrides[main.get_schema] = lambda: CompiledSchema(cli_json)
+    try:
+        client = TestClient(main.app)
+        with_timing = client.post("/llm/stream", json=sample_llm_request, params={"timing": "true"})
+        without = client.post("/llm/stream", json=sample_llm_request)
+    finally:
+        main.app.dependency_overrides.clear()
+
+    done = json.loads(with_timing.text.splitlines()[-1])
+    assert done["done"] is True
+    assert done["timing"]["output_bytes"] == 16
+    assert json.loads(without.text.splitlines()[-1]) == {"done": True}
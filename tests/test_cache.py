@@ -0,0 +1,229 @@
+import asyncio
+import os
+import time
+import pytest
+from unittest import mock
+import gull_api.db as db
+from gull_api import config
+from gull_api.cache import ResponseCache, SingleFlight, is_deterministic, request_key
+from gull_api.schema import CompiledSchema
+
+cli_json = {
+    "LLaMA-7B": [
+        {"name": "Prompt", "type": "str", "flag": "--prompt", "description": "Provide a prompt"},
+        {"name": "Temperature", "type": "float", "flag": "--temp", "default": 0.8, "description": "Temperature"},
+    ]
+}
+
+
+def test_request_key_is_canonical():
+    schema = CompiledSchema(cli_json)
+    explicit = schema.validate({"Prompt": "Hi", "Temperature": 0.8})
+    defaulted = schema.validate({"Prompt": "Hi"})
+
+    assert request_key(schema, explicit) == request_key(schema, defaulted)
+    assert request_key(schema, explicit) != request_key(schema, schema.validate({"Prompt": "Hi", "Temperature": 0}))
+
+
+def test_request_key_depends_on_schema_version():
+    schema = CompiledSchema(cli_json)
+    other = CompiledSchema(cli_json, version="other")
+    request = schema.validate({"Prompt": "Hi"})
+
+    assert request_key(schema, request) != request_key(other, request)
+
+
+def test_request_key_changes_with_executable_and_model_file(tmp_path, monkeypatch):
+    executable, model = tmp_path / "main", tmp_path / "model.bin"
+    executable.write_bytes(b"v1")
+    model.write_bytes(b"weights")
+    monkeypatch.setattr(config, "EXECUTABLE", str(executable))
+    schema = CompiledSchema({"LLaMA-7B": cli_json["LLaMA-7B"] + [
+        {"name": "Model", "type": "str", "flag": "-m", "default": str(model), "hidden": True, "description": "Model"},
+    ]})
+    request = schema.validate({"Prompt": "Hi"})
+    keys = [request_key(schema, request)]
+
+    executable.write_bytes(b"v2, rebuilt")
+    keys.append(request_key(schema, request))
+    model.write_bytes(b"new weights")
+    keys.append(request_key(schema, request))
+    os.utime(model, ns=(0, 0))
+    keys.append(request_key(schema, request))
+
+    assert len(set(keys)) == 4
+    assert request_key(schema, request) == keys[-1]
+
+
+def test_only_repeatable_requests_are_deterministic():
+    schema = CompiledSchema({"LLaMA-7B": cli_json["LLaMA-7B"] + [
+        {"name": "Seed", "type": "int", "flag": "--seed", "default": -1, "description": "Seed"},
+    ]})
+
+    assert not is_deterministic(schema, schema.validate({"Prompt": "Hi"}))
+    assert is_deterministic(schema, schema.validate({"Prompt": "Hi", "Temperature": 0}))
+    assert is_deterministic(schema, schema.validate({"Prompt": "Hi", "Seed": 42}))
+    # A model without either parameter is assumed to sample.
+    no_sampling_params = CompiledSchema({"LLaMA-7B": cli_json["LLaMA-7B"][:1]})
+    assert not is_deterministic(no_sampling_params, no_sampling_params.validate({"Prompt": "Hi"}))
+
+
+@pytest.mark.asyncio
+async def test_cache_hit_and_miss_counters():
+    cache = ResponseCache()
+
+    assert await cache.get("k") is None
+    await cache.put("k", "value")
+    assert await cache.get("k") == "value"
+
+    assert cache.stats() == {"entries": 1, "bytes": 5, "hits": 1, "misses": 1, "evictions": 0, "expirations": 0, "pruned": 0}
+
+
+@pytest.mark.asyncio
+async def test_cache_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    await cache.put("a", "1")
+    await cache.put("b", "2")
+    await cache.get("a")
+    await cache.put("c", "3")
+
+    assert await cache.get("b") is None
+    assert await cache.get("a") == "1"
+    assert cache.evictions == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_evicts_by_size():
+    cache = ResponseCache(max_bytes=10)
+    await cache.put("a", "x" * 6)
+    await cache.put("b", "y" * 6)
+
+    assert await cache.get("a") is None
+    assert cache.stats()["bytes"] == 6
+
+
+@pytest.mark.asyncio
+async def test_cache_expires_entries():
+    cache = ResponseCache(ttl=10)
+    with mock.patch("gull_api.cache.time.time", return_value=1000):
+        await cache.put("k", "value")
+    with mock.patch("gull_api.cache.time.time", return_value=1011):
+        assert await cache.get("k") is None
+
+    assert cache.expirations == 1
+
+
+@pytest.mark.asyncio
+async def test_persistent_tier_survives_new_cache_instance(tmp_path):
+    session_maker = db.get_session_maker(db.create_engine(f"sqlite:///{tmp_path / 'cache.db'}"))
+    await ResponseCache(persist=True, session_maker=session_maker).put("k", "value")
+
+    fresh = ResponseCache(persist=True, session_maker=session_maker)
+    assert await fresh.get("k") == "value"
+    assert fresh.stats()["entries"] == 1
+
+
+@pytest.mark.asyncio
+async def test_persistent_tier_is_pruned(tmp_path, monkeypatch):
+    session_maker = db.get_session_maker(db.create_engine(f"sqlite:///{tmp_path / 'cache.db'}"))
+    cache = ResponseCache(max_entries=2, ttl=60, persist=True, session_maker=session_maker)
+    for key in ("a", "b", "c", "d"):
+        await cache.put(key, "value")
+    session = session_maker()
+    session.get(db.CachedResponse, "d").created_at = time.time() - 120
+    session.commit()
+    session.close()
+
+    # Expired "d" goes first, then the oldest beyond the two newest.
+    assert cache.prune() == 2
+    fresh = ResponseCache(persist=True, session_maker=session_maker)
+    assert [await fresh.get(key) for key in "abcd"] == [None, "value", "value", None]
+
+    # Puts prune the table on their own once PRUNE_INTERVAL has passed.
+    monkeypatch.setattr("gull_api.cache.PRUNE_INTERVAL", 0)
+    await cache.put("e", "value")
+    assert cache.stats()["pruned"] == 3
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_one_execution():
+    flight = SingleFlight()
+    started = asyncio.Event()
+    release = asyncio.Event()
+    calls = 0
+
+    async def run():
+        nonlocal calls
+        calls += 1
+        started.set()
+        await release.wait()
+        return "result"
+
+    first = asyncio.create_task(flight.do("k", run))
+    await started.wait()
+    second = asyncio.create_task(flight.do("k", run))
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(first, second) == ["result", "result"]
+    assert calls == 1
+    assert flight.stats() == {"in_flight": 0, "executions": 1, "coalesced": 1}
+
+
+@pytest.mark.asyncio
+async def test_single_flight_propagates_failure_to_every_waiter():
+    flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def run():
+        await release.wait()
+        raise asyncio.TimeoutError
+
+    waiters = [asyncio.create_task(flight.do("k", run)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+
+    assert all(isinstance(result, asyncio.TimeoutError) for result in results)
+    assert flight.executions == 1
+
+
+@pytest.mark.asyncio
+async def test_single_flight_cancelled_waiter_does_not_cancel_shared_run():
+    flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def run():
+        await release.wait()
+        return "result"
+
+    leaver = asyncio.create_task(flight.do("k", run))
+    stayer = asyncio.create_task(flight.do("k", run))
+    await asyncio.sleep(0)
+
+    leaver.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await stayer == "result"
+    assert leaver.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_single_flight_cancels_run_when_last_waiter_leaves():
+    flight = SingleFlight()
+    cancelled = asyncio.Event()
+
+    async def run():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    waiter = asyncio.create_task(flight.do("k", run))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+
+    assert flight.in_flight == 0
@@ -0,0 +1,100 @@
+import json
+import pytest
+import gull_api.clients as clients
+import gull_api.config as config
+from gull_api.admission import BATCH, INTERACTIVE
+from gull_api.clients import Client, ClientRegistry, RateLimited, UnknownApiKey, lower_priority
+
+
+@pytest.fixture
+def registry(tmp_path):
+    path = tmp_path / "clients.json"
+    path.write_text(json.dumps({
+        "secret-1": {"name": "webapp", "weight": 4, "max_concurrency": 2, "rate": 5},
+        "secret-2": {"name": "nightly", "priority": "batch"},
+    }))
+    return ClientRegistry(path=str(path))
+
+
+def test_identifies_configured_clients_by_api_key(registry):
+    webapp = registry.identify({"x-api-key": "secret-1"})
+    nightly = registry.identify({"authorization": "Bearer secret-2"})
+
+    assert (webapp.id, webapp.weight, webapp.max_concurrency, webapp.burst) == ("webapp", 4, 2, 5)
+    assert (nightly.id, nightly.priority) == ("nightly", BATCH)
+
+
+def test_unconfigured_callers_get_defaults(registry, monkeypatch):
+    monkeypatch.setattr(config, "DEFAULT_CLIENT_WEIGHT", 1.0)
+
+    assert registry.identify({}, host="10.0.0.1").id == "ip:10.0.0.1"
+    assert registry.identify({}).id == "anonymous"
+    assert registry.identify({}).weight == 1.0
+
+
+def test_unknown_keys_are_refused_once_keys_are_configured(registry):
+    with pytest.raises(UnknownApiKey):
+        registry.identify({"x-api-key": "not-configured"}, host="10.0.0.1")
+    with pytest.raises(UnknownApiKey):
+        registry.identify({"authorization": "Bearer made-up"}, host="10.0.0.1")
+
+    # Without configured keys, a key is no way to a quota of its own.
+    open_registry = ClientRegistry(path="")
+    assert open_registry.identify({"x-api-key": "random-1"}, host="10.0.0.1").id == "ip:10.0.0.1"
+    assert open_registry.identify({"x-api-key": "random-2"}, host="10.0.0.1").id == "ip:10.0.0.1"
+
+
+def test_client_id_header_is_only_believed_from_trusted_proxies():
+    registry = ClientRegistry(path="", trusted_proxies="10.0.0.9, 10.0.0.10")
+
+    assert registry.identify({"x-client-id": "203.0.113.5"}, host="10.0.0.9").id == "id:203.0.113.5"
+    assert registry.identify({"x-client-id": "203.0.113.5"}, host="10.0.0.10").id == "id:203.0.113.5"
+    assert registry.identify({}, host="10.0.0.9").id == "ip:10.0.0.9"
+    assert registry.identify({"x-client-id": "someone-else"}, host="10.0.0.1").id == "ip:10.0.0.1"
+
+
+def test_rate_limit_buckets_are_capped(monkeypatch):
+    monkeypatch.setattr(clients, "MAX_DEFAULT_BUCKETS", 3)
+    registry = ClientRegistry(path="")
+    limited = Client("limited", rate=0.01, burst=1)
+    registry.check_rate(limited)
+
+    # None of these refill in time to be pruned as unused.
+    for index in range(10):
+        registry.check_rate(Client(f"caller-{index}", rate=0.01, burst=1))
+        assert len(registry.stats()) <= 3
+
+    assert "caller-9" in registry.stats()
+    assert "limited" not in registry.stats()
+
+
+def test_rate_limit_allows_burst_then_rejects():
+    registry = ClientRegistry(path="")
+    client = Client("burst", rate=0.5, burst=2)
+
+    registry.check_rate(client)
+    registry.check_rate(client)
+    with pytest.raises(RateLimited) as exc_info:
+        registry.check_rate(client)
+
+    assert exc_info.value.retry_after >= 1
+    assert registry.stats()["burst"]["rate_limited"] == 1
+    # Clients without a rate are never limited or tracked.
+    for _ in range(100):
+        registry.check_rate(Client("free"))
+    assert "free" not in registry.stats()
+
+
+def test_lower_priority_never_raises_the_class():
+    assert lower_priority(INTERACTIVE, INTERACTIVE, None) == INTERACTIVE
+    assert lower_priority(INTERACTIVE, BATCH) == BATCH
+    assert lower_priority(BATCH, INTERACTIVE, "interactive") == BATCH
+    assert lower_priority(INTERACTIVE, INTERACTIVE, "bogus") == INTERACTIVE
+
+
+def test_unknown_priority_class_is_rejected(tmp_path):
+    path = tmp_path / "clients.json"
+    path.write_text(json.dumps({"k": {"priority": "urgent"}}))
+
+    with pytest.raises(ValueError):
+        ClientRegistry(path=str(path))
@@ -1,8 +1,11 @@
+import asyncio
+import multiprocessing
 import pytest
 from unittest.mock import patch, MagicMock, mock_open
 from sqlalchemy.orm import Session, sessionmaker
 import gull_api.db as db
 from gull_api import config
+from sqlalchemy import event, inspect
 from sqlalchemy.exc import SQLAlchemyError
 
 @patch('gull_api.db.create_engine')
@@ -92,4 +95,262 @@ def test_get_session_maker_without_engine(mock_create_all, mock_create_engine):
     assert returned_session_maker.kw['bind'] == mock_engine
     
     # Check if metadata.create_all was called with the correct engine
-    mock_create_all.assert_called_once_with(bind=mock_engine)
\ No newline at end of file
+    mock_create_all.assert_called_once_with(bind=mock_engine)
+@patch('gull_api.db.get_session_maker')
+def test_default_session_maker_is_created_once(mock_get_session_maker, monkeypatch):
+    monkeypatch.setattr(db, '_session_maker', None)
+
+    first = db.get_default_session_maker()
+    second = db.get_default_session_maker()
+
+    assert first is second
+    mock_get_session_maker.assert_called_once_with()
+
+
+def sqlite_session_maker(tmp_path):
+    return db.get_session_maker(db.create_engine(f"sqlite:///{tmp_path / 'test.db'}"))
+
+
+@pytest.mark.asyncio
+async def test_log_writer_flushes_in_batches(tmp_path):
+    session_maker = sqlite_session_maker(tmp_path)
+    writer = db.LogWriter(session_maker, batch_size=2, flush_interval=60)
+    await writer.start()
+
+    for i in range(5):
+        await writer.submit(db.APIRequestLog(request=str(i), error_occurred=False))
+    await writer.stop()
+
+    session = session_maker()
+    assert session.query(db.APIRequestLog).count() == 5
+    session.close()
+    # Two full batches of two, plus the remainder flushed on shutdown.
+    assert writer.stats() == {"pending": 0, "written": 5, "failed": 0, "batches": 3}
+
+
+@pytest.mark.asyncio
+async def test_log_writer_flushes_partial_batch_after_interval(tmp_path):
+    session_maker = sqlite_session_maker(tmp_path)
+    writer = db.LogWriter(session_maker, batch_size=100, flush_interval=0.05)
+    await writer.start()
+
+    await writer.submit(db.APIRequestLog(request="only", error_occurred=False))
+    for _ in range(100):
+        if writer.written:
+            break
+        await asyncio.sleep(0.01)
+
+    assert writer.written == 1
+    await writer.stop()
+
+
+def test_log_writer_counts_failed_batches():
+    mock_session = MagicMock(spec=Session)
+    mock_session.commit.side_effect = SQLAlchemyError
+    writer = db.LogWriter(lambda: mock_session)
+
+    writer.write_batch([MagicMock(), MagicMock()])
+
+    mock_session.rollback.assert_called_once()
+    mock_session.close.assert_called_once()
+    assert (writer.written, writer.failed) == (0, 2)
+
+
+def test_write_logs_uses_one_transaction(tmp_path):
+    session_maker = sqlite_session_maker(tmp_path)
+    logs = [db.APIRequestLog(request=str(i), error_occurred=False) for i in range(3)]
+
+    with patch.object(Session, 'commit', autospec=True, side_effect=Session.commit) as mock_commit:
+        db.write_logs(logs, session_maker)
+
+    mock_commit.assert_called_once()
+    session = session_maker()
+    assert session.query(db.APIRequestLog).count() == 3
+    session.close()
+
+
+def test_get_session_maker_adds_columns_missing_from_old_tables(tmp_path):
+    engine = db.create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        connection.execute(db.sqlalchemy.text(
+            "CREATE TABLE api_request_log (id INTEGER PRIMARY KEY, request VARCHAR, response VARCHAR, "
+            "error_occurred BOOLEAN, error_details VARCHAR)"
+        ))
+        connection.execute(db.sqlalchemy.text("INSERT INTO api_request_log (request) VALUES ('old')"))
+
+    session_maker = db.get_session_maker(engine)
+    db.write_logs([db.APIRequestLog(request="new", client_id="webapp", priority="batch", queue_wait=0.5)], session_maker)
+
+    session = session_maker()
+    rows = {row.request: row for row in session.query(db.APIRequestLog)}
+    session.close()
+    assert rows["old"].client_id is None
+    assert (rows["new"].client_id, rows["new"].priority, rows["new"].queue_wait) == ("webapp", "batch", 0.5)
+
+
+def test_get_session_maker_adds_indexes_missing_from_old_tables(tmp_path):
+    engine = db.create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        connection.execute(db.sqlalchemy.text(
+            "CREATE TABLE api_request_log (id INTEGER PRIMARY KEY, request VARCHAR, response VARCHAR, "
+            "error_occurred BOOLEAN, error_details VARCHAR)"
+        ))
+
+    db.get_session_maker(engine)
+    db.get_session_maker(engine)
+
+    indexes = {index["name"] for index in db.sqlalchemy.inspect(engine).get_indexes("api_request_log")}
+    assert {"ix_api_request_log_timestamp", "ix_api_request_log_request_hash",
+            "ix_api_request_log_model_timestamp", "ix_api_request_log_error_timestamp"} <= indexes
+
+
+def write_sample_logs(session_maker):
+    db.write_logs([
+        db.APIRequestLog(request=str(i), response=f"out {i}", error_occurred=i % 4 == 0, returncode=int(i % 4 == 0),
+                         timestamp=1000.0 + i, duration=float(i), model="7B" if i % 2 else "13B")
+        for i in range(1, 11)
+    ], session_maker)
+
+
+def test_query_logs_pages_newest_first(tmp_path):
+    session_maker = sqlite_session_maker(tmp_path)
+    write_sample_logs(session_maker)
+
+    first = db.query_logs(session_maker, limit=4)
+    second = db.query_logs(session_maker, limit=4, before=first["next"])
+    last = db.query_logs(session_maker, limit=4, before=second["next"])
+
+    assert [log["request"] for log in first["logs"]] == ["10", "9", "8", "7"]
+    assert [log["request"] for log in second["logs"]] == ["6", "5", "4", "3"]
+    assert [log["request"] for log in last["logs"]] == ["2", "1"]
+    assert last["next"] is None
+    assert "response" not in first["logs"][0]
+    assert db.query_logs(session_maker, limit=1, include_response=True)["logs"][0]["response"] == "out 10"
+
+
+def test_query_logs_filters(tmp_path):
+    session_maker = sqlite_session_maker(tmp_path)
+    write_sample_logs(session_maker)
+
+    def requests(**filters):
+        return [log["request"] for log in db.query_logs(session_maker, **filters)["logs"]]
+
+    assert requests(since=1003, until=1006) == ["5", "4", "3"]
+    assert requests(error=True) == ["8", "4"]
+    assert requests(model="7B", error=False) == ["9", "7", "5", "3", "1"]
+
+
+def test_log_stats_are_computed_in_the_database(tmp_path):
+    session_maker = sqlite_session_maker(tmp_path)
+    write_sample_logs(session_maker)
+
+    stats = db.log_stats(session_maker)
+    assert (stats["count"], stats["errors"]) == (10, 2)
+    assert stats["duration"] == {"mean": 5.5, "max": 10.0, "p50": 5.0, "p90": 9.0, "p99": 10.0}
+    assert stats["models"] == {"7B": {"count": 5, "errors": 0}, "13B": {"count": 5, "errors": 2}}
+    assert db.log_stats(session_maker, model="13B", since=1005)["duration"]["p50"] == 8.0
+    assert db.log_stats(session_maker, model="none")["duration"]["p50"] is None
+
+
+def test_log_stats_read_all_percentiles_in_one_ordered_pass(tmp_path):
+    session_maker = sqlite_session_maker(tmp_path)
+    write_sample_logs(session_maker)
+    engine = session_maker.kw["bind"]
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    stats = db.log_stats(session_maker, percentiles=(0.25, 0.5, 0.75))
+
+    assert {key: stats["duration"][key] for key in ("p25", "p50", "p75")} == {"p25": 3.0, "p50": 5.0, "p75": 8.0}
+    assert sum("ORDER BY" in statement for statement in statements) == 1
+    assert "ix_api_request_log_duration" in {index["name"] for index in inspect(engine).get_indexes("api_request_log")}
+    assert db.log_stats(session_maker, percentiles=())["duration"] == {"mean": 5.5, "max": 10.0}
+
+
+def test_recent_generations_returns_latest_successful_runs_oldest_first(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'LOG_COMPRESS_BYTES', 100)
+    session_maker = sqlite_session_maker(tmp_path)
+    long_prompt = db.canonical_json({"Prompt": "x" * 500})
+    db.write_logs([
+        db.APIRequestLog(request='{"n":1}', model="7B", error_occurred=False, generation_time=1.0, timestamp=1.0),
+        db.APIRequestLog(request=long_prompt, model="7B", error_occurred=False, generation_time=2.0, timestamp=2.0),
+        db.APIRequestLog(request='{"n":3}', model="7B", error_occurred=True, generation_time=3.0, timestamp=3.0),
+        db.APIRequestLog(request='{"n":4}', model="7B", error_occurred=False, timestamp=4.0),
+        db.APIRequestLog(request='{"n":5}', model="13B", error_occurred=False, generation_time=5.0, timestamp=5.0),
+        db.APIRequestLog(request='{"n":6}', model="7B", error_occurred=False, generation_time=6.0, timestamp=6.0),
+    ], session_maker)
+
+    assert db.recent_generations("7B", 2, session_maker) == [({"Prompt": "x" * 500}, 2.0), ({"n": 6}, 6.0)]
+    assert db.recent_generations("7B", 10, session_maker)[0] == ({"n": 1}, 1.0)
+
+
+def test_large_texts_are_compressed_and_requests_deduplicated(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'LOG_COMPRESS_BYTES', 100)
+    session_maker = sqlite_session_maker(tmp_path)
+    prompt = db.canonical_json({"Prompt": "x" * 500, "Temperature": 0})
+    db.write_logs([db.APIRequestLog(request=prompt, response="y" * 500, timestamp=1.0)], session_maker)
+    db.write_logs([
+        db.APIRequestLog(request=prompt, response="short", timestamp=2.0),
+        db.APIRequestLog(request='{"Prompt":"small"}', timestamp=3.0),
+    ], session_maker)
+
+    session = session_maker()
+    rows = session.query(db.APIRequestLog).order_by(db.APIRequestLog.id).all()
+    assert session.query(db.LogContent).count() == 1
+    assert [row.request is None for row in rows] == [True, True, False]
+    assert rows[0].request_content == rows[1].request_content
+    assert rows[0].response is None and len(rows[0].response_data) < 100
+    session.close()
+
+    logs = db.query_logs(session_maker, include_response=True)["logs"]
+    assert [log["request"] for log in logs] == ['{"Prompt":"small"}', prompt, prompt]
+    assert [log["response"] for log in logs] == [None, "short", "y" * 500]
+
+
+def test_canonical_json_sorts_keys():
+    assert db.canonical_json({"b": 1, "a": "é"}) == '{"a":"é","b":1}'
+
+
+def test_get_engine_tunes_sqlite_for_several_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'DB_URI', f"sqlite:///{tmp_path / 'wal.db'}")
+    monkeypatch.setattr(config, 'SQLITE_BUSY_TIMEOUT', 7.5)
+    engine = db.get_engine()
+
+    with engine.connect() as connection:
+        pragma = lambda name: connection.execute(db.sqlalchemy.text(f"PRAGMA {name}")).scalar()
+        assert pragma("journal_mode") == "wal"
+        assert pragma("busy_timeout") == 7500
+        assert pragma("synchronous") == 1  # NORMAL
+    engine.dispose()
+
+
+def test_configure_sqlite_rejects_unknown_synchronous_level(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'SQLITE_SYNCHRONOUS', "SOMETIMES")
+    with pytest.raises(ValueError):
+        db.configure_sqlite(db.create_engine(f"sqlite:///{tmp_path / 'x.db'}"))
+
+
+def create_schema_in_process(uri, barrier, errors):
+    engine = db.create_engine(uri)
+    db.configure_sqlite(engine)
+    barrier.wait()
+    try:
+        db.get_session_maker(engine)
+    except Exception as e:
+        errors.put(repr(e))
+
+
+def test_processes_starting_together_on_new_database(tmp_path):
+    # Like uvicorn workers starting at once on a first deploy.
+    context = multiprocessing.get_context("spawn")
+    errors = context.Queue()
+    for trial in range(2):
+        uri = f"sqlite:///{tmp_path / f'new{trial}.db'}"
+        barrier = context.Barrier(4)
+        processes = [context.Process(target=create_schema_in_process, args=(uri, barrier, errors)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(30)
+        assert [process.exitcode for process in processes] == [0] * 4
+        assert errors.empty(), errors.get()
@@ -0,0 +1,261 @@
+import asyncio
+import json
+import httpx
+import pytest
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from gull_api import dispatcher as dispatcher_module
+from gull_api.dispatcher import Dispatcher
+
+
+def status(active=0, waiting=0, max_concurrency=2):
+    return {"admission": {"7B": {"active": active, "waiting": waiting, "max_concurrency": max_concurrency}}}
+
+
+class Body(httpx.AsyncByteStream):
+    # Streamed like a real connection's body; httpx reads a plain `json=` one up front.
+    def __init__(self, data):
+        self.data = data
+
+    async def __aiter__(self):
+        yield self.data
+
+
+def reply(status_code, data, headers=None):
+    return httpx.Response(status_code, headers={"content-type": "application/json", **(headers or {})},
+                          stream=Body(json.dumps(data).encode()))
+
+
+class FakeBackends:
+    """Answers for backends http://a, http://b, ... through one MockTransport."""
+
+    def __init__(self, **statuses):
+        self.statuses = statuses
+        self.not_ready = set()
+        self.down = set()
+        self.busy = set()
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        if host in self.down:
+            raise httpx.ConnectError("Connection refused", request=request)
+        if request.url.path == "/ready":
+            return httpx.Response(503 if host in self.not_ready else 200, json={"ready": host not in self.not_ready})
+        if request.url.path == "/status":
+            return httpx.Response(200, json=self.statuses[host])
+        self.requests.append((host, request))
+        if host in self.busy:
+            return reply(503, {"detail": "Queue full"}, {"Retry-After": "7"})
+        return reply(200, {"response": f"from {host}"})
+
+
+async def make_dispatcher(backends):
+    dispatcher = Dispatcher([f"http://{host}" for host in backends.statuses], transport=httpx.MockTransport(backends))
+    await dispatcher.check_all()
+    return dispatcher
+
+
+def dispatcher_client():
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=dispatcher_module.app), base_url="http://dispatcher")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def client_for(backends):
+        dispatcher = await make_dispatcher(backends)
+        monkeypatch.setattr(dispatcher_module, "dispatcher", dispatcher)
+        return dispatcher_client()
+    return client_for
+
+
+@pytest.mark.asyncio
+async def test_forwards_to_least_loaded_backend(client):
+    backends = FakeBackends(a=status(active=2, waiting=3), b=status(active=1), c=status(active=2))
+    async with await client(backends) as http:
+        response = await http.post("/llm/7B?timeout=5", json={"Prompt": "Hi"})
+
+    assert response.json() == {"response": "from b"}
+    host, request = backends.requests[0]
+    assert request.url.path == "/llm/7B"
+    assert request.url.params["timeout"] == "5"
+    assert request.content == b'{"Prompt": "Hi"}'
+
+
+@pytest.mark.asyncio
+async def test_ties_are_taken_in_turn(client):
+    backends = FakeBackends(a=status(), b=status())
+    async with await client(backends) as http:
+        for _ in range(4):
+            await http.post("/llm", json={})
+
+    assert [host for host, _ in backends.requests] == ["a", "b", "a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_in_flight_requests_count_until_next_poll():
+    backends = FakeBackends(a=status(), b=status(active=1, max_concurrency=4))
+    dispatcher = await make_dispatcher(backends)
+    a, b = dispatcher.backends
+
+    a.in_flight = 1
+    assert (a.load, b.load) == (0.5, 0.25)
+
+    # Once polled, a's request is part of what it reports.
+    backends.statuses["a"] = status(active=1)
+    await dispatcher.check_all()
+    assert a.load == 0.5
+    a.in_flight = 0
+    assert a.load == 0.0
+
+
+@pytest.mark.asyncio
+async def test_fails_over_on_connection_error(client):
+    backends = FakeBackends(a=status(), b=status(active=1))
+    async with await client(backends) as http:
+        backends.down.add("a")
+        response = await http.post("/llm", json={})
+        stats = (await http.get("/status")).json()["dispatcher"]
+
+    assert response.json() == {"response": "from b"}
+    assert stats["failovers"] == 1
+    assert stats["backends"][0]["healthy"] is False
+    assert "ConnectError" in stats["backends"][0]["last_error"]
+    assert stats["backends"][1]["forwarded"] == 1
+    assert stats["backends"][1]["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_full_backend_is_skipped_and_last_rejection_returned(client):
+    backends = FakeBackends(a=status(), b=status(active=1))
+    async with await client(backends) as http:
+        backends.busy.add("a")
+        assert (await http.post("/llm", json={})).json() == {"response": "from b"}
+
+        backends.busy.add("b")
+        response = await http.post("/llm", json={})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
+
+
+@pytest.mark.asyncio
+async def test_unready_and_unreachable_backends_get_nothing(client):
+    backends = FakeBackends(a=status(), b=status())
+    backends.not_ready.add("a")
+    backends.down.add("b")
+    async with await client(backends) as http:
+        response = await http.post("/llm", json={})
+        ready = await http.get("/ready")
+
+        backends.not_ready.clear()
+        await dispatcher_module.dispatcher.check_all()
+        assert (await http.get("/ready")).json() == {"ready": True, "healthy_backends": 1}
+
+    assert response.status_code == 503
+    assert response.json() == {"detail": "No backend is available."}
+    assert backends.requests == []
+    assert ready.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_callers_without_key_are_identified_by_address(client):
+    backends = FakeBackends(a=status())
+    async with await client(backends) as http:
+        await http.post("/llm", json={})
+        await http.post("/llm", json={}, headers={"X-API-Key": "secret"})
+
+    anonymous, keyed = (request.headers for _, request in backends.requests)
+    assert anonymous["x-client-id"] == anonymous["x-forwarded-for"] == "127.0.0.1"
+    assert keyed["x-api-key"] == "secret"
+    assert "x-client-id" not in keyed
+
+
+@pytest.mark.asyncio
+async def test_client_disconnect_cancels_backend_request():
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def backend(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/ready":
+            return httpx.Response(200, json={"ready": True})
+        if request.url.path == "/status":
+            return httpx.Response(200, json=status())
+        # A generation whose response only starts once it is done.
+        started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    dispatcher = Dispatcher(["http://a"], transport=httpx.MockTransport(backend))
+    await dispatcher.check_all()
+    messages = [{"type": "http.request", "body": b"{}", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await started.wait()
+        return {"type": "http.disconnect"}
+
+    scope = {"type": "http", "method": "POST", "path": "/llm", "query_string": b"", "headers": [],
+             "client": ("127.0.0.1", 50000)}
+    response = await asyncio.wait_for(dispatcher.forward(Request(scope, receive)), 5)
+
+    assert response.status_code == 499
+    assert cancelled.is_set()
+    assert dispatcher.backends[0].in_flight == 0
+    assert dispatcher.stats()["disconnected"] == 1
+
+
+def stub_backend(name):
+    app = FastAPI()
+
+    @app.get("/ready")
+    def ready():
+        return {"ready": True}
+
+    @app.get("/status")
+    def get_status():
+        return status()
+
+    @app.post("/llm")
+    async def llm(request: Request):
+        # The client port shows whether connections are being reused.
+        return JSONResponse({"backend": name, "port": request.client.port, "request": await request.json()})
+
+    return app
+
+
+async def serve(app):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, f"http://127.0.0.1:{port}"
+
+
+@pytest.mark.asyncio
+async def test_local_backends_with_keep_alive_and_failover(monkeypatch):
+    (server_a, task_a, url_a), (server_b, task_b, url_b) = [await serve(stub_backend(name)) for name in "ab"]
+    dispatcher = Dispatcher([url_a, url_b], connect_timeout=1.0)
+    await dispatcher.start()
+    monkeypatch.setattr(dispatcher_module, "dispatcher", dispatcher)
+    try:
+        async with dispatcher_client() as http:
+            results = [(await http.post("/llm", json={"Prompt": str(i)})).json() for i in range(4)]
+            assert [result["backend"] for result in results] == ["a", "b", "a", "b"]
+            assert results[0]["port"] == results[2]["port"]
+            assert results[0]["request"] == {"Prompt": "0"}
+
+            server_a.should_exit = True
+            await task_a
+            results = [(await http.post("/llm", json={})).json() for _ in range(2)]
+            assert [result["backend"] for result in results] == ["b", "b"]
+            assert not dispatcher.backends[0].healthy
+    finally:
+        await dispatcher.stop()
+        server_a.should_exit = server_b.should_exit = True
+        await asyncio.gather(task_a, task_b)
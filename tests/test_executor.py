@@ -0,0 +1,195 @@
+import asyncio
+import subprocess
+import sys
+import pytest
+from gull_api import config
+from gull_api.executor import (
+    BoundedBuffer, GenerationTiming, StreamingProcess, cap_text, capture_output, estimate_tokens, terminate_process,
+)
+
+# Writes "é" (0xC3 0xA9) split across two flushes, then a second line and some stderr.
+SPLIT_UTF8 = [sys.executable, "-c", """
+import sys, time
+out = sys.stdout.buffer
+out.write(b"caf\\xc3"); out.flush(); time.sleep(0.05)
+out.write(b"\\xa9\\n"); out.flush(); time.sleep(0.05)
+out.write(b"done\\n"); out.flush()
+sys.stderr.write("warn")
+"""]
+
+
+async def collect(run):
+    return [text async for text in run.chunks()]
+
+
+@pytest.mark.asyncio
+async def test_streaming_process_decodes_split_multibyte_characters():
+    run = StreamingProcess(SPLIT_UTF8, timeout=10)
+    await run.start()
+    chunks = await collect(run)
+
+    assert "".join(chunks) == "café\ndone\n"
+    assert all("�" not in chunk for chunk in chunks)
+    assert len(chunks) > 1
+    assert run.stdout == "café\ndone\n"
+    assert run.stderr == "warn"
+    assert run.returncode == 0
+
+
+@pytest.mark.asyncio
+async def test_streaming_process_reports_nonzero_returncode():
+    run = StreamingProcess([sys.executable, "-c", "import sys; sys.stderr.write('bad'); sys.exit(2)"], timeout=10)
+    await run.start()
+    assert await collect(run) == []
+    assert (run.returncode, run.stderr) == (2, "bad")
+
+
+@pytest.mark.asyncio
+async def test_streaming_process_kills_child_on_timeout():
+    run = StreamingProcess([sys.executable, "-c", "import time; print('hi', flush=True); time.sleep(30)"], timeout=0.5)
+    await run.start()
+    with pytest.raises(asyncio.TimeoutError):
+        await collect(run)
+
+    assert run.stdout == "hi\n"
+    assert run.process.returncode is not None
+
+
+def pid_running(pid):
+    # A killed grandchild may linger as a zombie if init here doesn't reap orphans.
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+@pytest.mark.asyncio
+async def test_terminate_process_kills_group_and_escalates(tmp_path):
+    # The leader ignores SIGTERM and has a grandchild; both must be gone afterwards.
+    pidfile = tmp_path / "grandchild.pid"
+    script = f"""
+import signal, subprocess, sys, time
+signal.signal(signal.SIGTERM, signal.SIG_IGN)
+child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+open({str(pidfile)!r}, "w").write(str(child.pid))
+print("ready", flush=True)
+time.sleep(30)
+"""
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", script, stdout=subprocess.PIPE, start_new_session=True
+    )
+    await process.stdout.readline()
+    grandchild = int(pidfile.read_text())
+
+    await terminate_process(process, grace=0.2)
+
+    assert process.returncode is not None
+    for _ in range(50):
+        if not pid_running(grandchild):
+            break
+        await asyncio.sleep(0.02)
+    assert not pid_running(grandchild)
+
+
+@pytest.mark.asyncio
+async def test_terminate_process_ignores_finished_process():
+    process = await asyncio.create_subprocess_exec(sys.executable, "-c", "pass", start_new_session=True)
+    await process.wait()
+    await terminate_process(process)
+    assert process.returncode == 0
+
+
+def test_bounded_buffer_spills_to_disk_and_truncates():
+    buffer = BoundedBuffer(max_bytes=10, spill_bytes=4)
+    buffer.write(b"abcdef")
+    assert buffer._file._rolled
+    buffer.write(b"ghijkl")
+
+    text = buffer.text()
+    assert text == "abcdefghij"
+    assert text.truncated and buffer.size == 10
+
+
+def test_cap_text_respects_utf8_boundaries():
+    assert cap_text("short", 100) == "short"
+    assert not hasattr(cap_text("short", 100), "limit")
+    capped = cap_text("é" * 10, 5)
+    assert capped == "éé"
+    assert capped.truncated and capped.limit == 5
+    assert cap_text("x" * 100, 0) == "x" * 100
+
+
+@pytest.mark.asyncio
+async def test_capture_output_caps_and_keeps_draining(monkeypatch):
+    monkeypatch.setattr(config, "STDOUT_MAX_BYTES", 1000)
+    monkeypatch.setattr(config, "STDERR_MAX_BYTES", 10)
+    monkeypatch.setattr(config, "OUTPUT_SPILL_BYTES", 100)
+    # Far more than a pipe buffer, so the child would block if reading stopped at the cap.
+    script = "import sys; sys.stdout.write('x' * 1000000); sys.stderr.write('e' * 50)"
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", script, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    stdout, stderr = await asyncio.wait_for(capture_output(process), timeout=10)
+
+    assert process.returncode == 0
+    assert stdout.text() == "x" * 1000 and stdout.truncated
+    assert stderr.text() == "e" * 10 and stderr.truncated
+
+
+@pytest.mark.asyncio
+async def test_streaming_process_caps_stored_stdout(monkeypatch):
+    monkeypatch.setattr(config, "STDOUT_MAX_BYTES", 5)
+    run = StreamingProcess([sys.executable, "-c", "print('hello world')"], timeout=10)
+    await run.start()
+    chunks = await collect(run)
+
+    assert "".join(chunks) == "hello world\n"
+    assert run.stdout == "hello"
+    assert run.stdout.truncated
+
+
+@pytest.mark.asyncio
+async def test_capture_output_times_first_output_and_exit():
+    timing = GenerationTiming()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", "import sys, time; time.sleep(0.2); print('one two three'); sys.stdout.flush(); time.sleep(0.2)",
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    timing.mark_spawned()
+    stdout, stderr = await capture_output(process, timing)
+    timing.count_tokens(stdout.text(), stderr.text())
+
+    stats = timing.stats()
+    assert stats["spawn_latency"] <= stats["time_to_first_output"] <= stats["generation_time"]
+    assert stats["time_to_first_output"] >= 0.2
+    assert stats["generation_time"] - stats["time_to_first_output"] >= 0.2
+    assert (stats["output_bytes"], stats["output_tokens"], stats["tokens_reported"]) == (14, 3, False)
+    assert 0 < stats["tokens_per_second"] < 3 / 0.2
+
+
+def test_timing_uses_llama_cpp_report_when_present():
+    timing = GenerationTiming()
+    timing.count_tokens("some text", (
+        "llama_print_timings: prompt eval time =   100.00 ms /     8 tokens\n"
+        "llama_print_timings:        eval time =  2000.00 ms /    99 runs   (   20.20 ms per token,    49.50 tokens per second)\n"
+    ))
+
+    assert (timing.tokens, timing.tokens_reported, timing.tokens_per_second) == (99, True, 49.5)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("Hello, world! It's 2023.") == 9
+    assert estimate_tokens("") == 0
+
+
+@pytest.mark.asyncio
+async def test_streaming_process_records_timing():
+    run = StreamingProcess(SPLIT_UTF8, timeout=10)
+    await run.start()
+    await collect(run)
+
+    stats = run.timing.stats()
+    assert stats["output_bytes"] == len("café\ndone\n".encode("utf-8"))
+    assert stats["time_to_first_output"] is not None
+    assert stats["output_tokens"] == 2
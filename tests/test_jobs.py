@@ -0,0 +1,168 @@
+import asyncio
+import time
+import pytest
+import gull_api.db as db
+from gull_api.jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue, JobRetry, JobRunner
+
+
+def sqlite_session_maker(tmp_path):
+    return db.get_session_maker(db.create_engine(f"sqlite:///{tmp_path / 'jobs.db'}"))
+
+
+def test_submitted_job_is_claimed_once(tmp_path):
+    session_maker = sqlite_session_maker(tmp_path)
+    first = JobQueue(session_maker, worker_id="a")
+    second = JobQueue(session_maker, worker_id="b")
+    job = first.submit("LLaMA-7B", {"Prompt": "Hi"}, timeout=600, client_id="webapp", priority="batch")
+
+    assert job["status"] == QUEUED
+    claimed = first.claim(5)
+    assert [c["id"] for c in claimed] == [job["id"]]
+    assert claimed[0]["request"] == {"Prompt": "Hi"}
+    assert (claimed[0]["timeout"], claimed[0]["client_id"]) == (600, "webapp")
+    assert second.claim(5) == []
+    assert first.get(job["id"])["status"] == RUNNING
+
+
+def test_only_the_claiming_worker_can_finish(tmp_path):
+    session_maker = sqlite_session_maker(tmp_path)
+    owner = JobQueue(session_maker, worker_id="a")
+    other = JobQueue(session_maker, worker_id="b")
+    job_id = owner.submit("LLaMA-7B", {})["id"]
+    owner.claim()
+
+    assert not other.finish(job_id, SUCCEEDED, response="stolen")
+    assert owner.finish(job_id, SUCCEEDED, response="done")
+    assert owner.get(job_id)["response"] == "done"
+    assert owner.get("missing") is None
+
+
+def test_retry_requeues_without_counting_attempt(tmp_path):
+    queue = JobQueue(sqlite_session_maker(tmp_path))
+    job_id = queue.submit("LLaMA-7B", {})["id"]
+    queue.claim()
+    queue.retry(job_id, delay=60)
+
+    job = queue.get(job_id)
+    assert (job["status"], job["attempts"]) == (QUEUED, 0)
+    # Not runnable until the backoff has passed.
+    assert queue.claim() == []
+
+
+def test_expired_leases_are_recovered_then_failed(tmp_path):
+    queue = JobQueue(sqlite_session_maker(tmp_path), lease=-1, max_attempts=2)
+    job_id = queue.submit("LLaMA-7B", {})["id"]
+
+    queue.claim()
+    assert queue.recover_expired() == 1
+    assert queue.get(job_id)["status"] == QUEUED
+
+    queue.claim()
+    queue.recover_expired()
+    job = queue.get(job_id)
+    assert (job["status"], job["status_code"], job["attempts"]) == (FAILED, 500, 2)
+
+
+def test_only_jobs_finished_past_retention_are_pruned(tmp_path, monkeypatch):
+    queue = JobQueue(sqlite_session_maker(tmp_path), retention=3600)
+    old, recent = (queue.submit("LLaMA-7B", {})["id"] for _ in range(2))
+    queue.claim(2)
+    queued = queue.submit("LLaMA-7B", {})["id"]
+    queue.finish(recent, SUCCEEDED, response="kept")
+    monkeypatch.setattr(time, "time", lambda: 0.0)
+    queue.finish(old, FAILED, error="gone")
+    monkeypatch.undo()
+
+    assert queue.prune() == 1
+    assert queue.get(old) is None
+    assert queue.get(recent)["response"] == "kept"
+    assert queue.get(queued)["status"] == QUEUED
+    assert queue.pruned == 1
+    assert JobQueue(queue.session_maker).prune() == 0
+
+
+@pytest.mark.asyncio
+async def test_wait_returns_when_job_finishes(tmp_path):
+    queue = JobQueue(sqlite_session_maker(tmp_path))
+    job_id = queue.submit("LLaMA-7B", {})["id"]
+    queue.claim()
+
+    async def finish_soon():
+        await asyncio.sleep(0.05)
+        queue.finish(job_id, SUCCEEDED, response="ok")
+        queue.notify_finished(job_id)
+
+    start = time.monotonic()
+    finisher = asyncio.create_task(finish_soon())
+    job = await queue.wait(job_id, timeout=5, poll_interval=5)
+    await finisher
+
+    assert job["response"] == "ok"
+    assert time.monotonic() - start < 2
+    # Without a result, the wait gives up after the timeout.
+    pending = queue.submit("LLaMA-7B", {})["id"]
+    assert (await queue.wait(pending, timeout=0.05, poll_interval=0.01))["status"] == QUEUED
+
+
+@pytest.mark.asyncio
+async def test_wait_leaves_nothing_behind(tmp_path):
+    queue = JobQueue(sqlite_session_maker(tmp_path))
+    job_id = queue.submit("LLaMA-7B", {})["id"]
+
+    # Two long-polls on one job; the first to give up keeps the other's event.
+    first = asyncio.create_task(queue.wait(job_id, timeout=0.05, poll_interval=0.01))
+    second = asyncio.create_task(queue.wait(job_id, timeout=0.3, poll_interval=0.3))
+    await first
+    assert job_id in queue._finished
+
+    # Finished by another process, so never notified here.
+    queue.claim()
+    queue.finish(job_id, SUCCEEDED, response="ok")
+    assert (await second)["status"] == SUCCEEDED
+    assert (queue._finished, queue._waiters) == ({}, {})
+
+
+@pytest.mark.asyncio
+async def test_runner_runs_jobs_and_retries(tmp_path):
+    queue = JobQueue(sqlite_session_maker(tmp_path))
+    retried = set()
+
+    async def handler(job):
+        if job["request"]["Prompt"] == "busy" and job["id"] not in retried:
+            retried.add(job["id"])
+            raise JobRetry(0)
+        if job["request"]["Prompt"] == "bad":
+            return {"status": FAILED, "error": "bad flag", "status_code": 422}
+        return {"status": SUCCEEDED, "response": job["request"]["Prompt"].upper()}
+
+    runner = JobRunner(queue, handler, concurrency=2, poll_interval=0.01)
+    ids = [queue.submit("LLaMA-7B", {"Prompt": prompt})["id"] for prompt in ("hi", "bad", "busy")]
+    await runner.start()
+    try:
+        results = [await queue.wait(job_id, timeout=5, poll_interval=0.01) for job_id in ids]
+    finally:
+        await runner.stop()
+
+    assert results[0]["response"] == "HI"
+    assert (results[1]["status"], results[1]["status_code"]) == (FAILED, 422)
+    assert (results[2]["response"], results[2]["attempts"]) == ("BUSY", 1)
+    assert runner.stats()["completed"] == 2
+    assert runner.stats()["retried"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stopping_runner_hands_running_jobs_back(tmp_path):
+    queue = JobQueue(sqlite_session_maker(tmp_path))
+    started = asyncio.Event()
+
+    async def handler(job):
+        started.set()
+        await asyncio.sleep(30)
+
+    runner = JobRunner(queue, handler, concurrency=1, poll_interval=0.01)
+    job_id = queue.submit("LLaMA-7B", {})["id"]
+    await runner.start()
+    await asyncio.wait_for(started.wait(), timeout=5)
+    await runner.stop()
+
+    assert queue.get(job_id)["status"] == QUEUED
@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+import gull_api.db as db
+from gull_api.logserver import LogServer, SocketLogWriter, log_to_record
+
+
+def sqlite_session_maker(tmp_path):
+    return db.get_session_maker(db.create_engine(f"sqlite:///{tmp_path / 'logs.db'}"))
+
+
+def test_log_to_record_skips_unset_columns():
+    log = db.APIRequestLog(request='{"Prompt":"hi"}', error_occurred=False, timestamp=1.5)
+
+    assert log_to_record(log) == {"request": '{"Prompt":"hi"}', "error_occurred": False, "timestamp": 1.5}
+
+
+@pytest.mark.asyncio
+async def test_socket_log_writer_delivers_records_to_log_server(tmp_path):
+    session_maker = sqlite_session_maker(tmp_path)
+    path = str(tmp_path / "log.sock")
+    server = LogServer(path, session_maker, batch_size=10, flush_interval=0.05)
+    writers = [SocketLogWriter(path, batch_size=3, retry_interval=0.01) for _ in range(2)]
+
+    # Records submitted before the log server is up wait for it.
+    for writer in writers:
+        await writer.start()
+    await writers[0].submit(db.APIRequestLog(request="early", error_occurred=False))
+    await asyncio.sleep(0.05)
+    await server.start()
+    for i in range(10):
+        await writers[i % 2].submit(db.APIRequestLog(request=str(i), error_occurred=False, model="7B"))
+    for writer in writers:
+        await writer.stop()
+    # Once stop() returns the server has every record, so nothing is lost if it exits now.
+    assert server.received == 11
+    await server.stop()
+
+    session = session_maker()
+    requests = sorted(log.request for log in session.query(db.APIRequestLog))
+    session.close()
+    assert requests == sorted(["early"] + [str(i) for i in range(10)])
+    assert sum(writer.stats()["sent"] for writer in writers) == 11
+    assert server.log_writer.stats()["written"] == 11
+
+
+@pytest.mark.asyncio
+async def test_log_server_ignores_malformed_lines(tmp_path):
+    session_maker = sqlite_session_maker(tmp_path)
+    path = str(tmp_path / "log.sock")
+    server = LogServer(path, session_maker, flush_interval=0.01)
+    await server.start()
+
+    _, writer = await asyncio.open_unix_connection(path)
+    writer.write(b'not json\n{"unknown_column": 1}\n{"request": "ok"}\n')
+    await writer.drain()
+    writer.close()
+    for _ in range(100):
+        if server.received:
+            break
+        await asyncio.sleep(0.01)
+    await server.stop()
+
+    assert (server.received, server.rejected) == (1, 2)
@@ -0,0 +1,65 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from gull_api import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("test_seconds", "Test histogram.", ("stage",), buckets=(0.1, 1))
+    histogram.observe(0.05, "spawn")
+    histogram.observe(0.5, "spawn")
+    histogram.observe(5, "spawn")
+
+    assert list(histogram.render()) == [
+        "# HELP test_seconds Test histogram.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="spawn",le="0.1"} 1',
+        'test_seconds_bucket{stage="spawn",le="1.0"} 2',
+        'test_seconds_bucket{stage="spawn",le="+Inf"} 3',
+        'test_seconds_sum{stage="spawn"} 5.55',
+        'test_seconds_count{stage="spawn"} 3',
+    ]
+
+
+def test_counter_renders_escaped_labels():
+    counter = metrics.Counter("test_total", "Test counter.", ("model",))
+    counter.inc('LLaMA "7B"')
+    counter.inc('LLaMA "7B"', amount=2)
+
+    assert list(counter.render())[-1] == 'test_total{model="LLaMA \\"7B\\""} 3'
+
+
+def test_gauge_reads_callback_at_render_time():
+    values = {("LLaMA-7B",): 1}
+    gauge = metrics.Gauge("test_active", "Test gauge.", ("model",), lambda: values)
+    values[("LLaMA-7B",)] = 4
+
+    assert list(gauge.render())[-1] == 'test_active{model="LLaMA-7B"} 4'
+
+
+def test_stage_records_duration():
+    before = metrics.stage_duration.count("unit_test_stage")
+    with metrics.stage("unit_test_stage"):
+        pass
+
+    assert metrics.stage_duration.count("unit_test_stage") == before + 1
+
+
+def test_middleware_counts_requests_by_handler_and_status():
+    app = FastAPI()
+    app.add_middleware(metrics.MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    def read_item(item_id: int):
+        metrics.observe_parse()
+        return {"item_id": item_id}
+
+    parse_before = metrics.stage_duration.count("parse")
+    client = TestClient(app)
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/items/oops")
+
+    assert metrics.http_requests.value("read_item", "200") == 2
+    assert metrics.http_requests.value("read_item", "422") == 1
+    assert metrics.http_duration.count("read_item") == 3
+    assert metrics.stage_duration.count("parse") == parse_before + 2
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import sys
+import pytest
+from gull_api.placement import Placement, claim_partition, numa_nodes, parse_cpulist, partition_cores, with_threads
+
+
+def test_parse_cpulist():
+    assert parse_cpulist("0-3,8,10-11\n") == {0, 1, 2, 3, 8, 10, 11}
+    assert parse_cpulist("") == set()
+
+
+def test_numa_nodes_reads_sysfs_layout(tmp_path):
+    for node, cpulist in ((0, "0-3"), (1, "4-7"), (10, "8")):
+        (tmp_path / f"node{node}").mkdir()
+        (tmp_path / f"node{node}" / "cpulist").write_text(cpulist)
+
+    nodes = numa_nodes(str(tmp_path / "node*" / "cpulist"))
+    assert nodes == [{0, 1, 2, 3}, {4, 5, 6, 7}, {8}]
+
+
+def test_slots_stay_within_numa_nodes():
+    placement = Placement(3, cpus=range(8), nodes=[{0, 1, 2, 3}, {4, 5, 6, 7}])
+
+    assert [slot.cpus for slot in placement.slots] == [(0, 1, 2), (4, 5, 6)]
+    assert [slot.node for slot in placement.slots] == [0, 1]
+    assert sum(slot.threads for slot in placement.slots) <= 8
+
+
+def test_slots_without_numa_information():
+    placement = Placement(2, cpus=[0, 1, 2, 3, 4], nodes=[])
+
+    assert [slot.cpus for slot in placement.slots] == [(0, 1), (2, 3)]
+    assert Placement(16, cpus=[0, 1], nodes=[]).slots[0].cpus == (0, 1)
+
+
+@pytest.mark.asyncio
+async def test_processes_wait_for_a_free_slot():
+    placement = Placement(1, cpus=[0, 1], nodes=[])
+    first = await placement.acquire()
+    second = await placement.acquire()
+    third = asyncio.create_task(placement.acquire())
+    await asyncio.sleep(0)
+
+    assert not third.done()
+    assert placement.stats()["busy"] == 2
+    first.release()
+    first.release()
+    lease = await third
+    assert lease.slot is first.slot
+    assert placement.try_acquire() is None
+
+    second.release()
+    lease.release()
+    assert placement.stats()["busy"] == 0
+    assert [slot["uses"] for slot in placement.stats()["occupancy"]] == [2, 1]
+
+
+def test_with_threads_replaces_requested_value():
+    assert with_threads(["./main", "-t", "64", "-n", "10"], "-t", 4) == ["./main", "-n", "10", "-t", "4"]
+    assert with_threads(["./main"], "--threads", 2) == ["./main", "--threads", "2"]
+
+
+@pytest.mark.asyncio
+async def test_lease_pins_process():
+    cpu = min(os.sched_getaffinity(0))
+    placement = Placement(1, cpus=[cpu], nodes=[])
+    lease = await placement.acquire()
+    process = await asyncio.create_subprocess_exec(sys.executable, "-c", "import time; time.sleep(5)")
+    try:
+        lease.pin(process.pid)
+        assert os.sched_getaffinity(process.pid) == {cpu}
+    finally:
+        process.kill()
+        await process.wait()
+        lease.release()
+
+
+def test_partition_cores_gives_workers_disjoint_shares():
+    shares = [partition_cores(range(10), 3, index) for index in range(3)]
+
+    assert shares == [[0, 1, 2], [3, 4, 5], [6, 7, 8]]
+    assert partition_cores([0, 1], 4, 3) == [1]
+
+
+def test_claim_partition_hands_out_each_share_once(tmp_path):
+    first, first_lock = claim_partition(2, str(tmp_path))
+    second, second_lock = claim_partition(2, str(tmp_path))
+    assert (first, second) == (0, 1)
+
+    # Every share is taken: fall back to sharing one.
+    assert claim_partition(2, str(tmp_path))[1] is None
+
+    first_lock.close()
+    again, again_lock = claim_partition(2, str(tmp_path))
+    assert again == 0
+    again_lock.close()
+    second_lock.close()
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import sys
+import pytest
+from gull_api import config
+from gull_api.pool import Worker, WorkerPool, WorkerCrashedError, WorkerReplyTooLarge
+
+ECHO_WORKER = [sys.executable, os.path.join(os.path.dirname(__file__), "..", "echo_worker.py")]
+
+# Answers pings but dies on the first real request.
+CRASHING_WORKER = [sys.executable, "-c", """
+import json, sys
+for line in sys.stdin:
+    if json.loads(line).get("ping"):
+        print(json.dumps({"pong": True}), flush=True)
+    else:
+        sys.exit(3)
+"""]
+
+# Answers with as many bytes of output as the first argument asks for.
+SIZED_WORKER = [sys.executable, "-c", """
+import json, sys
+for line in sys.stdin:
+    size = int(json.loads(line)["argv"][0])
+    print(json.dumps({"stdout": "x" * size, "stderr": "", "returncode": 0}), flush=True)
+"""]
+
+# Never answers anything.
+HANGING_WORKER = [sys.executable, "-c", "import time; time.sleep(60)"]
+
+
+@pytest.mark.asyncio
+async def test_pool_runs_request_on_warm_worker():
+    pool = WorkerPool(ECHO_WORKER, size=1, health_interval=0)
+    await pool.start()
+    try:
+        pid = pool.workers[0].process.pid
+        stdout, stderr, returncode = await pool.run(["-n", "16", "--prompt", "Hello world"], timeout=10)
+        await pool.run(["-n", "16"], timeout=10)
+    finally:
+        await pool.stop()
+
+    assert stdout.endswith('-n 16 --prompt "Hello world"\n')
+    assert (stderr, returncode) == ("", 0)
+    # Both requests were served by the same process.
+    assert pool.workers[0].requests_served == 2
+    assert pool.restarts == 0
+    assert pid is not None
+
+
+@pytest.mark.asyncio
+async def test_pool_recycles_after_max_requests():
+    pool = WorkerPool(ECHO_WORKER, size=1, max_requests=2, health_interval=0)
+    await pool.start()
+    try:
+        first_pid = pool.workers[0].process.pid
+        for _ in range(2):
+            await pool.run([], timeout=10)
+        second_pid = pool.workers[0].process.pid
+    finally:
+        await pool.stop()
+
+    assert first_pid != second_pid
+    assert pool.restarts == 1
+
+
+@pytest.mark.asyncio
+async def test_pool_restarts_crashed_worker():
+    pool = WorkerPool(CRASHING_WORKER, size=1, health_interval=0)
+    await pool.start()
+    try:
+        with pytest.raises(WorkerCrashedError):
+            await pool.run([], timeout=10)
+        assert pool.workers[0].alive
+    finally:
+        await pool.stop()
+
+    assert pool.restarts == 1
+
+
+@pytest.mark.asyncio
+async def test_pool_restarts_worker_on_timeout():
+    pool = WorkerPool(HANGING_WORKER, size=1, health_interval=0)
+    await pool.start()
+    try:
+        pid = pool.workers[0].process.pid
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.run([], timeout=0.1)
+        assert pool.workers[0].process.pid != pid
+    finally:
+        await pool.stop(grace=0)
+
+
+@pytest.mark.asyncio
+async def test_health_check_restarts_unresponsive_worker():
+    pool = WorkerPool(HANGING_WORKER, size=1, health_interval=0, health_timeout=0.1)
+    await pool.start()
+    try:
+        await pool.check_health()
+        assert pool.stats() == {"size": 1, "idle": 1, "alive": 1, "restarts": 1}
+    finally:
+        await pool.stop(grace=0)
+
+
+@pytest.mark.asyncio
+async def test_worker_ping():
+    worker = Worker(ECHO_WORKER)
+    await worker.start()
+    try:
+        assert await worker.ping(timeout=10)
+    finally:
+        await worker.stop()
+
+    assert not worker.alive
+
+
+@pytest.mark.asyncio
+async def test_replies_are_capped_like_captured_output(monkeypatch):
+    monkeypatch.setattr(config, "STDOUT_MAX_BYTES", 100 * 1024)
+    monkeypatch.setattr(config, "STDERR_MAX_BYTES", 1024)
+    monkeypatch.setattr(config, "OUTPUT_SPILL_BYTES", 1024)
+    pool = WorkerPool(SIZED_WORKER, size=1, health_interval=0)
+    await pool.start()
+    try:
+        # Longer than one read and than the cap, but short enough to be read whole.
+        stdout, _, _ = await pool.run(["150000"], timeout=10)
+        assert (len(stdout), stdout.truncated) == (100 * 1024, True)
+        assert not getattr((await pool.run(["100"], timeout=10))[0], "truncated", False)
+
+        with pytest.raises(WorkerReplyTooLarge):
+            await pool.run(["1000000"], timeout=10)
+        assert pool.restarts == 1
+        assert (await pool.run(["10"], timeout=10))[0] == "x" * 10
+    finally:
+        await pool.stop()
@@ -0,0 +1,73 @@
+import pytest
+from gull_api.predictor import RuntimePredictor, request_size, solve
+from gull_api.schema import CompiledSchema
+
+cli_json = {"model": [
+    {"name": "Model", "flag": "-m", "type": "str", "default": "m.bin", "description": ""},
+    {"name": "Maximum length", "flag": "-n", "type": "int", "default": 128, "description": ""},
+    {"name": "Prompt", "flag": "--prompt", "type": "str", "description": "", "required": False},
+    {"name": "Temperature", "flag": "--temp", "type": "float", "default": 0.8, "description": ""},
+]}
+
+
+def test_request_size_reads_length_flag_and_text_lengths():
+    schema = CompiledSchema(cli_json)
+
+    size = request_size(schema, schema.validate({"Prompt": "hello", "Maximum length": 16}))
+
+    assert size == (16, len("m.bin") + len("hello"))
+
+
+def test_request_size_uses_model_length_flag():
+    entry = {"params": cli_json["model"][:2] + [dict(cli_json["model"][3], flag="--tokens", type="int", default=7)],
+             "length_flag": "--tokens"}
+    schema = CompiledSchema({"model": entry})
+
+    assert request_size(schema, schema.validate({}))[0] == 7
+
+
+def test_solve():
+    assert solve([[2.0, 1.0], [1.0, 3.0]], [3.0, 5.0]) == pytest.approx([0.8, 1.4])
+    assert solve([[1.0, 1.0], [1.0, 1.0]], [1.0, 2.0]) is None
+
+
+def test_predicts_nothing_then_mean_then_fitted_line():
+    predictor = RuntimePredictor(decay=1.0, min_samples=4)
+    assert predictor.predict((100, 0)) is None
+
+    predictor.observe((100, 0), 2.0)
+    predictor.observe((300, 0), 4.0)
+    assert predictor.predict((2000, 0)) == pytest.approx(3.0)
+
+    # 1 second to start plus 10ms per token, plus 1ms per prompt character.
+    for tokens, chars in ((500, 100), (1000, 2000), (16, 400)):
+        predictor.observe((tokens, chars), 1 + 0.01 * tokens + 0.001 * chars)
+    predictor.observe((100, 0), 2.0)
+
+    assert predictor.predict((2048, 1000)) == pytest.approx(22.48, rel=0.01)
+    assert predictor.predict((16, 0)) == pytest.approx(1.16, rel=0.05)
+
+
+def test_decay_follows_a_slowdown():
+    predictor = RuntimePredictor(decay=0.8, min_samples=1)
+    for _ in range(20):
+        predictor.observe((128, 0), 1.0)
+    for _ in range(20):
+        predictor.observe((128, 0), 3.0)
+
+    assert predictor.predict((128, 0)) == pytest.approx(3.0, rel=0.05)
+
+
+def test_prediction_error_stats():
+    predictor = RuntimePredictor()
+    predictor.observe((128, 0), 2.0)
+    predictor.observe((128, 0), 2.0, predicted=3.0)
+    predictor.observe((128, 0), 4.0, predicted=3.0)
+
+    stats = predictor.stats()
+
+    assert stats["samples"] == 3
+    assert stats["predictions"] == 2
+    assert stats["mean_abs_error_seconds"] == 1.0
+    assert stats["mean_error_seconds"] == 0.0
+    assert stats["mean_relative_error"] == pytest.approx((0.5 + 0.25) / 2)
@@ -0,0 +1,90 @@
+import os
+import pytest
+from unittest import mock
+from gull_api import prewarm
+from gull_api.prewarm import FAILED, WARM, Prewarmer, model_paths, read_file
+from gull_api.schema import ModelCatalog
+
+
+def catalog_for(model_file):
+    return ModelCatalog({
+        "7B": [
+            {"name": "Model", "flag": "-m", "type": "str", "default": str(model_file), "hidden": True, "description": ""},
+            {"name": "Prompt", "flag": "--prompt", "type": "str", "default": "Once upon a time", "description": ""},
+            {"name": "Maximum length", "flag": "-n", "type": "int", "default": 16, "description": ""},
+        ],
+        "7B-chat": [
+            {"name": "Model", "flag": "-m", "type": "str", "default": str(model_file), "hidden": True, "description": ""},
+        ],
+    })
+
+
+def test_model_paths_are_existing_files_named_by_defaults(tmp_path):
+    model_file = tmp_path / "ggml-model.bin"
+    model_file.write_bytes(b"weights")
+
+    assert model_paths(catalog_for(model_file)) == [os.path.realpath(model_file)]
+    assert model_paths(catalog_for(tmp_path / "missing.bin")) == []
+
+
+def test_read_file_reads_everything(tmp_path):
+    model_file = tmp_path / "ggml-model.bin"
+    model_file.write_bytes(os.urandom(3 * 1024 + 5))
+
+    assert read_file(str(model_file), chunk_size=1024) == 3 * 1024 + 5
+
+
+@pytest.mark.asyncio
+async def test_run_warms_files_then_models(tmp_path):
+    model_file = tmp_path / "ggml-model.bin"
+    model_file.write_bytes(b"weights")
+    warm_up = mock.AsyncMock(return_value=1.5)
+    prewarmer = Prewarmer()
+    assert not prewarmer.ready
+
+    await prewarmer.run(catalog_for(model_file), warm_up)
+
+    assert prewarmer.ready
+    assert prewarmer.files[os.path.realpath(model_file)]["bytes"] == 7
+    assert [call.args[0].name for call in warm_up.call_args_list] == ["7B", "7B-chat"]
+    assert prewarmer.stats()["warm_up_seconds"] == {"7B": 1.5, "7B-chat": 1.5}
+
+
+@pytest.mark.asyncio
+async def test_failed_warm_up_is_not_ready(tmp_path):
+    prewarmer = Prewarmer()
+
+    await prewarmer.run(catalog_for(tmp_path / "missing.bin"), mock.AsyncMock(side_effect=RuntimeError("exit 1")))
+
+    assert prewarmer.state == FAILED
+    assert prewarmer.error == "exit 1"
+    assert not prewarmer.ready
+
+
+@pytest.mark.asyncio
+async def test_lock_failure_still_warms(tmp_path, monkeypatch):
+    model_file = tmp_path / "ggml-model.bin"
+    model_file.write_bytes(b"weights")
+    monkeypatch.setattr(prewarm, "LockedFile", mock.Mock(side_effect=OSError(12, "Cannot allocate memory")))
+    prewarmer = Prewarmer(lock=True)
+
+    await prewarmer.run(catalog_for(model_file))
+
+    assert prewarmer.state == WARM
+    result = prewarmer.files[os.path.realpath(model_file)]
+    assert result["locked"] is False
+    assert "Cannot allocate memory" in result["lock_error"]
+
+
+def test_locked_file_is_released(tmp_path):
+    model_file = tmp_path / "ggml-model.bin"
+    model_file.write_bytes(os.urandom(8192))
+    try:
+        locked = prewarm.LockedFile(str(model_file))
+    except OSError as e:
+        pytest.skip(f"mlock not permitted here: {e}")
+
+    assert locked.address is not None
+    locked.release()
+    locked.release()
+    assert locked.address is None
@@ -0,0 +1,59 @@
+import gzip
+import json
+import os
+import time
+import pytest
+import gull_api.db as db
+from gull_api import config
+from gull_api.retention import LogRetention, compact_log_table
+
+
+@pytest.fixture
+def session_maker(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'LOG_COMPRESS_BYTES', 100)
+    return db.get_session_maker(db.create_engine(f"sqlite:///{tmp_path / 'logs.db'}"))
+
+
+def write_logs(session_maker, timestamps, request="small"):
+    db.write_logs([
+        db.APIRequestLog(request=request, response=f"out {timestamp}", timestamp=timestamp) for timestamp in timestamps
+    ], session_maker)
+
+
+def test_compaction_archives_then_deletes_old_records(session_maker, tmp_path):
+    write_logs(session_maker, [None, 10.0, 20.0, 30.0, 100.0])
+
+    result = compact_log_table(50.0, str(tmp_path / "archive"), session_maker, batch_size=2)
+
+    assert (result["archived"], result["deleted"]) == (4, 4)
+    assert [os.path.basename(path) for path in result["files"]] == [
+        "api_request_log-000000000001-000000000002.jsonl.gz",
+        "api_request_log-000000000003-000000000004.jsonl.gz",
+    ]
+    with gzip.open(result["files"][1], "rt") as f:
+        archived = [json.loads(line) for line in f]
+    assert [(row["id"], row["response"]) for row in archived] == [(3, "out 20.0"), (4, "out 30.0")]
+    assert [log["timestamp"] for log in db.query_logs(session_maker)["logs"]] == [100.0]
+    assert not any(name.endswith(".partial") for name in os.listdir(tmp_path / "archive"))
+
+
+def test_compaction_drops_unreferenced_contents(session_maker):
+    large = "p" * 500
+    now = time.time()
+    write_logs(session_maker, [now - 1000], request=large + "old")
+    write_logs(session_maker, [now - 1000, now + 1000], request=large + "shared")
+
+    result = compact_log_table(now + 1, None, session_maker)
+
+    assert (result["archived"], result["deleted"], result["contents_deleted"]) == (0, 2, 1)
+    assert [log["request"] for log in db.query_logs(session_maker)["logs"]] == [large + "shared"]
+
+
+def test_log_retention_keeps_recent_records(session_maker):
+    write_logs(session_maker, [time.time() - 10 * 86400, time.time()])
+    retention = LogRetention(retention_days=7, session_maker=session_maker)
+
+    retention.run_once()
+
+    assert len(db.query_logs(session_maker)["logs"]) == 1
+    assert (retention.stats()["runs"], retention.stats()["deleted"]) == (1, 1)
@@ -1,3 +1,4 @@
+import os
 import pytest
 from unittest.mock import Mock, patch, ANY
 from gull_api.run_gull_api import create_parser, run_uvicorn, main
@@ -32,9 +33,70 @@ def test_main_function():
             mock_args.workers = 1
             mock_args.reload = False
             mock_args.reload_dir = None
+            mock_args.log_writer = False
+            mock_args.prewarm = False
+            mock_args.warmup_request = None
+            mock_args.dispatch = None
             mock_parse_args.return_value = mock_args
             
             main()
             
             # Assert that the run_uvicorn function was called with the correct arguments
-            mock_run_uvicorn.assert_called_once_with(mock_args, ANY)
\ No newline at end of file
+            mock_run_uvicorn.assert_called_once_with(mock_args, ANY)
+
+def test_main_starts_and_stops_log_writer():
+    with patch.dict(os.environ), \
+            patch('gull_api.run_gull_api.run_uvicorn') as mock_run_uvicorn, \
+            patch('gull_api.run_gull_api.start_log_writer') as mock_start, \
+            patch('gull_api.run_gull_api.stop_log_writer') as mock_stop, \
+            patch('gull_api.run_gull_api.prepare_database') as mock_prepare, \
+            patch('sys.argv', ['gull-api', '--workers', '4', '--log-writer', '--log-socket', '/tmp/gull.sock']):
+        main()
+
+    mock_prepare.assert_called_once_with()
+    mock_start.assert_called_once_with('/tmp/gull.sock')
+    assert mock_run_uvicorn.call_args.args[0].workers == 4
+    mock_run_uvicorn.assert_called_once()
+    mock_stop.assert_called_once_with(mock_start.return_value)
+
+def test_prewarm_options_are_passed_to_workers():
+    with patch.dict(os.environ), \
+            patch('gull_api.run_gull_api.run_uvicorn') as mock_run_uvicorn, \
+            patch('sys.argv', ['gull-api', '--prewarm', '--warmup-request', '{"Prompt": "Hi"}']):
+        main()
+        assert os.environ['PREWARM'] == 'true'
+        assert os.environ['WARMUP_REQUEST'] == '{"Prompt": "Hi"}'
+
+    mock_run_uvicorn.assert_called_once()
+
+def test_dispatch_runs_dispatcher_app():
+    mock_uvicorn = Mock()
+    with patch.dict(os.environ), \
+            patch.dict('sys.modules', {'uvicorn': mock_uvicorn}), \
+            patch('gull_api.run_gull_api.start_log_writer') as mock_start, \
+            patch('sys.argv', ['gull-api', '--log-writer', '--dispatch', 'http://10.0.0.2:8000', 'http://10.0.0.3:8000']):
+        main()
+        assert os.environ['DISPATCH_BACKENDS'] == 'http://10.0.0.2:8000,http://10.0.0.3:8000'
+
+    assert mock_uvicorn.run.call_args.args == ("gull_api.dispatcher:app",)
+    # The dispatcher logs nothing, so it needs no log writer.
+    mock_start.assert_not_called()
+
+def test_prepare_database_creates_schema(tmp_path, monkeypatch):
+    from gull_api import config, db
+    from gull_api.run_gull_api import prepare_database
+    monkeypatch.setattr(config, 'DB_URI', f"sqlite:///{tmp_path / 'new.db'}")
+
+    prepare_database()
+
+    engine = db.create_engine(config.DB_URI)
+    assert db.sqlalchemy.inspect(engine).has_table('api_request_log')
+    engine.dispose()
+
+def test_workers_get_their_own_core_partitions():
+    with patch.dict(os.environ), \
+            patch('gull_api.run_gull_api.run_uvicorn'), \
+            patch('gull_api.run_gull_api.prepare_database'), \
+            patch('sys.argv', ['gull-api', '--workers', '3']):
+        main()
+        assert os.environ['PLACEMENT_WORKERS'] == '3'
@@ -0,0 +1,148 @@
+import json
+import os
+import pytest
+from unittest import mock
+import gull_api.config as config
+from gull_api.schema import (
+    CompiledSchema, ModelCatalog, SchemaRegistry, convert_request_to_cli_command,
+    convert_cli_json_to_api_format, schema_version,
+)
+
+cli_json = {
+    "LLaMA-7B": [
+        {"name": "Model", "type": "str", "flag": "-m", "hidden": True,
+         "default": "models/7B/ggml-model.bin", "description": "Model path"},
+        {"name": "Instruct mode", "type": "bool", "flag": "-ins", "default": False, "description": "Instruct"},
+        {"name": "Maximum length", "type": "int", "flag": "-n", "default": 128, "min": 1, "max": 2048,
+         "description": "Tokens to predict"},
+        {"name": "Prompt", "type": "str", "flag": "--prompt", "required": True, "description": "Provide a prompt"},
+    ]
+}
+
+
+def write_cli_json(path, data, mtime_ns=None):
+    with open(path, "w") as f:
+        json.dump(data, f)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_compiled_schema_matches_uncompiled_helpers():
+    schema = CompiledSchema(cli_json)
+    request = schema.validate({"Prompt": "Hello", "Instruct mode": True})
+
+    assert schema.name == "LLaMA-7B"
+    assert schema.api_json == convert_cli_json_to_api_format(cli_json)
+    assert schema.build_command(request) == convert_request_to_cli_command(request, cli_json)
+
+
+def test_compiled_schema_version_is_content_hash():
+    assert CompiledSchema(cli_json).version == schema_version(cli_json)
+    assert CompiledSchema(cli_json, version="abc").version == "abc"
+
+
+def test_registry_compiles_once(tmp_path):
+    path = tmp_path / "cli.json"
+    write_cli_json(path, cli_json)
+    registry = SchemaRegistry(path=str(path), poll_interval=60)
+
+    with mock.patch("gull_api.schema.CompiledSchema", wraps=CompiledSchema) as compiled:
+        first = registry.get()
+        second = registry.get()
+
+    assert first is second
+    compiled.assert_called_once()
+
+
+def test_registry_reloads_on_change(tmp_path):
+    path = tmp_path / "cli.json"
+    write_cli_json(path, cli_json, mtime_ns=1_000_000_000)
+    registry = SchemaRegistry(path=str(path), poll_interval=0)
+    old = registry.get()
+
+    changed = {"LLaMA-13B": cli_json["LLaMA-7B"]}
+    write_cli_json(path, changed, mtime_ns=2_000_000_000)
+    new = registry.get()
+
+    assert new is not old
+    assert new.default.name == "LLaMA-13B"
+    # A request still holding the old schema is unaffected by the swap.
+    assert old.default.name == "LLaMA-7B"
+
+
+def test_registry_keeps_last_good_schema_on_bad_json(tmp_path):
+    path = tmp_path / "cli.json"
+    write_cli_json(path, cli_json, mtime_ns=1_000_000_000)
+    registry = SchemaRegistry(path=str(path), poll_interval=0)
+    good = registry.get()
+
+    path.write_text("{not json")
+    os.utime(path, ns=(2_000_000_000, 2_000_000_000))
+
+    assert registry.get() is good
+
+
+def test_registry_raises_without_any_schema(tmp_path):
+    registry = SchemaRegistry(path=str(tmp_path / "missing.json"), poll_interval=0)
+
+    with pytest.raises(OSError):
+        registry.get()
+
+
+def test_registry_defaults_to_config_path(monkeypatch, tmp_path):
+    path = tmp_path / "cli.json"
+    write_cli_json(path, cli_json)
+    monkeypatch.setattr(config, "CLI_JSON_PATH", str(path))
+
+    assert SchemaRegistry(poll_interval=0).get().default.name == "LLaMA-7B"
+
+
+def test_catalog_compiles_every_model():
+    catalog = ModelCatalog({
+        "LLaMA-7B": cli_json["LLaMA-7B"],
+        "LLaMA-13B": {"executable": "./main-13b", "max_concurrency": 2, "timeout": 300, "params": cli_json["LLaMA-7B"]},
+    })
+
+    assert list(catalog.models) == ["LLaMA-7B", "LLaMA-13B"]
+    assert catalog.default.name == "LLaMA-7B"
+    assert set(catalog.api_json) == {"LLaMA-7B", "LLaMA-13B"}
+    big = catalog.get("LLaMA-13B")
+    assert big.max_concurrency == 2
+    assert big.timeout == 300
+    assert catalog.default.timeout is None
+    assert big.build_command(big.validate({"Prompt": "Hi"}))[0] == "./main-13b"
+    assert catalog.default.build_command(catalog.default.validate({"Prompt": "Hi"}))[0] == config.EXECUTABLE
+    assert catalog.get("missing") is None
+
+
+def test_registry_loads_directory_of_cli_json(tmp_path):
+    write_cli_json(tmp_path / "a.json", cli_json)
+    write_cli_json(tmp_path / "b.json", {"LLaMA-13B": cli_json["LLaMA-7B"]})
+    (tmp_path / "notes.txt").write_text("ignored")
+    registry = SchemaRegistry(path=str(tmp_path), poll_interval=0)
+
+    assert list(registry.get().models) == ["LLaMA-7B", "LLaMA-13B"]
+
+    write_cli_json(tmp_path / "c.json", {"LLaMA-30B": cli_json["LLaMA-7B"]})
+    assert "LLaMA-30B" in registry.get().models
+
+
+def test_api_document_etag_depends_only_on_content():
+    first = ModelCatalog(cli_json).api_document
+    second = ModelCatalog(cli_json).api_document
+
+    assert first.body == second.body
+    assert (first.etag, first.gzip_body) == (second.etag, second.gzip_body)
+    assert first.matches(f'"other", W/{first.etag}')
+    assert first.matches("*")
+    assert not first.matches('"other"')
+
+
+def test_registry_keeps_catalog_when_file_is_touched_but_unchanged(tmp_path):
+    path = tmp_path / "cli.json"
+    path.write_text(json.dumps(cli_json))
+    registry = SchemaRegistry(path=str(path), poll_interval=0)
+    catalog = registry.get()
+
+    os.utime(path, ns=(0, 0))
+    assert registry.get() is catalog
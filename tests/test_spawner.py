@@ -0,0 +1,77 @@
+import asyncio
+import os
+import sys
+import pytest
+from gull_api import config
+from gull_api.executor import StreamingProcess, capture_output, spawn_process, terminate_process
+from gull_api.spawner import SpawnedProcess, posix_spawn_exec
+
+
+@pytest.mark.asyncio
+async def test_posix_spawn_captures_output_and_returncode():
+    process = await posix_spawn_exec(
+        [sys.executable, "-c", "import sys; print('out'); sys.stderr.write('err'); sys.exit(3)"]
+    )
+
+    stdout, stderr = await capture_output(process)
+
+    assert (process.returncode, stdout.text(), stderr.text()) == (3, "out\n", "err")
+
+
+@pytest.mark.asyncio
+async def test_posix_spawn_starts_a_new_session():
+    process = await posix_spawn_exec([sys.executable, "-c", "import os; print(os.getsid(0))"])
+
+    stdout, _ = await capture_output(process)
+
+    assert int(stdout.text()) == process.pid
+
+
+@pytest.mark.asyncio
+async def test_posix_spawn_missing_executable():
+    with pytest.raises(FileNotFoundError):
+        await posix_spawn_exec(["/nonexistent/llama"])
+
+
+@pytest.mark.asyncio
+async def test_terminate_posix_spawned_process():
+    process = await posix_spawn_exec([sys.executable, "-c", "import time; print('ready', flush=True); time.sleep(30)"])
+    await process.stdout.readline()
+
+    await terminate_process(process, grace=0.2)
+
+    assert process.returncode is not None
+    assert await process.wait() == process.returncode
+
+
+@pytest.mark.asyncio
+async def test_exit_noticed_without_pidfd(monkeypatch):
+    def pidfd_open(pid):
+        raise OSError(38, "Function not implemented")
+    monkeypatch.setattr(os, "pidfd_open", pidfd_open, raising=False)
+
+    process = await posix_spawn_exec([sys.executable, "-c", "print('hi')"])
+    stdout, _ = await capture_output(process)
+
+    assert process._pidfd is None
+    assert (process.returncode, stdout.text()) == (0, "hi\n")
+
+
+@pytest.mark.asyncio
+async def test_spawn_method_selects_launcher(monkeypatch):
+    monkeypatch.setattr(config, "SPAWN_METHOD", "posix_spawn")
+    process = await spawn_process([sys.executable, "-c", "pass"])
+    assert isinstance(process, SpawnedProcess)
+    await process.wait()
+
+    run = StreamingProcess([sys.executable, "-c", "print('streamed')"], timeout=10)
+    await run.start()
+    chunks = [text async for text in run.chunks()]
+
+    assert isinstance(run.process, SpawnedProcess)
+    assert ("".join(chunks), run.returncode) == ("streamed\n", 0)
+
+    monkeypatch.setattr(config, "SPAWN_METHOD", "asyncio")
+    process = await spawn_process([sys.executable, "-c", "pass"])
+    assert isinstance(process, asyncio.subprocess.Process)
+    await process.wait()